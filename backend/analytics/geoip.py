@@ -0,0 +1,198 @@
+"""
+Offline IPv4 geolocation backed by a memory-mapped range database.
+
+The database is a compact sorted-array file built from CSV with the
+``build_geoip_db`` management command:
+
+    header   : magic (4s) | record count (I) | string table offset (I)
+    records  : start (I) | end (I) | country index (I) | city index (I)
+    strings  : count (I) | [length (H) | utf-8 bytes] * count
+
+Records are sorted by ``start`` and never overlap, so a lookup is a binary
+search over fixed-size records read straight from the mapping.
+"""
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b'GEO1'
+HEADER = struct.Struct('<4sII')
+RECORD = struct.Struct('<IIII')
+STRING_COUNT = struct.Struct('<I')
+STRING_LENGTH = struct.Struct('<H')
+MAX_IPV4 = 0xFFFFFFFF
+MAX_STRING_BYTES = 0xFFFF
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def ip_to_int(value):
+    """Convert a dotted or integer IPv4 address to an int, or None"""
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        address = ipaddress.ip_address(value)
+    except ValueError:
+        return None
+    if address.version != 4:
+        return None
+    return int(address)
+
+
+def build_database(csv_path, output_path):
+    """
+    Build a range database from a CSV of ``start_ip,end_ip,country,city``.
+
+    IPs may be dotted quads or integers. Rows that are not IPv4 ranges are
+    skipped; integers past the IPv4 range raise ``ValueError``. Returns the
+    number of ranges written.
+    """
+    strings = {'': 0}
+    ranges = []
+
+    def intern(value, line):
+        value = (value or '').strip()
+        if len(value.encode('utf-8')) > MAX_STRING_BYTES:
+            raise ValueError(f"{csv_path}:{line}: names are limited to {MAX_STRING_BYTES} bytes")
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    with open(csv_path, newline='', encoding='utf-8') as handle:
+        for line, row in enumerate(csv.reader(handle), start=1):
+            if len(row) < 3 or row[0].startswith('#'):
+                continue
+            start, end = ip_to_int(row[0]), ip_to_int(row[1])
+            for value, number in ((row[0], start), (row[1], end)):
+                if number is not None and number > MAX_IPV4:
+                    raise ValueError(f"{csv_path}:{line}: {value.strip()} is not an IPv4 address")
+            if start is None or end is None or start > end:
+                continue
+            city = row[3] if len(row) > 3 else ''
+            ranges.append((start, end, intern(row[2], line), intern(city, line)))
+
+    ranges.sort()
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError(
+                f"Overlapping ranges at {ipaddress.ip_address(current[0])}"
+            )
+
+    string_offset = HEADER.size + RECORD.size * len(ranges)
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        handle.write(HEADER.pack(MAGIC, len(ranges), string_offset))
+        for record in ranges:
+            handle.write(RECORD.pack(*record))
+        handle.write(STRING_COUNT.pack(len(strings)))
+        for value in strings:
+            encoded = value.encode('utf-8')
+            handle.write(STRING_LENGTH.pack(len(encoded)))
+            handle.write(encoded)
+    os.replace(tmp_path, output_path)
+    return len(ranges)
+
+
+class GeoIPDatabase:
+    """Read-only view over a memory-mapped range database"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self.mtime = os.fstat(handle.fileno()).st_mtime
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, string_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a geolocation database")
+        self._strings = self._read_strings(string_offset)
+
+    def _read_strings(self, offset):
+        (count,) = STRING_COUNT.unpack_from(self._map, offset)
+        offset += STRING_COUNT.size
+        strings = []
+        for _ in range(count):
+            (length,) = STRING_LENGTH.unpack_from(self._map, offset)
+            offset += STRING_LENGTH.size
+            strings.append(self._map[offset:offset + length].decode('utf-8'))
+            offset += length
+        return strings
+
+    def _record(self, index):
+        return RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+
+    def find_range(self, ip_int):
+        """Return ``(start, end, country, city)`` for the range holding the IP"""
+        low, high = 0, self.count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            start, end, country, city = self._record(middle)
+            if ip_int < start:
+                high = middle - 1
+            elif ip_int > end:
+                low = middle + 1
+            else:
+                return start, end, self._strings[country], self._strings[city]
+        return None
+
+    def lookup(self, ip):
+        """Return ``(country, city)`` for an IP, or None if unknown"""
+        ip_int = ip_to_int(ip)
+        if ip_int is None:
+            return None
+        found = self.find_range(ip_int)
+        if found is None:
+            return None
+        return found[2], found[3]
+
+    def close(self):
+        self._map.close()
+
+
+def get_database(path):
+    """
+    Return a shared database for ``path``, or None if the file is missing.
+
+    A rebuilt file replaces the database. The old one is not closed, since
+    other threads may still be looking IPs up in it: its mapping is
+    released when the last of them drops it.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with _databases_lock:
+        mtime = os.path.getmtime(path)
+        database = _databases.get(path)
+        if database is None or database.mtime != mtime:
+            database = GeoIPDatabase(path)
+            _databases[path] = database
+        return database
+
+
+class PrefixCache:
+    """
+    Per-/24 lookup cache.
+
+    A result is only cached for the prefix when its range covers the whole
+    /24, so ranges narrower than a /24 are always resolved exactly.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._prefixes = {}
+
+    def lookup(self, ip):
+        ip_int = ip_to_int(ip)
+        if ip_int is None:
+            return None
+        prefix = ip_int & 0xFFFFFF00
+        if prefix in self._prefixes:
+            return self._prefixes[prefix]
+        found = self.database.find_range(ip_int)
+        result = (found[2], found[3]) if found else None
+        if found and found[0] <= prefix and found[1] >= prefix | 0xFF:
+            self._prefixes[prefix] = result
+        return result
@@ -0,0 +1,29 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.geoip import build_database
+
+
+class Command(BaseCommand):
+    help = "Build the offline geolocation database from a start_ip,end_ip,country,city CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help="CSV file of IPv4 ranges")
+        parser.add_argument(
+            '--output',
+            default=settings.GEOIP_DATABASE_PATH,
+            help="Where to write the database (defaults to GEOIP_DATABASE_PATH)"
+        )
+
+    def handle(self, *args, **options):
+        os.makedirs(os.path.dirname(options['output']) or '.', exist_ok=True)
+        try:
+            count = build_database(options['csv_path'], options['output'])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} ranges to {options['output']}"
+        ))
@@ -23,3 +23,18 @@ class DailyAnalytics(models.Model):
     
     def __str__(self):
         return f"{self.url.short_code} - {self.date}: {self.clicks} clicks"
+
+
+class ExportWatermark(models.Model):
+    """Last click exported by an incremental export job"""
+    
+    name = models.CharField(max_length=100, unique=True)
+    last_click_id = models.BigIntegerField(default=0)
+    last_exported_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'export_watermarks'
+    
+    def __str__(self):
+        return f"{self.name}: click {self.last_click_id}"
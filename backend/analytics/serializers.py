@@ -3,14 +3,17 @@ from rest_framework import serializers
 
 class DashboardStatsSerializer(serializers.Serializer):
     """Serializer for dashboard statistics response"""
-    total_urls = serializers.IntegerField()
-    total_clicks = serializers.IntegerField()
-    total_unique_visitors = serializers.IntegerField()
-    clicks_today = serializers.IntegerField()
-    clicks_this_week = serializers.IntegerField()
+    total_urls = serializers.IntegerField(allow_null=True)
+    total_clicks = serializers.IntegerField(allow_null=True)
+    total_unique_visitors = serializers.IntegerField(allow_null=True)
+    clicks_today = serializers.IntegerField(allow_null=True)
+    clicks_this_week = serializers.IntegerField(allow_null=True)
     top_urls = serializers.ListField(
         child=serializers.DictField()
     )
+    degraded = serializers.BooleanField(
+        help_text="Some queries timed out; their figures are null"
+    )
 
 
 class TrendsSerializer(serializers.Serializer):
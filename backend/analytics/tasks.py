@@ -1,42 +1,59 @@
 from celery import shared_task
-from django.db.models import Count
+from django.db.models import Count, Sum
 from django.utils import timezone
 from datetime import timedelta
 import logging
 
+from config.sharding import each_shard, fan_out
+
 logger = logging.getLogger(__name__)
 
+# Modification time of the GeoIP database unresolved clicks were last tried against
+GEOIP_VERSION_KEY = 'geoip:retried_version'
+
 
 @shared_task
 def aggregate_analytics():
     """Aggregate click data into daily analytics"""
     try:
+        from shortener.conditional import bump
         from shortener.models import Click
         from .models import DailyAnalytics
         
         yesterday = timezone.now().date() - timedelta(days=1)
         
-        # Aggregate clicks by URL for yesterday
-        daily_stats = Click.objects.filter(
-            clicked_at__date=yesterday
-        ).values('url').annotate(
-            clicks=Count('id'),
-            unique_visitors=Count('session_id', distinct=True)
-        )
-        
-        # Update or create daily analytics records
-        for stat in daily_stats:
-            DailyAnalytics.objects.update_or_create(
-                url_id=stat['url'],
-                date=yesterday,
-                defaults={
-                    'clicks': stat['clicks'],
-                    'unique_visitors': stat['unique_visitors']
-                }
+        aggregated = 0
+        # Rollups are stored on the shard of their URL's clicks
+        for _ in each_shard():
+            # Aggregate clicks by URL for yesterday
+            # Sampled rows carry a weight; visitors are scaled by the mean
+            # weight of the URL's rows
+            daily_stats = Click.objects.filter(
+                clicked_at__date=yesterday
+            ).values('url').annotate(
+                clicks=Sum('weight'),
+                rows=Count('id'),
+                unique_visitors=Count('session_id', distinct=True)
             )
+            
+            # Update or create daily analytics records
+            for stat in daily_stats:
+                DailyAnalytics.objects.update_or_create(
+                    url_id=stat['url'],
+                    date=yesterday,
+                    defaults={
+                        'clicks': stat['clicks'],
+                        'unique_visitors': round(
+                            stat['unique_visitors'] * stat['clicks'] / stat['rows']
+                        )
+                    }
+                )
+            aggregated += len(daily_stats)
         
-        logger.info(f"Aggregated analytics for {len(daily_stats)} URLs")
-        return len(daily_stats)
+        bump('rollups')
+        
+        logger.info(f"Aggregated analytics for {aggregated} URLs")
+        return aggregated
         
     except Exception as exc:
         logger.error(f"Error aggregating analytics: {exc}")
@@ -53,9 +70,11 @@ def cleanup_old_analytics():
         retention_days = settings.ANALYTICS_RETENTION_DAYS
         cutoff_date = timezone.now() - timedelta(days=retention_days)
         
-        deleted_count = Click.objects.filter(
-            clicked_at__lt=cutoff_date
-        ).delete()[0]
+        deleted_count = 0
+        for _ in each_shard():
+            deleted_count += Click.objects.filter(
+                clicked_at__lt=cutoff_date
+            ).delete()[0]
         
         logger.info(f"Deleted {deleted_count} old click records")
         return deleted_count
@@ -75,12 +94,20 @@ def update_url_rankings():
         # Get top URLs by clicks in last 7 days
         week_ago = timezone.now() - timedelta(days=7)
         
-        top_urls = URL.objects.filter(
-            is_active=True,
-            click_records__clicked_at__gte=week_ago
-        ).annotate(
-            recent_clicks=Count('click_records')
-        ).order_by('-recent_clicks')[:100]
+        def shard_top_urls(alias):
+            return list(URL.objects.filter(
+                is_active=True,
+                click_records__clicked_at__gte=week_ago
+            ).annotate(
+                recent_clicks=Sum('click_records__weight')
+            ).order_by('-recent_clicks')[:100])
+        
+        # The top 100 of every shard holds the overall top 100
+        top_urls = sorted(
+            (url for urls in fan_out(shard_top_urls).values() for url in urls),
+            key=lambda url: url.recent_clicks,
+            reverse=True
+        )[:100]
         
         # Cache the rankings
         rankings = [
@@ -100,3 +127,92 @@ def update_url_rankings():
     except Exception as exc:
         logger.error(f"Error updating rankings: {exc}")
         raise
+
+
+@shared_task
+def enrich_click_geolocation(batch_size=1000, max_batches=50):
+    """Resolve country/city for unenriched clicks from the offline database"""
+    try:
+        from django.conf import settings
+        from django.core.cache import cache
+        from shortener.conditional import bump
+        from shortener.models import Click
+        from .geoip import get_database, PrefixCache
+        
+        database = get_database(settings.GEOIP_DATABASE_PATH)
+        if database is None:
+            logger.warning(
+                f"GeoIP database not found at {settings.GEOIP_DATABASE_PATH}"
+            )
+            return 0
+        
+        prefix_cache = PrefixCache(database)
+        enriched = 0
+        # Clicks no database resolved are retried once a new one is built
+        retry_unresolved = cache.get(GEOIP_VERSION_KEY) != database.mtime
+        
+        for shard in each_shard():
+            if retry_unresolved:
+                Click.objects.filter(country='', ip_address__isnull=False).update(
+                    country=None,
+                    city=None
+                )
+            for _ in range(max_batches):
+                batch = list(
+                    Click.objects.filter(country__isnull=True)
+                    .order_by('id')
+                    .values_list('id', 'ip_address')[:batch_size]
+                )
+                if not batch:
+                    break
+                
+                # Group click ids by location so each batch is a few UPDATEs.
+                # Unresolvable IPs get empty strings so they are not retried
+                # until the database changes.
+                by_location = {}
+                for click_id, ip_address in batch:
+                    location = prefix_cache.lookup(ip_address) if ip_address else None
+                    by_location.setdefault(location or ('', ''), []).append(click_id)
+                
+                for (country, city), click_ids in by_location.items():
+                    Click.objects.filter(id__in=click_ids).update(
+                        country=country,
+                        city=city
+                    )
+                enriched += len(batch)
+        
+        cache.set(GEOIP_VERSION_KEY, database.mtime, None)
+        if enriched:
+            bump('clicks')
+        
+        logger.info(f"Enriched geolocation for {enriched} clicks")
+        return enriched
+        
+    except Exception as exc:
+        logger.error(f"Error enriching click geolocation: {exc}")
+        raise
+
+
+@shared_task
+def export_clicks_columnar(export_format='parquet'):
+    """Incrementally export new clicks to the columnar warehouse drop"""
+    try:
+        from django.conf import settings
+        from .exports import export_clicks
+        
+        rows, paths = 0, []
+        for _ in each_shard():
+            shard_rows, shard_paths = export_clicks(
+                settings.CLICK_EXPORT_DIR,
+                export_format=export_format,
+                chunk_size=settings.CLICK_EXPORT_CHUNK_SIZE
+            )
+            rows += shard_rows
+            paths += shard_paths
+        
+        logger.info(f"Exported {rows} clicks to {len(paths)} {export_format} files")
+        return rows
+        
+    except Exception as exc:
+        logger.error(f"Error exporting clicks: {exc}")
+        raise
@@ -0,0 +1,124 @@
+"""
+Tests for columnar click export
+"""
+import pytest
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.utils import timezone
+from django.db import connection
+from analytics.exports import export_clicks, iter_click_rows
+from analytics.models import ExportWatermark
+from config.sharding import on_shard
+from shortener.dimensions import browser_id
+from shortener.models import URL, Click
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+def backdate(click, **delta):
+    """Move a click into the past, past the watermark safety lag"""
+    Click.objects.filter(pk=click.pk).update(
+        clicked_at=timezone.now() - timedelta(**delta)
+    )
+
+
+@pytest.mark.django_db
+class TestExportClicks:
+    """Tests for export_clicks"""
+
+    def test_partitioned_parquet_export(self, tmp_path, sample_url):
+        """Test clicks are written per date with dictionary-encoded columns"""
+        today = Click.objects.create(url=sample_url, ip_address='10.0.0.1', browser_id=browser_id('Chrome'))
+        older = Click.objects.create(url=sample_url, ip_address='10.0.0.2', browser_id=browser_id('Firefox'))
+        backdate(today, minutes=5)
+        backdate(older, days=2)
+
+        rows, paths = export_clicks(str(tmp_path), chunk_size=1)
+
+        assert rows == 2
+        assert len(paths) == 2
+        table = pq.read_table(paths[0])
+        assert pa.types.is_dictionary(table.schema.field('browser').type)
+        assert table.column('ip_address').to_pylist() == ['10.0.0.1']
+
+    def test_export_is_incremental(self, tmp_path, sample_url):
+        """Test a second run only exports clicks past the watermark"""
+        first = Click.objects.create(url=sample_url)
+        backdate(first, minutes=5)
+        export_clicks(str(tmp_path), export_format='arrow')
+
+        second = Click.objects.create(url=sample_url)
+        backdate(second, minutes=5)
+        rows, paths = export_clicks(str(tmp_path), export_format='arrow')
+
+        assert rows == 1
+        with pa.ipc.open_file(paths[0]) as reader:
+            assert reader.read_all().column('id').to_pylist() == [second.id]
+        assert ExportWatermark.objects.get(name='clicks_arrow').last_click_id == second.id
+
+    def test_range_export_keeps_watermark(self, tmp_path, sample_url):
+        """Test a backfill of a recent window leaves older clicks to the incremental run"""
+        older = Click.objects.create(url=sample_url)
+        recent = Click.objects.create(url=sample_url)
+        backdate(older, days=3)
+        backdate(recent, minutes=5)
+
+        rows, paths = export_clicks(
+            str(tmp_path), start=timezone.now() - timedelta(days=1), export_format='arrow'
+        )
+        assert rows == 1
+        assert 'clicks-range-' in paths[0]
+        assert not ExportWatermark.objects.filter(name='clicks_arrow').exists()
+
+        rows, paths = export_clicks(str(tmp_path), export_format='arrow')
+
+        exported = []
+        for path in paths:
+            with pa.ipc.open_file(path) as reader:
+                exported += reader.read_all().column('id').to_pylist()
+        assert sorted(exported) == [older.id, recent.id]
+
+    def test_recent_clicks_wait_for_safety_lag(self, tmp_path, sample_url):
+        """Test clicks inside the safety lag are left for the next run"""
+        Click.objects.create(url=sample_url)
+
+        rows, paths = export_clicks(str(tmp_path))
+
+        assert rows == 0
+        assert paths == []
+
+
+@pytest.mark.django_db(databases='__all__')
+class TestExportCommand:
+    """Tests for manage.py export_clicks"""
+
+    def test_exports_every_shard(self, tmp_path, shards):
+        """Test clicks on every shard are exported, each under its own watermark"""
+        for alias in shards:
+            with on_shard(alias):
+                url = URL.objects.create(original_url='https://www.example.com', short_code=f'x{alias}')
+                backdate(url.click_records.create(), minutes=5)
+
+        out = StringIO()
+        call_command('export_clicks', output=str(tmp_path), format='arrow', watermark='nightly', stdout=out)
+
+        assert 'Exported 3 clicks to 3 files' in out.getvalue()
+        assert set(ExportWatermark.objects.values_list('name', flat=True)) == {
+            'nightly', 'nightly_shard_1', 'nightly_shard_2'
+        }
+
+
+@pytest.mark.django_db
+class TestIterClickRows:
+    """Tests for iter_click_rows"""
+
+    def test_keyset_pages_without_server_side_cursors(self, monkeypatch, sample_url):
+        """Test rows are paged by id when server-side cursors are disabled"""
+        clicks = [Click.objects.create(url=sample_url) for _ in range(5)]
+        monkeypatch.setitem(connection.settings_dict, 'DISABLE_SERVER_SIDE_CURSORS', True)
+
+        rows = list(iter_click_rows(Click.objects.all(), fields=['id'], chunk_size=2))
+
+        assert rows == [(click.id,) for click in clicks]
@@ -0,0 +1,120 @@
+"""
+Tests for offline geolocation enrichment
+"""
+import gc
+import os
+import weakref
+import pytest
+from analytics.geoip import GeoIPDatabase, PrefixCache, build_database, get_database
+from analytics.tasks import enrich_click_geolocation
+from shortener.models import Click
+
+
+@pytest.fixture
+def geoip_path(tmp_path):
+    """Build a small range database"""
+    csv_path = tmp_path / 'ranges.csv'
+    csv_path.write_text(
+        '10.0.0.0,10.0.0.255,US,New York\n'
+        '10.0.1.0,10.0.1.127,GB,London\n'
+        '10.0.1.128,10.0.1.255,FR,Paris\n'
+        '3232235776,3232236031,DE,Berlin\n'  # 192.168.1.0/24 as integers
+    )
+    output = tmp_path / 'ipv4.bin'
+    build_database(str(csv_path), str(output))
+    return str(output)
+
+
+class TestGeoIPDatabase:
+    """Tests for the memory-mapped range database"""
+
+    def test_lookup(self, geoip_path):
+        """Test binary search resolves IPs inside ranges"""
+        database = GeoIPDatabase(geoip_path)
+
+        assert database.lookup('10.0.0.17') == ('US', 'New York')
+        assert database.lookup('10.0.1.200') == ('FR', 'Paris')
+        assert database.lookup('192.168.1.1') == ('DE', 'Berlin')
+        assert database.lookup('8.8.8.8') is None
+        assert database.lookup('::1') is None
+
+    def test_prefix_cache_respects_narrow_ranges(self, geoip_path):
+        """Test /24 caching does not leak across ranges narrower than /24"""
+        prefix_cache = PrefixCache(GeoIPDatabase(geoip_path))
+
+        assert prefix_cache.lookup('10.0.1.1') == ('GB', 'London')
+        assert prefix_cache.lookup('10.0.1.129') == ('FR', 'Paris')
+
+    def test_overlapping_ranges_rejected(self, tmp_path):
+        """Test building fails on overlapping ranges"""
+        csv_path = tmp_path / 'ranges.csv'
+        csv_path.write_text('10.0.0.0,10.0.0.255,US\n10.0.0.128,10.0.1.0,GB\n')
+
+        with pytest.raises(ValueError):
+            build_database(str(csv_path), str(tmp_path / 'ipv4.bin'))
+
+    def test_out_of_range_ip_rejected(self, tmp_path):
+        """Test integers past the IPv4 range fail the build with the line"""
+        csv_path = tmp_path / 'ranges.csv'
+        csv_path.write_text('10.0.0.0,10.0.0.255,US\n4294967296,4294967400,GB\n')
+
+        with pytest.raises(ValueError, match=r'ranges.csv:2: 4294967296 is not an IPv4 address'):
+            build_database(str(csv_path), str(tmp_path / 'ipv4.bin'))
+
+    def test_reload_releases_previous(self, geoip_path):
+        """Test a rebuilt file replaces the shared database; the old one serves its readers until dropped"""
+        old = get_database(geoip_path)
+        assert get_database(geoip_path) is old
+
+        os.utime(geoip_path, (old.mtime + 10, old.mtime + 10))
+        new = get_database(geoip_path)
+
+        assert new is not old
+        assert old.lookup('10.0.0.17') == ('US', 'New York')
+        released = weakref.ref(old)
+        del old
+        gc.collect()
+        assert released() is None
+
+
+@pytest.mark.django_db
+class TestEnrichClickGeolocation:
+    """Tests for enrich_click_geolocation task"""
+
+    def test_enriches_unresolved_clicks(self, settings, geoip_path, sample_url):
+        """Test clicks get country/city and unknown IPs are not retried"""
+        settings.GEOIP_DATABASE_PATH = geoip_path
+        known = Click.objects.create(url=sample_url, ip_address='10.0.0.5')
+        unknown = Click.objects.create(url=sample_url, ip_address='8.8.8.8')
+
+        assert enrich_click_geolocation() == 2
+
+        known.refresh_from_db()
+        unknown.refresh_from_db()
+        assert (known.country, known.city) == ('US', 'New York')
+        assert unknown.country == ''
+        assert enrich_click_geolocation() == 0
+
+    def test_missing_database(self, settings, tmp_path, sample_url):
+        """Test the task is a no-op without a database"""
+        settings.GEOIP_DATABASE_PATH = str(tmp_path / 'missing.bin')
+        Click.objects.create(url=sample_url, ip_address='10.0.0.5')
+
+        assert enrich_click_geolocation() == 0
+
+    def test_unresolved_retried_with_new_database(self, settings, geoip_path, sample_url):
+        """Test clicks no database resolved are tried again once it is rebuilt"""
+        settings.GEOIP_DATABASE_PATH = geoip_path
+        click = Click.objects.create(url=sample_url, ip_address='8.8.8.8')
+        enrich_click_geolocation()
+
+        csv_path = os.path.join(os.path.dirname(geoip_path), 'ranges.csv')
+        with open(csv_path, 'a') as handle:
+            handle.write('8.8.8.0,8.8.8.255,US,Mountain View\n')
+        build_database(csv_path, geoip_path)
+        mtime = os.path.getmtime(geoip_path) + 10
+        os.utime(geoip_path, (mtime, mtime))
+
+        assert enrich_click_geolocation() == 1
+        click.refresh_from_db()
+        assert (click.country, click.city) == ('US', 'Mountain View')
@@ -0,0 +1,47 @@
+"""
+Query and cache budgets for the analytics endpoints
+
+Re-record after an intended change with ``pytest --record-query-budgets``.
+"""
+import pytest
+from datetime import timedelta
+from django.utils import timezone
+from analytics.models import DailyAnalytics
+from shortener.models import URL, Click
+
+
+@pytest.fixture
+def history(db):
+    """URLs with clicks and a month of daily aggregates"""
+    today = timezone.now().date()
+    for i in range(5):
+        url = URL.objects.create(
+            original_url=f'https://www.example.com/{i}',
+            short_code=f'trend{i}',
+            clicks=10 * i
+        )
+        Click.objects.create(url=url, ip_address='127.0.0.1', session_id='s')
+        for days_ago in range(30):
+            DailyAnalytics.objects.create(
+                url=url,
+                date=today - timedelta(days=days_ago),
+                clicks=i,
+                unique_visitors=i
+            )
+
+
+@pytest.mark.django_db
+class TestAnalyticsBudgets:
+    """Test analytics views stay within their query budgets"""
+
+    def test_dashboard(self, api_client, history, query_budget):
+        """Test the dashboard totals"""
+        with query_budget(queries=6, cache=2):
+            response = api_client.get('/api/analytics/dashboard/')
+        assert len(response.data['top_urls']) == 5
+
+    def test_trends(self, api_client, history, query_budget):
+        """Test the daily trends"""
+        with query_budget(queries=1, cache=2):
+            response = api_client.get('/api/analytics/trends/?days=30')
+        assert len(response.data['trends']) == 30
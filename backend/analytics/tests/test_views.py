@@ -34,6 +34,20 @@ class TestDashboardStatsView:
         
         assert response.status_code == status.HTTP_200_OK
         assert response.data['total_urls'] >= 1
+        assert response.data['degraded'] is False
+    
+    def test_dashboard_stats_degraded(self, api_client, sample_url, settings):
+        """Test figures that time out are null and the response is not cached"""
+        settings.QUERY_TIMEOUT_SECONDS = 0
+        
+        response = api_client.get(reverse('dashboard-stats'))
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['degraded'] is True
+        assert response.data['total_urls'] is None
+        assert response.data['top_urls'] == []
+        assert 'ETag' not in response
+        assert 'no-store' in response['Cache-Control']
 
 
 @pytest.mark.django_db
@@ -3,7 +3,14 @@ from rest_framework.response import Response
 from django.db.models import Sum, Count
 from django.utils import timezone
 from datetime import timedelta
+from functools import partial
+from operator import itemgetter
+from django.conf import settings
 from drf_spectacular.utils import extend_schema
+from config.concurrency import run_parallel
+from config.routers import read_from_replica
+from config.sharding import fan_out, on_shard, shards
+from shortener.conditional import conditional, dashboard_freshness, trends_freshness
 from shortener.models import URL, Click
 from .models import DailyAnalytics
 from .serializers import DashboardStatsSerializer, TrendsSerializer
@@ -17,50 +24,78 @@ class DashboardStatsView(generics.GenericAPIView):
         responses={200: DashboardStatsSerializer},
         description="Get dashboard statistics including total URLs, clicks, and top URLs"
     )
+    @read_from_replica
+    @conditional(dashboard_freshness, 'dashboard')
     def get(self, request):
+        # Every figure of every shard is one query, all run in parallel;
+        # figures a shard did not answer in time are left out
+        results = run_parallel(
+            {
+                (alias, name): partial(self.run_on, alias, query)
+                for alias in shards()
+                for name, query in self.queries.items()
+            },
+            timeout=settings.QUERY_TIMEOUT_SECONDS
+        )
+        
+        def answers(name):
+            return [results[alias, name] for alias in shards() if (alias, name) in results]
+        
+        # Totals are only given when every shard answered
+        figures = {}
+        for name in self.queries:
+            found = answers(name)
+            if name != 'top_urls':
+                figures[name] = sum(found) if len(found) == len(shards()) else None
+        
+        # Top URLs across the shards that answered
+        figures['top_urls'] = sorted(
+            (url for urls in answers('top_urls') for url in urls),
+            key=itemgetter('clicks'),
+            reverse=True
+        )[:5]
+        
+        return Response({**figures, 'degraded': results.degraded})
+    
+    @staticmethod
+    def run_on(alias, query):
+        with on_shard(alias):
+            return query()
+    
+    queries = {
         # Total URLs
-        total_urls = URL.objects.filter(is_active=True).count()
+        'total_urls': lambda: URL.objects.filter(is_active=True).count(),
         
         # Total clicks
-        total_clicks = URL.objects.filter(is_active=True).aggregate(
+        'total_clicks': lambda: URL.objects.filter(is_active=True).aggregate(
             total=Sum('clicks')
-        )['total'] or 0
+        )['total'] or 0,
         
         # Total unique visitors
-        total_unique = URL.objects.filter(is_active=True).aggregate(
+        'total_unique_visitors': lambda: URL.objects.filter(is_active=True).aggregate(
             total=Sum('unique_clicks')
-        )['total'] or 0
+        )['total'] or 0,
         
         # Clicks today
-        today = timezone.now().date()
-        clicks_today = Click.objects.filter(
-            clicked_at__date=today
-        ).count()
+        'clicks_today': lambda: Click.objects.filter(
+            clicked_at__date=timezone.now().date()
+        ).aggregate(total=Sum('weight'))['total'] or 0,
         
         # Clicks this week
-        week_ago = timezone.now() - timedelta(days=7)
-        clicks_week = Click.objects.filter(
-            clicked_at__gte=week_ago
-        ).count()
+        'clicks_this_week': lambda: Click.objects.filter(
+            clicked_at__gte=timezone.now() - timedelta(days=7)
+        ).aggregate(total=Sum('weight'))['total'] or 0,
         
         # Top URLs
-        top_urls = URL.objects.filter(
+        'top_urls': lambda: list(URL.objects.filter(
             is_active=True
         ).order_by('-clicks')[:5].values(
             'short_code',
             'original_url',
             'clicks',
             'title'
-        )
-        
-        return Response({
-            'total_urls': total_urls,
-            'total_clicks': total_clicks,
-            'total_unique_visitors': total_unique,
-            'clicks_today': clicks_today,
-            'clicks_this_week': clicks_week,
-            'top_urls': list(top_urls)
-        })
+        )),
+    }
 
 
 class TrendsView(generics.GenericAPIView):
@@ -71,19 +106,32 @@ class TrendsView(generics.GenericAPIView):
         responses={200: TrendsSerializer},
         description="Get click trends over a specified time period"
     )
+    @read_from_replica
+    @conditional(trends_freshness, 'trends')
     def get(self, request):
         days = int(request.query_params.get('days', 30))
         start_date = timezone.now().date() - timedelta(days=days)
         
-        # Daily trends
-        daily_trends = DailyAnalytics.objects.filter(
-            date__gte=start_date
-        ).values('date').annotate(
-            total_clicks=Sum('clicks'),
-            total_unique=Sum('unique_visitors')
-        ).order_by('date')
+        # Daily trends, summed over every shard's rollups
+        def shard_trends(alias):
+            return list(DailyAnalytics.objects.filter(
+                date__gte=start_date
+            ).values('date').annotate(
+                total_clicks=Sum('clicks'),
+                total_unique=Sum('unique_visitors')
+            ).order_by('date'))
+        
+        daily_trends = {}
+        for rows in fan_out(shard_trends).values():
+            for row in rows:
+                day = daily_trends.setdefault(
+                    row['date'],
+                    {'date': row['date'], 'total_clicks': 0, 'total_unique': 0}
+                )
+                day['total_clicks'] += row['total_clicks']
+                day['total_unique'] += row['total_unique']
         
         return Response({
             'period_days': days,
-            'trends': list(daily_trends)
+            'trends': [daily_trends[date] for date in sorted(daily_trends)]
         })
@@ -28,6 +28,40 @@ app.conf.beat_schedule = {
         'task': 'analytics.tasks.update_url_rankings',
         'schedule': crontab(minute='*/30'),  # Every 30 minutes
     },
+    'expire-due-urls': {
+        'task': 'shortener.tasks.expire_due_urls',
+        'schedule': crontab(),  # Every minute, only touches URLs that are due
+    },
+    'cleanup-expired-urls': {
+        'task': 'shortener.tasks.cleanup_expired_urls',
+        'schedule': crontab(hour=4, minute=0),  # Daily backstop for the scheduler
+    },
+    'ensure-url-cache-warm': {
+        'task': 'shortener.tasks.warm_url_cache_task',
+        'schedule': crontab(),  # Every minute, no-op unless Redis was flushed
+        'kwargs': {'if_cold': True},
+    },
+    'enrich-click-geolocation': {
+        'task': 'analytics.tasks.enrich_click_geolocation',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
+    'ensure-short-code-filter': {
+        'task': 'shortener.tasks.rebuild_short_code_filter',
+        'schedule': crontab(minute='*/5'),  # No-op unless Redis lost the filter
+        'kwargs': {'if_missing': True},
+    },
+    'rebuild-short-code-filter': {
+        'task': 'shortener.tasks.rebuild_short_code_filter',
+        'schedule': crontab(hour=3, minute=30),  # Daily, drops deleted codes
+    },
+    'publish-edge-redirects': {
+        'task': 'shortener.tasks.publish_edge_redirects',
+        'schedule': crontab(),  # Every minute; rewrites the map only on change
+    },
+    'ingest-edge-clicks': {
+        'task': 'shortener.tasks.ingest_edge_clicks',
+        'schedule': 10.0,  # Every 10 seconds, no-op without edge click logs
+    },
 }
 
 
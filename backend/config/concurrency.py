@@ -0,0 +1,168 @@
+"""
+Running independent database queries in parallel.
+
+``run_parallel`` runs named callables on a shared thread pool and waits
+for them until a deadline. Queries that miss it are left out of the
+returned ``Results``, which are then ``degraded``, so a view can answer
+with what it has instead of waiting for the sum of the latencies. On
+PostgreSQL a worker's statements carry a ``statement_timeout`` of the
+time left, so the server cancels one still running at the deadline and
+the thread is free again; elsewhere an abandoned query's thread finishes
+its statement and stops at its next one (``QueryTimeout``).
+
+Each pool has its own threads (``POOL_SIZES``): the shard fan-out does
+not wait behind slow dashboard queries, nor they behind it.
+
+Workers see the caller's routing state (replica reads, primary pinning,
+the selected shard) through the thread-locals registered with
+``propagate``, and keep their connections across tasks the way request
+threads do, within ``CONN_MAX_AGE``. Inside a transaction, whose
+uncommitted rows other connections cannot see, and inside a worker, the
+queries run one after another in the calling thread, against the same
+deadline.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connections
+
+# Thread pools by name, and the setting with their size
+POOL_SIZES = {
+    'query': 'QUERY_POOL_SIZE',
+    'shard': 'SHARD_POOL_SIZE',
+}
+# SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+_locals = []
+_worker = threading.local()
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+class QueryTimeout(Exception):
+    """A query was started after its deadline"""
+
+
+class Results(dict):
+    """Results by query name; ``timed_out`` lists the queries left out"""
+
+    def __init__(self, results, timed_out):
+        super().__init__(results)
+        self.timed_out = timed_out
+
+    @property
+    def degraded(self):
+        return bool(self.timed_out)
+
+
+def propagate(local):
+    """Register a ``threading.local`` that workers copy from the caller"""
+    _locals.append(local)
+    return local
+
+
+def _get_pool(name):
+    with _pool_lock:
+        if name not in _pools:
+            _pools[name] = ThreadPoolExecutor(
+                max_workers=getattr(settings, POOL_SIZES[name]),
+                thread_name_prefix=name
+            )
+        return _pools[name]
+
+
+def _deadline_guard(deadline, connection):
+    server_timeout = connection.vendor == 'postgresql' and getattr(_worker, 'active', False)
+
+    def guard(execute, sql, params, many, context):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise QueryTimeout(sql)
+        if server_timeout and not many:
+            # Sent with the statement, so it holds for that statement
+            # only, whichever server connection pgbouncer picks
+            sql = f'SET LOCAL statement_timeout = {max(int(remaining * 1000), 1)}; {sql}'
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if getattr(exc.__cause__, 'pgcode', None) == QUERY_CANCELED:
+                raise QueryTimeout(sql) from exc
+            raise
+    return guard
+
+
+def _call(fn, deadline):
+    """``fn()``, with every statement it runs checked against ``deadline``"""
+    if deadline is None:
+        return fn()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(_deadline_guard(deadline, connection)))
+        return fn()
+
+
+def _run_in_worker(fn, state, deadline):
+    _worker.active = True
+    for local, values in zip(_locals, state):
+        vars(local).update(values)
+    close_old_connections()
+    try:
+        return _call(fn, deadline)
+    finally:
+        # Connections past CONN_MAX_AGE or broken by the query are closed;
+        # the others are reused by the thread's next task
+        close_old_connections()
+        for local in _locals:
+            vars(local).clear()
+        _worker.active = False
+
+
+def _sequential():
+    return getattr(_worker, 'active', False) or any(
+        connection.in_atomic_block for connection in connections.all()
+    )
+
+
+def run_parallel(queries, timeout=None, pool='query'):
+    """
+    Run ``{name: callable}`` concurrently on ``pool`` and return their
+    ``Results``.
+
+    Every query gets ``timeout`` seconds from the call; without one,
+    waits for all of them. Exceptions other than timeouts propagate.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    results, timed_out = {}, []
+
+    if len(queries) == 1 or _sequential():
+        for name, fn in queries.items():
+            try:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise QueryTimeout(name)
+                results[name] = _call(fn, deadline)
+            except QueryTimeout:
+                timed_out.append(name)
+        return Results(results, timed_out)
+
+    state = [dict(vars(local)) for local in _locals]
+    executor = _get_pool(pool)
+    futures = {
+        name: executor.submit(_run_in_worker, fn, state, deadline)
+        for name, fn in queries.items()
+    }
+    wait(futures.values(), timeout=timeout)
+    for name, future in futures.items():
+        if not future.done():
+            # Finishes its statement in the background
+            future.cancel()
+            timed_out.append(name)
+            continue
+        try:
+            results[name] = future.result()
+        except QueryTimeout:
+            timed_out.append(name)
+    return Results(results, timed_out)
@@ -0,0 +1,71 @@
+"""
+Connection health and pool metrics for the configured databases.
+"""
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+def check_connection(alias):
+    """Run a trivial query on one alias and report its latency"""
+    connection = connections[alias]
+    status = {
+        'alias': alias,
+        'vendor': connection.vendor,
+        'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+        'server_side_cursors': not connection.settings_dict.get(
+            'DISABLE_SERVER_SIDE_CURSORS', False
+        ),
+    }
+    started = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except Exception as exc:
+        status.update(reachable=False, error=str(exc))
+    else:
+        status.update(
+            reachable=True,
+            latency_ms=round((time.perf_counter() - started) * 1000, 2)
+        )
+    return status
+
+
+def pgbouncer_pools():
+    """Return ``SHOW POOLS`` from the pgbouncer admin console, if pooling through it"""
+    if settings.DB_POOL_MODE != 'pgbouncer' or not settings.PGBOUNCER_ADMIN_URL:
+        return None
+
+    import psycopg2
+
+    admin = psycopg2.connect(settings.PGBOUNCER_ADMIN_URL, connect_timeout=5)
+    try:
+        # The admin console only speaks the simple protocol, no transactions
+        admin.autocommit = True
+        with admin.cursor() as cursor:
+            cursor.execute('SHOW POOLS')
+            columns = [column.name for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        admin.close()
+
+
+def database_health():
+    """Health of every configured database plus pgbouncer pool metrics"""
+    databases = [check_connection(alias) for alias in settings.DATABASES]
+    health = {
+        'status': 'healthy',
+        'pool_mode': settings.DB_POOL_MODE,
+        'databases': databases,
+        'pools': None,
+    }
+    if not all(database['reachable'] for database in databases):
+        health['status'] = 'degraded'
+    try:
+        health['pools'] = pgbouncer_pools()
+    except Exception as exc:
+        health['status'] = 'degraded'
+        health['pools_error'] = str(exc)
+    return health
@@ -0,0 +1,74 @@
+"""
+JSON and NDJSON parsers backed by orjson.
+
+``ORJSONParser`` accepts exactly what DRF's ``JSONParser`` accepts (NaN
+and Infinity are rejected by both) and returns the same data. Bodies in
+a charset other than UTF-8, bodies orjson rejects, and installs without
+orjson go through the stock parser, which also produces the usual error
+message. Integers beyond 64 bits are the one difference: orjson reads
+them as floats.
+
+``NDJSONParser`` reads ``Content-Type: application/x-ndjson`` bodies, one
+JSON document per line, into a list.
+"""
+import io
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.utils import json
+
+from .renderers import NDJSON_MEDIA_TYPE, NDJSONRenderer, ORJSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+UTF8 = {'utf-8', 'utf8'}
+
+
+def loads(data):
+    if orjson is None:
+        return json.loads(data)
+    return orjson.loads(data)
+
+
+def _is_utf8(parser_context):
+    encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+    return encoding.lower() in UTF8
+
+
+class ORJSONParser(JSONParser):
+    """``JSONParser`` results, decoded with orjson"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None or not _is_utf8(parser_context):
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+
+
+class NDJSONParser(BaseParser):
+    """A list with one item per line of the body"""
+    media_type = NDJSON_MEDIA_TYPE
+    renderer_class = NDJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if not _is_utf8(parser_context):
+            raise ParseError("NDJSON bodies must be UTF-8")
+
+        items = []
+        for number, line in enumerate(iter(stream.readline, b''), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(loads(line))
+            except ValueError as exc:
+                raise ParseError(f"NDJSON parse error on line {number} - {exc}")
+        return items
@@ -0,0 +1,96 @@
+"""
+JSON and NDJSON renderers backed by orjson.
+
+``ORJSONRenderer`` writes the same bytes as DRF's ``JSONRenderer`` with
+this project's settings (compact, UTF-8, ``Z`` for UTC datetimes,
+Decimals as floats, lazy strings forced), several times faster on large
+lists. Types orjson has no native encoding for go through DRF's own
+encoder. Floats that need an exponent are written in orjson's shortest
+form (``1e16`` rather than ``1e+16``), the same number either way.
+
+It falls back to the stock renderer when orjson is not installed, when a
+client asks for indented output (``Accept: application/json; indent=4``)
+and for values orjson cannot encode, such as integers beyond 64 bits.
+
+``NDJSONRenderer`` answers ``Accept: application/x-ndjson`` (or
+``?format=ndjson``) with one JSON document per line; a paginated
+response renders one line per result.
+"""
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+_encoder = JSONEncoder()
+
+# Escaped by JSONRenderer since they end lines in JavaScript
+_LINE_SEPARATORS = (
+    ('\u2028'.encode(), b'\\u2028'),
+    ('\u2029'.encode(), b'\\u2029'),
+)
+
+
+def dumps(data):
+    """Compact UTF-8 JSON bytes, encoded like DRF's JSONRenderer"""
+    if orjson is None:
+        return json.dumps(
+            data,
+            cls=JSONEncoder,
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(',', ':')
+        ).encode()
+    return orjson.dumps(
+        data,
+        default=_encoder.default,
+        option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    )
+
+
+class ORJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` output, encoded with orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = dumps(data)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        for raw, escaped in _LINE_SEPARATORS:
+            if raw in ret:
+                ret = ret.replace(raw, escaped)
+        return ret
+
+
+class NDJSONRenderer(BaseRenderer):
+    """One JSON document per line"""
+    media_type = NDJSON_MEDIA_TYPE
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and isinstance(data.get('results'), list):
+            data = data['results']
+        if not isinstance(data, (list, tuple)):
+            data = [data]
+        return b''.join(dumps(item) + b'\n' for item in data)
+
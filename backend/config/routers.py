@@ -0,0 +1,146 @@
+"""
+Database routing for read replicas.
+
+Reads only go to a replica inside ``use_replica()`` (or a view decorated
+with ``read_from_replica``); everything else, including all writes, stays
+on ``default``. Replicas lagging more than ``REPLICA_MAX_LAG_SECONDS`` are
+skipped, and clients that have just written are pinned to the primary for
+``REPLICA_PIN_SECONDS`` so they read their own writes.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .concurrency import propagate
+
+# Copied into parallel query workers, which read like their caller
+_state = propagate(threading.local())
+_lag_checks = {}
+
+# Postgres replication lag in seconds; 0 when the replica has replayed
+# everything it received (an idle primary does not look like lag)
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+@contextmanager
+def use_replica():
+    """Send reads inside the block to a replica when one is healthy"""
+    _state.replica_depth = getattr(_state, 'replica_depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.replica_depth -= 1
+
+
+@contextmanager
+def pin_primary(pinned=True):
+    """Force reads inside the block onto the primary"""
+    previous = getattr(_state, 'pinned', False)
+    _state.pinned = pinned
+    try:
+        yield
+    finally:
+        _state.pinned = previous
+
+
+def read_from_replica(view_method):
+    """Decorator running a read-only view method under ``use_replica()``"""
+    @wraps(view_method)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return view_method(*args, **kwargs)
+    return wrapper
+
+
+def replica_lag(alias):
+    """Replication lag of a replica in seconds, checked at most every few seconds"""
+    now = time.monotonic()
+    checked = _lag_checks.get(alias)
+    if checked and now - checked[0] < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return checked[1]
+
+    connection = connections[alias]
+    try:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(LAG_QUERY)
+                lag = float(cursor.fetchone()[0])
+        else:
+            lag = 0.0
+    except Exception:
+        lag = float('inf')
+
+    _lag_checks[alias] = (now, lag)
+    return lag
+
+
+def choose_replica():
+    """Pick a replica within the lag budget, or None to use the primary"""
+    healthy = [
+        alias for alias in settings.DATABASE_REPLICAS
+        if replica_lag(alias) <= settings.REPLICA_MAX_LAG_SECONDS
+    ]
+    return random.choice(healthy) if healthy else None
+
+
+class ReplicaRouter:
+    """Route opted-in reads to replicas and everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS:
+            return None
+        if not getattr(_state, 'replica_depth', 0) or getattr(_state, 'pinned', False):
+            return DEFAULT_DB_ALIAS
+        return choose_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS if settings.DATABASE_REPLICAS else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Pin a client to the primary for a few seconds after it writes"""
+
+    unsafe_methods = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = settings.REPLICA_PIN_COOKIE in request.COOKIES
+        with pin_primary(pinned):
+            response = self.get_response(request)
+
+        if (settings.DATABASE_REPLICAS
+                and request.method in self.unsafe_methods
+                and response.status_code < 400):
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE,
+                '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
+
@@ -0,0 +1,236 @@
+"""
+Sharding of URLs and their clicks across databases.
+
+With ``SHARD_DATABASE_URLS`` set, ``DATABASE_SHARDS`` lists ``default``
+followed by one alias per extra database, and every URL lives on the shard
+its short code hashes to (``shard_for_code``). Clicks, their interned
+dimensions, scheduled expiries and daily rollups are stored on their URL's
+shard, so the queries joining them stay on one database; everything else
+(users, Celery beat, export watermarks) stays on ``default``.
+
+``ShardRouter`` sends sharded models to the database of the instance at
+hand, or to the shard selected with ``on_shard()``, and to ``default``
+otherwise. Work on one URL selects its shard; lists and aggregates run on
+every shard with ``fan_out`` and merge the results (``MergedRows`` for
+ordered, paginated lists). URL ids carry the index of the shard they were
+allocated on (``shard_for_id``), so lookups by id also go to one shard;
+URLs moved by ``manage.py reshard`` or created before sharding are found
+by asking the other shards after a miss.
+
+With a single database all of this is a no-op and routing is left to
+``ReplicaRouter``.
+"""
+import heapq
+import threading
+import zlib
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .concurrency import propagate, run_parallel
+
+# Every model of these apps is sharded, plus these models of other apps
+SHARDED_APPS = frozenset({'shortener'})
+SHARDED_MODELS = frozenset({'analytics.dailyanalytics'})
+
+# URL ids are ``sequence * MAX_SHARDS + shard index``
+MAX_SHARDS = 64
+
+_state = propagate(threading.local())
+
+
+def shards():
+    """Database aliases of the shards, ``default`` first"""
+    return settings.DATABASE_SHARDS
+
+
+def is_sharded():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def is_sharded_model(model):
+    meta = model._meta
+    return meta.app_label in SHARDED_APPS or meta.label_lower in SHARDED_MODELS
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping & Veach): growing ``buckets`` by one
+    only moves a ``1 / buckets`` share of the keys, all to the new bucket
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (1 << 31) / ((key >> 33) + 1))
+    return bucket
+
+
+def shard_for_code(short_code):
+    """Shard a short code belongs on"""
+    aliases = shards()
+    if len(aliases) == 1:
+        return aliases[0]
+    return aliases[jump_hash(zlib.crc32(short_code.encode()), len(aliases))]
+
+
+def shard_for_id(pk):
+    """Shard a URL id was allocated on, or None when it cannot tell"""
+    aliases = shards()
+    try:
+        index = int(pk) % MAX_SHARDS
+    except (TypeError, ValueError):
+        return None
+    return aliases[index] if index < len(aliases) else None
+
+
+def encode_id(sequence, alias):
+    """URL id for the ``sequence``-th URL allocated on a shard"""
+    return sequence * MAX_SHARDS + shards().index(alias)
+
+
+def shard_order(hint, fallback=True):
+    """Shards to look on: ``hint`` first, then (with ``fallback``) the others"""
+    aliases = shards()
+    if hint not in aliases:
+        return list(aliases)
+    if not fallback:
+        return [hint]
+    return [hint] + [alias for alias in aliases if alias != hint]
+
+
+def code_shards(short_code):
+    """Shards a code may be on: its own, and the others while resharding"""
+    return shard_order(shard_for_code(short_code), fallback=settings.SHARD_RESHARDING)
+
+
+@contextmanager
+def on_shard(alias):
+    """Route sharded models without an instance at hand to ``alias``"""
+    previous = getattr(_state, 'shard', None)
+    _state.shard = alias
+    try:
+        yield
+    finally:
+        _state.shard = previous
+
+
+def select_shard(alias):
+    """Switch the shard for the rest of the enclosing ``on_shard`` block"""
+    _state.shard = alias
+
+
+def current_db():
+    """Database sharded models are routed to right now"""
+    return getattr(_state, 'shard', None) or DEFAULT_DB_ALIAS
+
+
+def each_shard():
+    """Iterate over the shards, each selected in turn"""
+    for alias in shards():
+        with on_shard(alias):
+            yield alias
+
+
+def _run_on(alias, fn):
+    with on_shard(alias):
+        return fn(alias)
+
+
+def fan_out(fn, aliases=None):
+    """
+    ``{alias: fn(alias)}`` with ``fn`` run on every shard inside its
+    ``on_shard``, the shards queried in parallel (``run_parallel``) on
+    their own pool
+    """
+    aliases = list(aliases or shards())
+    return dict(run_parallel({alias: partial(_run_on, alias, fn) for alias in aliases}, pool='shard'))
+
+
+def urls_by_code(queryset, short_codes):
+    """
+    URLs of ``queryset`` with these codes, each shard asked in parallel
+    for its own codes only; while resharding, codes not found there are
+    looked for on the other shards too
+    """
+    if not short_codes:
+        return []
+    groups = {}
+    for code in short_codes:
+        groups.setdefault(shard_for_code(code), []).append(code)
+
+    def find(codes):
+        return lambda alias: list(queryset.using(alias).filter(short_code__in=codes[alias]))
+
+    urls = [url for found in fan_out(find(groups), groups).values() for url in found]
+    if settings.SHARD_RESHARDING and is_sharded():
+        missing = set(short_codes) - {url.short_code for url in urls}
+        elsewhere = {
+            alias: [code for code in missing if shard_for_code(code) != alias]
+            for alias in shards()
+        }
+        elsewhere = {alias: codes for alias, codes in elsewhere.items() if codes}
+        if elsewhere:
+            urls.extend(url for found in fan_out(find(elsewhere), elsewhere).values() for url in found)
+    return urls
+
+
+class MergedRows:
+    """
+    ``.values()`` rows of a queryset on every shard, merged in ``order_by``
+    order (ties broken by ``id``, which the rows must include).
+
+    Supports ``count()`` and slicing, so it can be handed to a paginator:
+    a slice reads the first ``stop`` rows of every shard in parallel and
+    merges them.
+    """
+
+    def __init__(self, queryset, order_by):
+        field = order_by.lstrip('-')
+        self.reverse = order_by.startswith('-')
+        self.queryset = queryset.order_by(order_by, '-id' if self.reverse else 'id')
+        self.key = itemgetter(field, 'id')
+
+    def count(self):
+        return sum(fan_out(lambda alias: self.queryset.using(alias).count()).values())
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+
+        def top(alias):
+            queryset = self.queryset.using(alias)
+            return list(queryset[:stop] if stop is not None else queryset)
+
+        rows = heapq.merge(*fan_out(top).values(), key=self.key, reverse=self.reverse)
+        return list(islice(rows, start, stop))
+
+
+class ShardRouter:
+    """Route sharded models to their shard and defer everything else"""
+
+    def _db(self, model, hints):
+        if not is_sharded() or not is_sharded_model(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in shards():
+            return instance._state.db
+        return current_db()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not is_sharded() or db == DEFAULT_DB_ALIAS or db not in shards():
+            return None
+        if app_label in SHARDED_APPS:
+            return True
+        return bool(model_name) and f'{app_label}.{model_name}' in SHARDED_MODELS
@@ -10,6 +10,7 @@ from drf_spectacular.views import (
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
+from monitoring.views import MetricsView
 from shortener.views import RedirectView
 
 urlpatterns = [
@@ -23,6 +24,7 @@ urlpatterns = [
     # App URLs
     path('api/', include('shortener.urls')),
     path('api/analytics/', include('analytics.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     
     # Redirect short URLs (must be last)
     path('<str:short_code>/', RedirectView.as_view(), name='redirect'),
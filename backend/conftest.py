@@ -7,6 +7,93 @@ from rest_framework.test import APIClient
 from shortener.models import URL, Click
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        '--record-query-budgets',
+        action='store_true',
+        help="Record the queries and cache calls of passing query budgets"
+    )
+
+
+# SQLite databases the sharding tests spread URLs over, next to default
+TEST_SHARDS = ['shard_1', 'shard_2']
+
+
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    """Create the test shards along with the test database"""
+    from django.conf import settings
+    from django.db import connections
+    for alias in TEST_SHARDS:
+        settings.DATABASES.setdefault(alias, {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        })
+    connections.configure_settings(settings.DATABASES)
+
+
+@pytest.fixture
+def shards(settings):
+    """
+    Shard URLs over default and the test shards; tests using it need
+    ``@pytest.mark.django_db(databases='__all__')``
+    """
+    settings.DATABASE_SHARDS = ['default', *TEST_SHARDS]
+    return settings.DATABASE_SHARDS
+
+
+@pytest.fixture(autouse=True)
+def celery_eager():
+    """Run tasks sent with ``.delay()`` inline, raising their errors"""
+    from config.celery import app
+    previous = {key: app.conf[key] for key in ('task_always_eager', 'task_eager_propagates')}
+    app.conf.update(task_always_eager=True, task_eager_propagates=True)
+    yield
+    app.conf.update(previous)
+
+
+@pytest.fixture(autouse=True)
+def reset_local_state():
+    """Start every test with empty rate limits and in-process caches"""
+    from shortener.bloom import short_codes
+    from shortener.cache import local_urls
+    from shortener.dimensions import local_dimensions
+    from shortener.ratelimit import limiter
+    from monitoring.metrics import registry
+    limiter.reset()
+    registry.reset()
+    local_urls.clear()
+    local_dimensions.clear()
+    short_codes.reset()
+
+
+@pytest.fixture
+def query_budget(request):
+    """
+    Fail a block that runs more queries or cache calls than its budget:
+
+        with query_budget(queries=2, cache=1):
+            api_client.get(...)
+    """
+    from monitoring.budgets import QueryBudget, baseline_path
+    
+    test_name = request.node.nodeid.split('::', 1)[-1]
+    budgets = []
+    
+    def budget(queries=None, cache=None):
+        name = test_name if not budgets else f'{test_name}#{len(budgets) + 1}'
+        budgets.append(name)
+        return QueryBudget(
+            name,
+            queries=queries,
+            cache=cache,
+            baseline_path=baseline_path(request.node.fspath),
+            record=request.config.getoption('record_query_budgets')
+        )
+    
+    return budget
+
+
 @pytest.fixture
 def api_client():
     """Create an API client for testing"""
@@ -54,7 +141,6 @@ def sample_click(db, sample_url):
     return Click.objects.create(
         url=sample_url,
         ip_address='127.0.0.1',
-        user_agent='Mozilla/5.0',
         session_id='test_session',
         country='US',
         city='New York'
@@ -0,0 +1,181 @@
+"""
+Query and cache budgets for the test suite.
+
+``QueryBudget`` counts the SQL statements and Django cache calls made
+inside it and fails when either goes over its limit. Passing runs can be
+recorded (``pytest --record-query-budgets``) into a ``query_budgets.json``
+next to the tests; a failure then shows the statements as a diff against
+that recording, so a regression reads as the queries it added.
+
+Cache calls are counted at the Django cache API: ``get_many`` is one call
+however many keys it reads, as it is one round trip on Redis.
+"""
+import difflib
+import json
+import os
+import re
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, connections
+
+from .profiling import QueryLog
+
+BASELINE_FILE = 'query_budgets.json'
+
+CACHE_METHODS = (
+    'get', 'set', 'add', 'delete', 'touch', 'incr', 'decr', 'has_key',
+    'get_many', 'set_many', 'delete_many', 'get_or_set', 'clear',
+)
+
+_PLACEHOLDER_LIST = re.compile(r'%s(?:, %s)+')
+_SAVEPOINT = re.compile(r'"?s\d+_x\d+"?')
+
+
+def normalize_sql(sql):
+    """SQL with run-specific details (IN list lengths, savepoint ids) folded"""
+    sql = _PLACEHOLDER_LIST.sub('%s, ...', sql)
+    return _SAVEPOINT.sub('<savepoint>', sql)
+
+
+class CacheCallLog:
+    """Record calls to this thread's cache backends"""
+
+    def __init__(self):
+        self.calls = []
+        self._depth = 0
+        self._patched = []
+
+    def wrap(self, alias, backend, name):
+        method = getattr(backend, name)
+
+        def counted(*args, **kwargs):
+            # Backends built on others (get_many -> get) count once
+            if self._depth == 0:
+                key = args[0] if args else ''
+                if not isinstance(key, str):
+                    key = f'<{len(key)} keys>'
+                self.calls.append(f'{alias}.{name} {key}')
+            self._depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth -= 1
+
+        return counted
+
+    def __enter__(self):
+        for alias in settings.CACHES:
+            backend = caches[alias]
+            for name in CACHE_METHODS:
+                setattr(backend, name, self.wrap(alias, backend, name))
+            self._patched.append(backend)
+        return self
+
+    def __exit__(self, *exc_info):
+        for backend in self._patched:
+            for name in CACHE_METHODS:
+                backend.__dict__.pop(name, None)
+        self._patched = []
+        return False
+
+
+class QueryBudget:
+    """
+    Fail when a block runs more than ``queries`` statements or ``cache``
+    cache calls (``None`` leaves that side unchecked).
+    """
+
+    def __init__(self, name, queries=None, cache=None, baseline_path=None, record=False):
+        self.name = name
+        self.max_queries = queries
+        self.max_cache = cache
+        self.baseline_path = baseline_path
+        self.record = record
+        self.query_logs = []
+        self.cache_log = CacheCallLog()
+        self._stack = None
+
+    @property
+    def queries(self):
+        return [
+            normalize_sql(query['sql'])
+            for log in self.query_logs
+            for query in log.queries
+        ]
+
+    @property
+    def query_count(self):
+        return sum(log.count for log in self.query_logs)
+
+    @property
+    def cache_calls(self):
+        return list(self.cache_log.calls)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            log = QueryLog(alias)
+            self.query_logs.append(log)
+            self._stack.enter_context(connections[alias].execute_wrapper(log))
+        self._stack.enter_context(self.cache_log)
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self._stack.close()
+        if exc_type is not None:
+            return False
+
+        failures = []
+        if self.max_queries is not None and self.query_count > self.max_queries:
+            failures.append(self.report('queries', self.max_queries, self.queries))
+        if self.max_cache is not None and len(self.cache_calls) > self.max_cache:
+            failures.append(self.report('cache', self.max_cache, self.cache_calls))
+        if failures:
+            raise AssertionError('\n\n'.join(failures))
+
+        if self.record and self.baseline_path:
+            self.save_baseline()
+        return False
+
+    def baselines(self):
+        try:
+            with open(self.baseline_path) as f:
+                return json.load(f)
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def save_baseline(self):
+        baselines = self.baselines()
+        baselines[self.name] = {
+            'vendor': connection.vendor,
+            'queries': self.queries,
+            'cache': self.cache_calls,
+        }
+        with open(self.baseline_path, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    def report(self, kind, limit, actual):
+        """Failure message listing what ran, as a diff when recorded"""
+        count = self.query_count if kind == 'queries' else len(actual)
+        header = f"{self.name}: {count} {kind} over a budget of {limit}"
+        recorded = self.baselines().get(self.name, {})
+        # SQL differs between backends; only diff against the same one
+        baseline = recorded.get(kind) if recorded.get('vendor') == connection.vendor else None
+        if baseline is None:
+            lines = [f'  {i}. {entry}' for i, entry in enumerate(actual, 1)]
+            return '\n'.join([header, '(no recorded baseline; run pytest --record-query-budgets)'] + lines)
+        diff = difflib.unified_diff(
+            baseline, actual,
+            fromfile=f'recorded ({len(baseline)})',
+            tofile=f'actual ({len(actual)})',
+            lineterm=''
+        )
+        return '\n'.join([header] + list(diff))
+
+
+def baseline_path(test_path):
+    """The recording file for a test module"""
+    return os.path.join(os.path.dirname(str(test_path)), BASELINE_FILE)
@@ -0,0 +1,63 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from monitoring.profiling import collapse, load_profiles, summarize_queries
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold saved profiles into collapsed stacks for flamegraph.pl or "
+        "speedscope, or list their slowest SQL with --queries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILING_DIR)
+        parser.add_argument('--kind', choices=['request', 'task'])
+        parser.add_argument('--name', help="Route or task name pattern, e.g. 'url-stats' or 'analytics.*'")
+        parser.add_argument('--minutes', type=int, help="Only profiles from the last N minutes")
+        parser.add_argument('--output', help="Write to this file instead of stdout")
+        parser.add_argument('--queries', action='store_true',
+                            help="Summarize SQL by total time instead of collapsing stacks")
+        parser.add_argument('--top', type=int, default=20)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['minutes']:
+            since = timezone.now() - timedelta(minutes=options['minutes'])
+        records = list(load_profiles(
+            options['dir'], kind=options['kind'], name=options['name'], since=since
+        ))
+
+        if options['queries']:
+            lines = self.query_lines(records, options['top'])
+        else:
+            stacks = collapse(records)
+            lines = [f'{stack} {count}' for stack, count in sorted(stacks.items())]
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.writelines(f'{line}\n' for line in lines)
+        else:
+            for line in lines:
+                self.stdout.write(line)
+
+        sampled = sum(1 for record in records if record['samples'])
+        # On stderr so stdout can be piped straight into flamegraph.pl
+        self.stderr.write(
+            f"{len(records)} profiles ({sampled} with stack samples; open the .prof "
+            f"files of cProfile runs with pstats or snakeviz)"
+        )
+
+    def query_lines(self, records, top):
+        summary = sorted(
+            summarize_queries(records).items(),
+            key=lambda item: item[1][1],
+            reverse=True
+        )
+        return [
+            f"{total * 1e3:10.2f}ms {count:6d}x  {' '.join(sql.split())}"
+            for sql, (count, total) in summary[:top]
+        ]
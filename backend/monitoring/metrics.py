@@ -0,0 +1,279 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters and histograms record into a per-process registry under one
+lock, so recording costs a dict update. Every gunicorn and Celery worker
+has its own registry; when the default cache is Redis each process adds
+its deltas to shared Redis hashes at most every ``METRICS_FLUSH_INTERVAL``
+seconds (piggybacking on requests and tasks, no background thread), and
+``/metrics`` renders the cluster-wide totals from there. Without Redis, or
+while it cannot be reached, it renders this process's registry.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'metrics'
+
+# Seconds; fine-grained at the low end where redirects live
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _redis_client():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+class Registry:
+    """Metric definitions and this process's unflushed samples"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self._client = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add(self, name, field, amount):
+        with self.lock:
+            samples = self.samples.setdefault(name, {})
+            samples[field] = samples.get(field, 0) + amount
+
+    def take(self):
+        with self.lock:
+            samples, self.samples = self.samples, {}
+        return samples
+
+    def merge(self, samples):
+        for name, fields in samples.items():
+            for field, amount in fields.items():
+                self.add(name, field, amount)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = _redis_client() or False
+        return self._client or None
+
+    def flush(self):
+        """Add this process's samples to the shared totals in Redis"""
+        self.last_flush = time.monotonic()
+        client = self.client
+        if client is None:
+            return False
+        samples = self.take()
+        if not samples:
+            return True
+        try:
+            pipeline = client.pipeline(transaction=False)
+            for name, fields in samples.items():
+                for field, amount in fields.items():
+                    pipeline.hincrbyfloat(f'{KEY_PREFIX}:{name}', field, amount)
+            pipeline.execute()
+        except Exception as exc:
+            logger.warning(f"Error flushing metrics: {exc}")
+            self.merge(samples)
+            return False
+        return True
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def collect(self):
+        """Current totals as ``{metric name: {field: value}}``"""
+        if self.client is None or not self.flush():
+            with self.lock:
+                return {name: dict(fields) for name, fields in self.samples.items()}
+        pipeline = self.client.pipeline(transaction=False)
+        names = list(self.metrics)
+        for name in names:
+            pipeline.hgetall(f'{KEY_PREFIX}:{name}')
+        try:
+            totals = pipeline.execute()
+        except Exception as exc:
+            logger.warning(f"Error reading metrics: {exc}")
+            with self.lock:
+                return {name: dict(fields) for name, fields in self.samples.items()}
+        return {
+            name: {field.decode(): float(value) for field, value in fields.items()}
+            for name, fields in zip(names, totals)
+        }
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        totals = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.extend(metric.render(totals.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Forget this process's samples and the shared totals in Redis"""
+        with self.lock:
+            self.samples = {}
+        client = self.client
+        if client is None or not self.metrics:
+            return
+        try:
+            client.delete(*(f'{KEY_PREFIX}:{name}' for name in self.metrics))
+        except Exception as exc:
+            logger.warning(f"Error resetting metrics: {exc}")
+
+
+registry = Registry()
+
+
+def _field(suffix, labels):
+    return json.dumps([suffix, labels], separators=(',', ':'))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _labels(self, labels):
+        return [[name, str(labels.get(name, ''))] for name in self.labelnames]
+
+    def render(self, fields):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        series = {}
+        for field, value in fields.items():
+            suffix, labels = json.loads(field)
+            series.setdefault(tuple(map(tuple, labels)), {})[suffix] = value
+        for labels in sorted(series):
+            lines.extend(self.render_series(labels, series[labels]))
+        return lines
+
+
+class Counter(Metric):
+    """Monotonic counter"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        registry.add(self.name, _field('total', self._labels(labels)), amount)
+
+    def render_series(self, labels, values):
+        yield f'{self.name}_total{_format_labels(labels)} {_format_value(values["total"])}'
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        # Per-bucket counts; made cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        registry.add(self.name, _field(f'b{index}', labels), 1)
+        registry.add(self.name, _field('sum', labels), value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render_series(self, labels, values):
+        cumulative = 0
+        bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+        for index, bound in enumerate(bounds):
+            cumulative += values.get(f'b{index}', 0)
+            yield (
+                f'{self.name}_bucket{_format_labels(labels, ("le", bound))} '
+                f'{_format_value(cumulative)}'
+            )
+        yield f'{self.name}_sum{_format_labels(labels)} {_format_value(values.get("sum", 0))}'
+        yield f'{self.name}_count{_format_labels(labels)} {_format_value(cumulative)}'
+
+
+# Instruments used across the project
+http_request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Request latency by route',
+    ['route', 'method', 'status']
+)
+db_queries = Counter(
+    'db_queries',
+    'Database queries by route',
+    ['route']
+)
+db_query_duration = Histogram(
+    'db_query_duration_seconds',
+    'Database time per request by route',
+    ['route']
+)
+cache_requests = Counter(
+    'cache_requests',
+    'Cache lookups by cache tier and result',
+    ['cache', 'result']
+)
+redirect_phase_duration = Histogram(
+    'redirect_phase_duration_seconds',
+    'Redirect latency split into cache lookup, database load and click enqueue',
+    ['phase']
+)
+click_ingestion_lag = Histogram(
+    'click_ingestion_lag_seconds',
+    'Delay between a redirect and its click being recorded',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+)
+qrcode_render_duration = Histogram(
+    'qrcode_render_duration_seconds',
+    'QR code rendering time',
+    ['source']
+)
+celery_task_duration = Histogram(
+    'celery_task_duration_seconds',
+    'Celery task runtime by task and final state',
+    ['task', 'state'],
+    buckets=DEFAULT_BUCKETS + (120.0, 300.0, 600.0, 1800.0)
+)
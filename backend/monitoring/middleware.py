@@ -0,0 +1,89 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import db_queries, db_query_duration, http_request_duration, registry
+from .profiling import Profile, requested_mode
+
+KNOWN_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and their total time"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Record latency and database usage per route"""
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        # Route names rather than paths, so short codes do not become labels
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else 'unmatched'
+        method = request.method if request.method in KNOWN_METHODS else 'OTHER'
+        http_request_duration.observe(
+            elapsed, route=route, method=method, status=response.status_code
+        )
+        if timer.count:
+            db_queries.inc(timer.count, route=route)
+            db_query_duration.observe(timer.duration, route=route)
+
+        registry.maybe_flush()
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile requests selected by the X-Profile header or sample rate"""
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        if not settings.PROFILING_TOKEN and not settings.PROFILING_SAMPLE_RATE:
+            # Nothing could ever select a request
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+
+        with Profile('request', mode=mode) as profile:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        profile_id = profile.save(
+            match.view_name if match else 'unmatched',
+            method=request.method,
+            path=request.path,
+            status=response.status_code
+        )
+        response['X-Profile-Id'] = profile_id
+        return response
@@ -0,0 +1,364 @@
+"""
+Opt-in profiling of individual requests and Celery tasks.
+
+Nothing here runs unless ``PROFILING_ENABLED`` is set: the middleware
+removes itself from the stack and the task signals are never connected.
+When enabled, a request is profiled if it carries ``X-Profile: <token>``
+or falls in the ``PROFILING_SAMPLE_RATE`` fraction; tasks matching
+``PROFILING_TASKS`` are profiled at ``PROFILING_TASK_SAMPLE_RATE``.
+
+A profile records either stack samples (``sampler`` mode: a thread reads
+the profiled thread's stack every ``PROFILING_INTERVAL`` seconds, cheap
+enough for production) or a full cProfile run (``cprofile`` mode, exact
+but slow), plus the SQL the request ran. Each profile is one JSON file in
+``PROFILING_DIR`` (cProfile runs also get a ``.prof`` file for pstats or
+snakeviz); only the newest ``PROFILING_MAX_FILES`` are kept.
+``manage.py collapse_profiles`` folds the samples into collapsed stacks
+for flamegraph.pl or speedscope.
+"""
+import cProfile
+import fnmatch
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+MODES = ('sampler', 'cprofile')
+PROFILE_HEADER = 'X-Profile'
+MODE_HEADER = 'X-Profile-Mode'
+
+# Per profile; the total count and time are always exact
+MAX_QUERIES = 1000
+MAX_SQL_LENGTH = 2000
+TOP_FUNCTIONS = 50
+
+# Profiles do not nest: an eager task inside a profiled request, or a
+# second cProfile on the same thread, is left to the outer profile
+_active = threading.local()
+
+
+def frame_label(frame):
+    """``module:function`` name of a frame, safe for collapsed stacks"""
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    label = f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+    return label.replace(';', ':').replace(' ', '_')
+
+
+def collapse_frame(frame):
+    """Root-first ``a;b;c`` stack of a frame"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler(threading.Thread):
+    """Count another thread's stacks at a fixed interval"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profiling-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_frame(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class QueryLog:
+    """Database execute wrapper recording each statement and its time"""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if len(self.queries) < MAX_QUERIES:
+                # Statements only; parameters can hold visitor data
+                self.queries.append({
+                    'alias': self.alias,
+                    'sql': sql[:MAX_SQL_LENGTH],
+                    'many': many,
+                    'duration': round(elapsed, 6),
+                })
+
+
+class Profile:
+    """
+    One profiled request or task.
+
+    Use as a context manager around the work, then ``save()`` it.
+    """
+
+    def __init__(self, kind, mode=None, interval=None):
+        self.kind = kind
+        self.mode = mode or settings.PROFILING_MODE
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {self.mode}")
+        self.interval = interval or settings.PROFILING_INTERVAL
+        self.id = None
+        self.started_at = None
+        self.duration = None
+        self.query_logs = []
+        self.sampler = None
+        self.profiler = None
+        self._stack = None
+
+    def __enter__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._stack = ExitStack()
+        for alias in connections:
+            log = QueryLog(alias)
+            self.query_logs.append(log)
+            self._stack.enter_context(connections[alias].execute_wrapper(log))
+
+        _active.profile = self
+        if self.mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+        else:
+            self.sampler = StackSampler(threading.get_ident(), self.interval)
+            self.sampler.start()
+        self._started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.duration = time.perf_counter() - self._started
+        if self.sampler is not None:
+            self.sampler.stop()
+        _active.profile = None
+        self._stack.close()
+        return False
+
+    @property
+    def samples(self):
+        return dict(self.sampler.samples) if self.sampler else {}
+
+    def functions(self):
+        """The slowest functions of a cProfile run by cumulative time"""
+        if self.profiler is None:
+            return []
+        stats = pstats.Stats(self.profiler)
+        rows = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({
+                'function': f'{filename}:{line}({name})',
+                'calls': calls,
+                'tottime': round(tottime, 6),
+                'cumtime': round(cumtime, 6),
+            })
+        rows.sort(key=lambda row: row['cumtime'], reverse=True)
+        return rows[:TOP_FUNCTIONS]
+
+    def record(self, name, **meta):
+        queries = [query for log in self.query_logs for query in log.queries]
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'name': name,
+            'mode': self.mode,
+            'started_at': self.started_at.isoformat(),
+            'duration': round(self.duration, 6),
+            'interval': self.interval if self.sampler else None,
+            'samples': self.samples,
+            'functions': self.functions(),
+            'query_count': sum(log.count for log in self.query_logs),
+            'query_time': round(sum(log.duration for log in self.query_logs), 6),
+            'queries': queries,
+            'meta': meta,
+        }
+
+    def save(self, name, **meta):
+        """Write the profile to ``PROFILING_DIR`` and return its id"""
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        # Timestamp first, so file names sort oldest to newest
+        safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)[:60]
+        self.id = (
+            f"{self.started_at:%Y%m%dT%H%M%S%f}-{self.kind}-{safe_name}-"
+            f"{uuid.uuid4().hex[:8]}"
+        )
+        base = os.path.join(directory, self.id)
+        if self.profiler is not None:
+            self.profiler.dump_stats(f'{base}.prof')
+        _write_atomic(f'{base}.json', json.dumps(self.record(name, **meta)))
+        rotate(directory, settings.PROFILING_MAX_FILES)
+        return self.id
+
+
+def _write_atomic(path, content):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def rotate(directory, max_files):
+    """Delete all but the newest ``max_files`` profiles"""
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    for name in names[:max(len(names) - max_files, 0)]:
+        base = os.path.join(directory, name[:-len('.json')])
+        for path in (f'{base}.json', f'{base}.prof'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def load_profiles(directory, kind=None, name=None, since=None):
+    """Saved profiles, oldest first, optionally filtered"""
+    if not os.path.isdir(directory):
+        return
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            # Rotated away or still being written
+            continue
+        if kind and record['kind'] != kind:
+            continue
+        if name and not fnmatch.fnmatchcase(record['name'], name):
+            continue
+        if since and datetime.fromisoformat(record['started_at']) < since:
+            continue
+        yield record
+
+
+def collapse(records):
+    """
+    Sum the stack samples of profiles into collapsed stacks, each rooted
+    at the profile's ``kind:name``
+    """
+    stacks = Counter()
+    for record in records:
+        root = f"{record['kind']}:{record['name']}".replace(';', ':').replace(' ', '_')
+        for stack, count in record['samples'].items():
+            stacks[f'{root};{stack}'] += count
+    return stacks
+
+
+def summarize_queries(records):
+    """``{sql: [count, total seconds]}`` over the queries of profiles"""
+    summary = {}
+    for record in records:
+        for query in record['queries']:
+            entry = summary.setdefault(query['sql'], [0, 0.0])
+            entry[0] += 1
+            entry[1] += query['duration']
+    return summary
+
+
+def is_profiling():
+    """Whether this thread is already being profiled"""
+    return getattr(_active, 'profile', None) is not None
+
+
+def requested_mode(request):
+    """
+    Profiling mode for a request, or None to leave it alone.
+
+    The header needs the configured token; without one only the sample
+    rate applies.
+    """
+    if is_profiling():
+        return None
+    token = settings.PROFILING_TOKEN
+    header = request.headers.get(PROFILE_HEADER)
+    if token and header and hmac.compare_digest(header, token):
+        mode = request.headers.get(MODE_HEADER)
+        return mode if mode in MODES else settings.PROFILING_MODE
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return settings.PROFILING_MODE
+    return None
+
+
+def should_profile_task(name):
+    """Whether to profile a run of the named task"""
+    if is_profiling():
+        return False
+    if not any(fnmatch.fnmatchcase(name, pattern) for pattern in settings.PROFILING_TASKS):
+        return False
+    return random.random() < settings.PROFILING_TASK_SAMPLE_RATE
+
+
+_task_profiles = {}
+
+
+def start_task_profile(task_id=None, task=None, **kwargs):
+    """Begin profiling a task run if it is selected"""
+    if task is None or not should_profile_task(task.name):
+        return
+    profile = Profile('task')
+    try:
+        profile.__enter__()
+    except Exception as e:
+        logger.error(f"Error starting profile for {task.name}: {e}")
+        return
+    _task_profiles[task_id] = profile
+
+
+def finish_task_profile(task_id=None, task=None, state=None, **kwargs):
+    """Stop and save a task run's profile"""
+    profile = _task_profiles.pop(task_id, None)
+    if profile is None:
+        return
+    profile.__exit__(None, None, None)
+    try:
+        profile.save(task.name, task_id=task_id, state=state or 'UNKNOWN')
+    except Exception as e:
+        logger.error(f"Error saving profile for {task.name}: {e}")
+
+
+def connect_task_signals():
+    """Profile selected Celery tasks; only called when profiling is enabled"""
+    from celery.signals import task_postrun, task_prerun
+
+    task_prerun.connect(start_task_profile, dispatch_uid='profiling_task_prerun')
+    task_postrun.connect(finish_task_profile, dispatch_uid='profiling_task_postrun')
+
+
+def disconnect_task_signals():
+    from celery.signals import task_postrun, task_prerun
+
+    task_prerun.disconnect(dispatch_uid='profiling_task_prerun')
+    task_postrun.disconnect(dispatch_uid='profiling_task_postrun')
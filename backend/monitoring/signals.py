@@ -0,0 +1,32 @@
+import time
+
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+
+from .metrics import celery_task_duration, registry
+
+_started = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    """Note when a task starts running"""
+    _started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    """Record a finished task's runtime"""
+    started = _started.pop(task_id, None)
+    if started is not None:
+        celery_task_duration.observe(
+            time.perf_counter() - started,
+            task=task.name if task else 'unknown',
+            state=state or 'UNKNOWN'
+        )
+    registry.maybe_flush()
+
+
+@worker_process_shutdown.connect
+def flush_metrics(**kwargs):
+    """Hand this worker's last samples to the shared totals"""
+    registry.flush()
@@ -0,0 +1,61 @@
+"""
+Tests for query and cache budgets
+"""
+import pytest
+from django.core.cache import cache, caches
+from monitoring.budgets import QueryBudget, normalize_sql
+from shortener.models import URL
+
+
+@pytest.mark.django_db
+class TestQueryBudget:
+    """Test counting and reporting queries and cache calls"""
+
+    def test_within_budget(self, sample_url):
+        """Test queries and cache calls are counted"""
+        with QueryBudget('test', queries=1, cache=2) as budget:
+            URL.objects.get(short_code='test123')
+            cache.get_many(['a', 'b', 'c'])
+            cache.set('a', 1)
+
+        assert budget.query_count == 1
+        assert budget.cache_calls == ['default.get_many <3 keys>', 'default.set a']
+
+    def test_over_budget_lists_queries(self, sample_url):
+        """Test a failure without a recording lists what ran"""
+        with pytest.raises(AssertionError) as excinfo:
+            with QueryBudget('test', queries=1):
+                URL.objects.get(short_code='test123')
+                URL.objects.count()
+
+        message = str(excinfo.value)
+        assert 'test: 2 queries over a budget of 1' in message
+        assert '2. SELECT COUNT(*)' in message
+
+    def test_over_budget_diffs_recording(self, sample_url, tmp_path):
+        """Test a failure shows the queries added since the recording"""
+        path = str(tmp_path / 'query_budgets.json')
+        with QueryBudget('test', queries=1, baseline_path=path, record=True):
+            URL.objects.get(short_code='test123')
+
+        with pytest.raises(AssertionError) as excinfo:
+            with QueryBudget('test', queries=1, baseline_path=path):
+                URL.objects.get(short_code='test123')
+                URL.objects.count()
+
+        added = [line for line in str(excinfo.value).splitlines() if line.startswith('+S')]
+        assert len(added) == 1
+        assert added[0].startswith('+SELECT COUNT(*)')
+
+    def test_cache_restored(self):
+        """Test the cache backend is unpatched afterwards"""
+        with QueryBudget('test'):
+            pass
+
+        assert 'get' not in vars(caches['default'])
+
+
+def test_normalize_sql():
+    """Test run-specific SQL details are folded"""
+    assert normalize_sql('WHERE id IN (%s, %s, %s)') == 'WHERE id IN (%s, ...)'
+    assert normalize_sql('SAVEPOINT "s1234_x5"') == 'SAVEPOINT <savepoint>'
@@ -0,0 +1,130 @@
+"""
+Tests for metrics recording and the Prometheus endpoint
+"""
+import pytest
+from unittest.mock import MagicMock, patch
+from django.urls import reverse
+from monitoring.metrics import (
+    Counter,
+    Histogram,
+    Registry,
+    celery_task_duration,
+    registry,
+)
+
+
+def series(text, prefix):
+    """Sample lines of the exposition starting with a prefix"""
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+class TestMetrics:
+    """Test metric recording and rendering"""
+
+    def test_counter(self):
+        """Test counters render per label set"""
+        counter = Counter('test_events', 'Test events', ['kind'])
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        counter.inc(kind='b"quoted"')
+
+        text = registry.render()
+
+        assert '# TYPE test_events counter' in text
+        assert 'test_events_total{kind="a"} 3' in text
+        assert 'test_events_total{kind="b\\"quoted\\""} 1' in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test histogram buckets, sum and count"""
+        histogram = Histogram('test_latency_seconds', 'Test latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+
+        text = registry.render()
+
+        assert series(text, 'test_latency_seconds_bucket') == [
+            'test_latency_seconds_bucket{le="0.1"} 2',
+            'test_latency_seconds_bucket{le="1"} 3',
+            'test_latency_seconds_bucket{le="+Inf"} 4',
+        ]
+        assert 'test_latency_seconds_sum 3.65' in text
+        assert 'test_latency_seconds_count 4' in text
+
+    def test_redis_down(self):
+        """Test scrapes fall back to this process's samples when Redis fails"""
+        local = Registry()
+        local.register(Counter('test_fallback', 'Test fallback'))
+        local.add('test_fallback', '["_total",[]]', 2)
+        client = MagicMock()
+        client.pipeline.return_value.execute.side_effect = ConnectionError('down')
+
+        # Samples not due for a flush yet
+        with patch.object(Registry, 'client', client), patch.object(local, 'flush', return_value=True):
+            totals = local.collect()
+
+        assert totals['test_fallback'] == {'["_total",[]]': 2}
+
+    def test_reset_clears_shared_totals(self):
+        """Test a reset also drops the totals other runs left in Redis"""
+        local = Registry()
+        local.register(Counter('test_reset', 'Test reset'))
+        local.add('test_reset', '["_total",[]]', 1)
+        client = MagicMock()
+
+        with patch.object(Registry, 'client', client):
+            local.reset()
+
+        assert local.samples == {}
+        client.delete.assert_called_once_with('metrics:test_reset')
+
+
+@pytest.mark.django_db
+class TestInstrumentation:
+    """Test request and task instrumentation"""
+
+    def test_redirect_metrics(self, api_client, sample_url, settings):
+        """Test a redirect records its route, phases and cache tiers"""
+        settings.DEBUG = True
+        api_client.get(f'/{sample_url.short_code}/')
+        api_client.get(f'/{sample_url.short_code}/')
+
+        text = api_client.get(reverse('metrics')).content.decode()
+
+        assert 'http_request_duration_seconds_count{route="redirect",method="GET",status="302"} 2' in text
+        assert 'redirect_phase_duration_seconds_count{phase="cache"} 2' in text
+        assert 'redirect_phase_duration_seconds_count{phase="db"} 1' in text
+        assert 'redirect_phase_duration_seconds_count{phase="enqueue"} 2' in text
+        assert 'cache_requests_total{cache="url_local",result="hit"} 1' in text
+        assert 'db_queries_total{route="redirect"}' in text
+        # The eagerly run click task is timed by the Celery signals
+        assert 'task="shortener.tasks.track_click_async"' in text
+        assert 'click_ingestion_lag_seconds_count 2' in text
+
+    def test_task_metrics(self):
+        """Test Celery tasks are timed by name and state"""
+        from shortener.tasks import cleanup_expired_urls
+        cleanup_expired_urls.delay()
+
+        text = registry.render()
+
+        assert (
+            f'{celery_task_duration.name}_count'
+            '{task="shortener.tasks.cleanup_expired_urls",state="SUCCESS"} 1'
+        ) in text
+
+    def test_metrics_token(self, client, settings):
+        """Test scrapes need the bearer token when one is configured"""
+        settings.METRICS_TOKEN = 'secret'
+
+        assert client.get(reverse('metrics')).status_code == 401
+        response = client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+
+    def test_no_token_outside_debug(self, client, settings):
+        """Test /metrics is not served without a token unless DEBUG is on"""
+        settings.METRICS_TOKEN = ''
+
+        assert client.get(reverse('metrics')).status_code == 404
+        settings.DEBUG = True
+        assert client.get(reverse('metrics')).status_code == 200
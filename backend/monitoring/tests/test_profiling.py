@@ -0,0 +1,188 @@
+"""
+Tests for request and task profiling
+"""
+import json
+import os
+import time
+from io import StringIO
+
+import pytest
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from monitoring.middleware import ProfilingMiddleware
+from monitoring.profiling import (
+    Profile,
+    connect_task_signals,
+    disconnect_task_signals,
+    load_profiles,
+    rotate,
+)
+
+
+def busy(seconds):
+    """Spin on the CPU so the sampler sees this frame"""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def profiling(settings, tmp_path):
+    """Enable profiling into a temporary directory"""
+    settings.PROFILING_ENABLED = True
+    settings.PROFILING_TOKEN = 'secret'
+    settings.PROFILING_SAMPLE_RATE = 0.0
+    settings.PROFILING_MODE = 'sampler'
+    settings.PROFILING_INTERVAL = 0.001
+    settings.PROFILING_DIR = str(tmp_path)
+    settings.PROFILING_MAX_FILES = 100
+    return settings
+
+
+def saved(directory, suffix='.json'):
+    return sorted(name for name in os.listdir(directory) if name.endswith(suffix))
+
+
+class TestProfile:
+    """Test capturing and storing profiles"""
+
+    def test_stack_samples(self, profiling):
+        """Test the sampler records the profiled thread's stacks"""
+        with Profile('request') as profile:
+            busy(0.05)
+        profile_id = profile.save('url-stats', path='/api/urls/1/stats/')
+
+        with open(os.path.join(profiling.PROFILING_DIR, f'{profile_id}.json')) as f:
+            record = json.load(f)
+        assert record['kind'] == 'request'
+        assert record['name'] == 'url-stats'
+        assert record['meta'] == {'path': '/api/urls/1/stats/'}
+        assert any(stack.endswith('test_profiling:busy') for stack in record['samples'])
+
+    def test_cprofile_mode(self, profiling):
+        """Test cProfile runs keep a .prof file and their slowest functions"""
+        with Profile('task', mode='cprofile') as profile:
+            busy(0.01)
+        profile_id = profile.save('analytics.tasks.aggregate_analytics')
+
+        assert saved(profiling.PROFILING_DIR, '.prof') == [f'{profile_id}.prof']
+        record = next(load_profiles(profiling.PROFILING_DIR))
+        assert record['samples'] == {}
+        assert any('(busy)' in row['function'] for row in record['functions'])
+
+    @pytest.mark.django_db
+    def test_query_log(self, profiling, sample_url):
+        """Test the SQL run inside a profile is recorded without parameters"""
+        from shortener.models import URL
+
+        with Profile('request') as profile:
+            URL.objects.filter(short_code='test123').exists()
+        profile.save('test')
+
+        record = next(load_profiles(profiling.PROFILING_DIR))
+        assert record['query_count'] == 1
+        assert '"urls"' in record['queries'][0]['sql']
+        assert 'test123' not in record['queries'][0]['sql']
+
+    def test_rotation(self, profiling):
+        """Test only the newest profiles are kept"""
+        ids = []
+        for _ in range(5):
+            with Profile('request', mode='cprofile') as profile:
+                pass
+            ids.append(profile.save('test'))
+
+        rotate(profiling.PROFILING_DIR, 2)
+
+        assert saved(profiling.PROFILING_DIR) == [f'{i}.json' for i in ids[-2:]]
+        assert saved(profiling.PROFILING_DIR, '.prof') == [f'{i}.prof' for i in ids[-2:]]
+
+
+@pytest.mark.django_db
+class TestProfilingMiddleware:
+    """Test selecting requests for profiling"""
+
+    def test_disabled_by_default(self):
+        """Test the middleware drops out unless profiling is enabled"""
+        with pytest.raises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+    def test_header_with_token(self, profiling, api_client, sample_url):
+        """Test a request with the token is profiled"""
+        response = api_client.get(f'/api/urls/{sample_url.id}/stats/', HTTP_X_PROFILE='secret')
+
+        profile_id = response['X-Profile-Id']
+        record = next(load_profiles(profiling.PROFILING_DIR))
+        assert record['id'] == profile_id
+        assert record['name'] == 'url-stats'
+        assert record['meta']['status'] == 200
+        assert record['query_count'] > 0
+
+    def test_header_without_token(self, profiling, api_client, sample_url):
+        """Test a wrong token is ignored"""
+        response = api_client.get(f'/api/urls/{sample_url.id}/stats/', HTTP_X_PROFILE='guess')
+
+        assert 'X-Profile-Id' not in response
+        assert saved(profiling.PROFILING_DIR) == []
+
+    def test_sample_rate(self, profiling, api_client, sample_url):
+        """Test sampled requests are profiled without the header"""
+        profiling.PROFILING_SAMPLE_RATE = 1.0
+        api_client.get(f'/{sample_url.short_code}/')
+
+        assert [record['name'] for record in load_profiles(profiling.PROFILING_DIR)] == ['redirect']
+
+
+@pytest.mark.django_db
+class TestTaskProfiling:
+    """Test profiling Celery tasks"""
+
+    def test_matching_tasks_are_profiled(self, profiling):
+        """Test tasks matching the patterns are profiled when run in this process"""
+        from shortener.tasks import cleanup_expired_urls, rebuild_short_code_filter
+
+        profiling.PROFILING_TASKS = ['shortener.tasks.cleanup_*']
+        profiling.PROFILING_TASK_SAMPLE_RATE = 1.0
+        connect_task_signals()
+        try:
+            cleanup_expired_urls.apply()
+            rebuild_short_code_filter.apply()
+        finally:
+            disconnect_task_signals()
+
+        records = list(load_profiles(profiling.PROFILING_DIR, kind='task'))
+        assert [record['name'] for record in records] == ['shortener.tasks.cleanup_expired_urls']
+        assert records[0]['meta']['state'] == 'SUCCESS'
+
+
+class TestCollapseProfiles:
+    """Test folding profiles into collapsed stacks"""
+
+    def test_collapse(self, profiling):
+        """Test stacks are summed and rooted at the profile name"""
+        for _ in range(2):
+            with Profile('request') as profile:
+                busy(0.03)
+            profile.save('url-stats')
+
+        out = StringIO()
+        call_command('collapse_profiles', stdout=out, stderr=StringIO())
+
+        lines = out.getvalue().splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            assert stack.startswith('request:url-stats;')
+            assert int(count) > 0
+        assert any('test_profiling:busy ' in line for line in lines)
+
+    def test_filter_by_name(self, profiling):
+        """Test profiles can be selected by name"""
+        with Profile('request') as profile:
+            busy(0.02)
+        profile.save('redirect')
+
+        out = StringIO()
+        call_command('collapse_profiles', name='url-*', stdout=out, stderr=StringIO())
+
+        assert out.getvalue() == ''
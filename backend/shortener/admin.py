@@ -1,22 +1,51 @@
+from django.conf import settings
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import URL, Click
+from config.sharding import on_shard, shard_for_code
+from .models import URL, Click, Browser, OperatingSystem, UserAgent, Referer
 
 
 @admin.register(URL)
 class URLAdmin(admin.ModelAdmin):
-    list_display = ['short_code', 'original_url_truncated', 'clicks', 'is_active', 'created_at']
-    list_filter = ['is_active', 'custom_code', 'created_at']
+    list_display = ['short_code', 'original_url_truncated', 'clicks', 'click_sample_rate', 'is_active', 'created_at']
+    list_filter = ['is_active', 'custom_code', 'redirect_policy', 'created_at']
+    list_editable = ['click_sample_rate']
     search_fields = ['short_code', 'original_url', 'title']
     readonly_fields = ['short_code', 'clicks', 'unique_clicks', 'created_at', 'updated_at']
     
     def original_url_truncated(self, obj):
         return obj.original_url[:50] + '...' if len(obj.original_url) > 50 else obj.original_url
+    
+    def save_model(self, request, obj, form, change):
+        # New URLs are stored on the shard their code belongs on, like
+        # those created through the API
+        if not obj.short_code:
+            obj.short_code = URL.generate_short_code(settings.SHORT_CODE_LENGTH)
+        with on_shard(shard_for_code(obj.short_code)):
+            super().save_model(request, obj, form, change)
 
 
 @admin.register(Click)
 class ClickAdmin(admin.ModelAdmin):
     list_display = ['url', 'ip_address', 'device_type', 'browser', 'clicked_at']
     list_filter = ['device_type', 'browser', 'clicked_at']
-    search_fields = ['ip_address', 'referer']
-    readonly_fields = ['url', 'clicked_at']
+    list_select_related = ['url', 'browser']
+    search_fields = ['ip_address', 'referer__url']
+    readonly_fields = ['url', 'user_agent', 'referer', 'browser', 'os', 'clicked_at']
+
+
+@admin.register(UserAgent)
+class UserAgentAdmin(admin.ModelAdmin):
+    list_display = ['value', 'browser', 'os', 'device_type']
+    list_filter = ['device_type', 'browser', 'os']
+    search_fields = ['value']
+
+
+@admin.register(Referer)
+class RefererAdmin(admin.ModelAdmin):
+    list_display = ['url', 'host']
+    search_fields = ['host', 'url']
+
+
+admin.site.register(Browser)
+admin.site.register(OperatingSystem)
@@ -0,0 +1,227 @@
+"""
+Bloom filter of taken short codes.
+
+A negative answer means the code is definitely free, so availability
+checks and code generation only reach the unique index for possible
+collisions. The bitmap lives in Redis when the default cache is Redis
+(one pipelined round trip per check) and in process memory otherwise.
+The in-process filter only sees codes created by its own process and is
+meant for development and tests.
+
+The filter is rebuilt from the database into a fresh bitmap which is then
+swapped in, and kept current by adding codes as URLs are created. Until a
+build with the current ``BLOOM_CAPACITY``/``BLOOM_ERROR_RATE`` completes,
+every code is reported as possibly taken. In Redis the parameters of the
+build head the bitmap itself and are checked in the same round trip as
+the bits, so a bitmap that was evicted (or recreated by an add) is never
+trusted. Deleted codes stay in the filter (they only cost a database
+check) until the next full rebuild.
+"""
+import hashlib
+import logging
+import math
+import threading
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.utils import timezone
+
+from config.sharding import shards
+
+logger = logging.getLogger(__name__)
+
+FILTER_KEY = 'bloom:short_codes'
+# Bytes before the Redis bitmap holding the build parameters
+HEADER_BYTES = 32
+HEADER_BITS = HEADER_BYTES * 8
+
+# URLs committed late in a rebuild may have been added to the old bitmap
+# only; everything created this recently is re-added after the swap
+REBUILD_OVERLAP = timedelta(minutes=1)
+
+
+def filter_size(capacity, error_rate):
+    """Bits and hash count for a capacity and false-positive rate"""
+    bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    hashes = max(1, int(round(bits / capacity * math.log(2))))
+    return bits, hashes
+
+
+def bit_offsets(code, bits, hashes):
+    """Double hashing: k offsets from two 64-bit halves of one digest"""
+    digest = hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+def build_bitmap(codes, bits, hashes):
+    """Bitmap in Redis bit order (bit 0 is the high bit of byte 0)"""
+    bitmap = bytearray((bits + 7) // 8)
+    for code in codes:
+        for offset in bit_offsets(code, bits, hashes):
+            bitmap[offset >> 3] |= 0x80 >> (offset & 7)
+    return bitmap
+
+
+class RedisFilterStore:
+    """Bitmap stored in Redis behind a header of its build parameters"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def header(params):
+        return params.encode().ljust(HEADER_BYTES, b'\0')
+
+    def built_with(self):
+        header = self.client.getrange(FILTER_KEY, 0, HEADER_BYTES - 1)
+        return header.rstrip(b'\0').decode() or None
+
+    def contains(self, offsets, params):
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.getrange(FILTER_KEY, 0, HEADER_BYTES - 1)
+        for offset in offsets:
+            pipeline.getbit(FILTER_KEY, HEADER_BITS + offset)
+        header, *found = pipeline.execute()
+        if header != self.header(params):
+            # Not built with these parameters, or evicted
+            return True
+        return all(found)
+
+    def add_many(self, offsets_list):
+        pipeline = self.client.pipeline(transaction=False)
+        for offsets in offsets_list:
+            for offset in offsets:
+                pipeline.setbit(FILTER_KEY, HEADER_BITS + offset, 1)
+        pipeline.execute()
+
+    def replace(self, bitmap, params):
+        building = f'{FILTER_KEY}:building'
+        pipeline = self.client.pipeline()
+        pipeline.set(building, self.header(params) + bytes(bitmap))
+        pipeline.rename(building, FILTER_KEY)
+        pipeline.execute()
+
+    def reset(self):
+        self.client.delete(FILTER_KEY)
+
+
+class LocalFilterStore:
+    """Bitmap held in this process"""
+
+    def __init__(self):
+        self.bitmap = None
+        self.params = None
+        self.lock = threading.Lock()
+
+    def built_with(self):
+        return self.params
+
+    def contains(self, offsets, params):
+        bitmap = self.bitmap
+        if bitmap is None or self.params != params:
+            return True
+        return all(bitmap[offset >> 3] & (0x80 >> (offset & 7)) for offset in offsets)
+
+    def add_many(self, offsets_list):
+        with self.lock:
+            if self.bitmap is None:
+                return
+            for offsets in offsets_list:
+                for offset in offsets:
+                    self.bitmap[offset >> 3] |= 0x80 >> (offset & 7)
+
+    def replace(self, bitmap, params):
+        with self.lock:
+            self.bitmap = bitmap
+            self.params = params
+
+    def reset(self):
+        with self.lock:
+            self.bitmap = None
+            self.params = None
+
+
+class ShortCodeFilter:
+    """Membership filter for taken short codes"""
+
+    def __init__(self):
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            try:
+                from django_redis import get_redis_connection
+                self._store = RedisFilterStore(get_redis_connection('default'))
+            except (ImportError, NotImplementedError):
+                self._store = LocalFilterStore()
+        return self._store
+
+    @property
+    def size(self):
+        return filter_size(settings.BLOOM_CAPACITY, settings.BLOOM_ERROR_RATE)
+
+    @property
+    def params(self):
+        return '{}:{}'.format(*self.size)
+
+    def is_ready(self):
+        """Whether a bitmap built with the current size is in place"""
+        return self.store.built_with() == self.params
+
+    def might_contain(self, code):
+        """False only when the code is definitely not taken"""
+        try:
+            return self.store.contains(bit_offsets(code, *self.size), self.params)
+        except Exception as exc:
+            logger.warning(f"Short code filter unavailable: {exc}")
+            return True
+
+    def add(self, *codes):
+        """Record newly taken codes"""
+        bits, hashes = self.size
+        try:
+            self.store.add_many([bit_offsets(code, bits, hashes) for code in codes])
+        except Exception as exc:
+            # The next rebuild picks these up; until then they may be
+            # reported free and rejected by the unique index on insert
+            logger.error(f"Error adding codes to short code filter: {exc}")
+
+    def rebuild(self):
+        """Rebuild from every code on every shard and swap it in"""
+        from .models import URL
+
+        started = timezone.now()
+        bits, hashes = self.size
+        codes = URL.objects.values_list('short_code', flat=True)
+        bitmap = build_bitmap(
+            chain.from_iterable(
+                codes.using(alias).iterator(chunk_size=10000) for alias in shards()
+            ),
+            bits,
+            hashes
+        )
+        self.store.replace(bitmap, self.params)
+
+        late = [
+            code
+            for alias in shards()
+            for code in codes.using(alias).filter(created_at__gte=started - REBUILD_OVERLAP)
+        ]
+        if late:
+            self.add(*late)
+        logger.info(f"Rebuilt short code filter ({bits} bits, {hashes} hashes)")
+
+    def reset(self):
+        self.store.reset()
+
+
+short_codes = ShortCodeFilter()
+
+
+def code_may_be_taken(code):
+    """True when the code might be taken and the database must be asked"""
+    return short_codes.might_contain(code)
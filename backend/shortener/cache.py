@@ -0,0 +1,376 @@
+"""
+Shared cache helpers for short-code lookups.
+
+Entries are stored as ``(value, expires_at, delta)`` envelopes: the key
+itself lives ``URL_CACHE_STALE_TTL`` seconds past ``expires_at`` so that,
+when an entry goes stale, one request refills it while the rest keep
+serving the stale value. Refreshes start probabilistically before expiry
+(XFetch, weighted by ``delta``, the time the last fill took) and TTLs are
+jittered, so hot keys do not all expire at once. Misses are coalesced per
+key: a striped in-process lock lets one thread per worker try, and a short
+``cache.add`` lock lets one worker per cluster run the loader. A loader
+raising ``Http404`` leaves a ``MISSING`` entry for ``URL_CACHE_MISSING_TTL``
+seconds, so requests for unknown codes wait on it rather than the database.
+
+Redirect lookups also go through a small per-process LRU in front of the
+shared cache. Both tiers are evicted on URL changes by
+``shortener.invalidation``, which lets the TTLs be measured in days.
+"""
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils import timezone
+
+from config.sharding import fan_out, is_sharded, urls_by_code
+from monitoring.metrics import cache_requests
+
+logger = logging.getLogger(__name__)
+
+# Present while the URL cache holds warmed data; gone after a Redis flush
+WARM_SENTINEL_KEY = 'url_cache_warm'
+WARM_LOCK_KEY = 'url_cache_warming'
+
+FILL_LOCK_TIMEOUT = 5
+FILL_WAIT_SECONDS = 1.0
+FILL_POLL_INTERVAL = 0.02
+
+# Cached in place of a value the loader found missing
+MISSING = 'missing'
+
+_fill_locks = [threading.Lock() for _ in range(64)]
+
+
+class LocalCache:
+    """Thread-safe in-process LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_urls = LocalCache(settings.URL_LOCAL_CACHE_SIZE)
+
+
+def url_cache_key(short_code):
+    return f'url_{short_code}'
+
+
+def qrcode_cache_key(short_code):
+    return f'qrcode_{short_code}'
+
+
+def jittered_ttl(ttl):
+    """Spread a TTL by +/- CACHE_TTL_JITTER so keys expire at different times"""
+    jitter = settings.CACHE_TTL_JITTER
+    return ttl * random.uniform(1 - jitter, 1 + jitter)
+
+
+def make_entry(value, ttl, delta=0.0):
+    """Build a cache envelope and the key timeout that goes with it"""
+    ttl = jittered_ttl(ttl)
+    timeout = int(math.ceil(ttl + settings.URL_CACHE_STALE_TTL))
+    return (value, time.time() + ttl, delta), timeout
+
+
+def make_entries(values, ttl):
+    """
+    Envelopes of ``{key: value}`` for one ``set_many``, and a key timeout
+    that covers the latest of their jittered expiries plus the stale window
+    """
+    entries, timeout = {}, 0
+    for key, value in values.items():
+        entries[key], entry_timeout = make_entry(value, ttl)
+        timeout = max(timeout, entry_timeout)
+    return entries, timeout
+
+
+def _unpack(entry):
+    if isinstance(entry, tuple) and len(entry) == 3:
+        return entry
+    return None
+
+
+def _found(value):
+    if value == MISSING:
+        raise Http404
+    return value
+
+
+def _needs_refresh(expires_at, delta, now):
+    # XFetch: the closer to expiry and the slower the loader, the more
+    # likely a request volunteers to refresh early. log(u) < 0 for u in (0, 1)
+    return now - delta * math.log(1 - random.random()) >= expires_at
+
+
+def _fill(key, loader, ttl):
+    started = time.time()
+    try:
+        value = loader()
+    except Http404:
+        entry, timeout = make_entry(MISSING, settings.URL_CACHE_MISSING_TTL)
+        cache.set(key, entry, timeout)
+        raise
+    entry, timeout = make_entry(value, ttl, time.time() - started)
+    cache.set(key, entry, timeout)
+    return value
+
+
+def get_or_fill(key, loader, ttl):
+    """
+    Return the cached value for ``key``, calling ``loader`` at most once
+    per key across concurrent misses. Raises ``Http404`` for keys the
+    loader recently found missing.
+    """
+    entry = _unpack(cache.get(key))
+    now = time.time()
+    if entry is not None:
+        value, expires_at, delta = entry
+        if not _needs_refresh(expires_at, delta, now):
+            return _found(value)
+        # Stale or volunteering early: refresh if nobody else is, otherwise
+        # keep serving what we have
+        lock_key = f'{key}:fill'
+        if not cache.add(lock_key, 1, FILL_LOCK_TIMEOUT):
+            return _found(value)
+        try:
+            return _fill(key, loader, ttl)
+        except Http404:
+            raise
+        except ObjectDoesNotExist:
+            # The value is gone: stop serving the stale copy
+            cache.delete(key)
+            raise
+        except Exception as exc:
+            # e.g. the database is down: the stale copy is still good
+            logger.warning(f"Error refreshing {key}, serving the cached value: {exc}")
+            return _found(value)
+        finally:
+            cache.delete(lock_key)
+
+    with _fill_locks[hash(key) % len(_fill_locks)]:
+        # Another thread in this worker may have filled it while we waited
+        entry = _unpack(cache.get(key))
+        if entry is not None:
+            return _found(entry[0])
+
+        lock_key = f'{key}:fill'
+        if cache.add(lock_key, 1, FILL_LOCK_TIMEOUT):
+            try:
+                return _fill(key, loader, ttl)
+            finally:
+                cache.delete(lock_key)
+
+        # Another worker is filling: wait briefly for its result
+        deadline = time.monotonic() + FILL_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(FILL_POLL_INTERVAL)
+            entry = _unpack(cache.get(key))
+            if entry is not None:
+                return _found(entry[0])
+        return _fill(key, loader, ttl)
+
+
+def get_cached_url(short_code):
+    """Return the cached URL for a code, or None"""
+    entry = _unpack(cache.get(url_cache_key(short_code)))
+    return entry[0] if entry and entry[0] != MISSING else None
+
+
+def cache_url(url):
+    """Cache a URL for redirect lookups"""
+    entry, timeout = make_entry(url, settings.URL_CACHE_TTL)
+    cache.set(url_cache_key(url.short_code), entry, timeout)
+
+
+def get_or_load_url(short_code, loader):
+    """
+    URL for a code from the in-process cache, then the shared cache, then
+    ``loader`` with single-flight on a miss
+    """
+    from .invalidation import ensure_subscriber
+
+    key = url_cache_key(short_code)
+    url = local_urls.get(key)
+    if url is not None:
+        cache_requests.inc(cache='url_local', result='hit')
+        return url
+
+    cache_requests.inc(cache='url_local', result='miss')
+    ensure_subscriber()
+    loaded = []
+
+    def load():
+        loaded.append(True)
+        return loader()
+
+    url = get_or_fill(key, load, settings.URL_CACHE_TTL)
+    cache_requests.inc(cache='url_shared', result='miss' if loaded else 'hit')
+    local_urls.set(key, url, settings.URL_LOCAL_CACHE_TTL)
+    return url
+
+
+def resolve_short_codes(short_codes):
+    """
+    Resolve many codes to ``{code: URL or None}`` with one ``get_many`` and
+    one ``short_code__in`` query for the misses, backfilling the cache with
+    the active URLs that query finds. Inactive URLs are returned but never
+    cached, since redirects must not see them.
+    """
+    from .models import URL
+
+    keys = {url_cache_key(code): code for code in short_codes}
+    resolved = {}
+    for key, entry in cache.get_many(list(keys)).items():
+        entry = _unpack(entry)
+        # Missing entries also cover inactive URLs, which are returned
+        if entry is not None and entry[0] != MISSING:
+            resolved[keys[key]] = entry[0]
+
+    misses = [code for code in short_codes if code not in resolved]
+    cache_requests.inc(len(resolved), cache='url_shared', result='hit')
+    cache_requests.inc(len(misses), cache='url_shared', result='miss')
+    if misses:
+        backfill = {}
+        for url in urls_by_code(URL.objects.all(), misses):
+            resolved[url.short_code] = url
+            if url.is_active:
+                backfill[url_cache_key(url.short_code)] = url
+        if backfill:
+            cache.set_many(*make_entries(backfill, settings.URL_CACHE_TTL))
+
+    return {code: resolved.get(code) for code in short_codes}
+
+
+def _merge_recent(shard_rows):
+    """Codes of ``(code, last_accessed, clicks)`` rows from every shard, hottest first"""
+    rows = [row for rows in shard_rows for row in rows]
+    rows.sort(key=lambda row: (
+        row[1] is None,
+        -row[1].timestamp() if row[1] else 0,
+        -row[2]
+    ))
+    return [row[0] for row in rows]
+
+
+def hot_short_codes(limit):
+    """
+    Codes most likely to be requested next: this week's trending URLs
+    first, then the most recently accessed and most clicked ones.
+    """
+    codes = [
+        entry['short_code']
+        for entry in cache.get('top_urls_weekly') or []
+    ][:limit]
+    seen = set(codes)
+    if len(codes) < limit:
+        from .models import URL
+
+        recent = (
+            URL.objects.filter(is_active=True)
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+            .order_by(F('last_accessed').desc(nulls_last=True), '-clicks')
+        )
+        if is_sharded():
+            recent = _merge_recent(fan_out(
+                lambda alias: list(recent.using(alias).values_list(
+                    'short_code', 'last_accessed', 'clicks'
+                )[:limit + len(seen)])
+            ).values())
+        else:
+            recent = recent.values_list('short_code', flat=True)
+        for code in recent[:limit + len(seen)]:
+            if code not in seen:
+                codes.append(code)
+                seen.add(code)
+            if len(codes) >= limit:
+                break
+    return codes
+
+
+def warm_url_cache(limit=None, batch_size=None, concurrency=None, progress=None):
+    """
+    Preload the hottest URLs into the redirect cache.
+
+    URLs are read from the database in batches on this thread, and each
+    batch is written with one pipelined ``set_many`` on a pool of at most
+    ``concurrency`` writer threads. ``progress(done, total)`` is called as
+    batches land. Returns the number of URLs cached.
+    """
+    from .models import URL
+
+    limit = limit or settings.CACHE_WARM_TOP_N
+    batch_size = batch_size or settings.CACHE_WARM_BATCH_SIZE
+    concurrency = concurrency or settings.CACHE_WARM_CONCURRENCY
+
+    codes = hot_short_codes(limit)
+    total = len(codes)
+    done = 0
+
+    def write(batch):
+        cache.set_many(*make_entries(batch, settings.URL_CACHE_TTL))
+        return len(batch)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = []
+        for start in range(0, total, batch_size):
+            urls = urls_by_code(
+                URL.objects.filter(is_active=True),
+                codes[start:start + batch_size]
+            )
+            batch = {url_cache_key(url.short_code): url for url in urls}
+            pending.append(pool.submit(write, batch))
+
+            # Keep at most `concurrency` batches in flight
+            while len(pending) >= concurrency:
+                done += pending.pop(0).result()
+                if progress:
+                    progress(done, total)
+        for future in pending:
+            done += future.result()
+            if progress:
+                progress(done, total)
+
+    cache.set(WARM_SENTINEL_KEY, timezone.now().isoformat(), None)
+    logger.info(f"Warmed URL cache with {done} URLs")
+    return done
+
+
+def url_cache_is_warm():
+    return cache.get(WARM_SENTINEL_KEY) is not None
@@ -0,0 +1,178 @@
+"""
+Conditional requests and cache policies for API reads.
+
+Read endpoints derive their ``ETag``/``Last-Modified`` from cheap markers
+instead of the response body, so Django's ``condition`` answers
+``If-None-Match``/``If-Modified-Since`` with a 304 before the view runs
+its aggregation:
+
+* URL detail and stats: the URL row's ``updated_at`` and
+  ``last_accessed`` (every click moves it); stats also key on the
+  ``clicks`` version, which geolocation enrichment bumps
+* popular, recent and the dashboard: the ``urls`` version, bumped when
+  URLs are created, edited or deleted, and a time bucket that carries
+  click counter changes (which do not bump it) within a minute
+* trends: the ``rollups`` version, bumped when daily analytics are
+  aggregated
+
+Versions are random tokens in the default cache, replaced after the
+changing transaction commits; a flushed cache starts fresh tokens, so an
+old ETag can never match again. Rolling windows also key on the date (or,
+for the dashboard's week, a time bucket). Every tag covers the path,
+query string and negotiated media type.
+
+``Cache-Control`` comes from ``API_CACHE_CONTROL`` per policy; nginx
+caches for ``s-maxage`` and revalidates with these ETags. Degraded
+responses (queries that timed out, ``config.concurrency``) are neither
+tagged nor cached.
+"""
+import hashlib
+import time
+import uuid
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from config.sharding import current_db
+
+VERSION_KEY_PREFIX = 'version'
+
+# The dashboard's "this week" window rolls continuously
+DASHBOARD_WINDOW_SECONDS = 60
+# Click counters, which do not bump ``urls``, reach the lists this late
+COUNTERS_WINDOW_SECONDS = 30
+
+
+def version_key(name):
+    return f'{VERSION_KEY_PREFIX}:{name}'
+
+
+def _new_version():
+    return f'{uuid.uuid4().hex[:12]}:{time.time():.3f}'
+
+
+def bump(*names):
+    """Mark version markers changed, once the current transaction commits"""
+    def _bump():
+        cache.set_many({version_key(name): _new_version() for name in names}, None)
+    transaction.on_commit(_bump, using=current_db())
+
+
+def versions(*names):
+    """``(token, changed_at)`` of version markers, starting missing ones"""
+    keys = [version_key(name) for name in names]
+    found = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+
+    result = []
+    for key in keys:
+        token, changed_at = found[key].split(':')
+        result.append((token, datetime.fromtimestamp(float(changed_at), dt_timezone.utc)))
+    return result
+
+
+def make_etag(request, *parts):
+    """Tag for a representation of ``request`` identified by ``parts``"""
+    representation = [
+        request.path,
+        request.META.get('QUERY_STRING', ''),
+        getattr(request, 'accepted_media_type', ''),
+    ]
+    value = '|'.join(str(part) for part in representation + list(parts))
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def start_of_today():
+    return timezone.make_aware(datetime.combine(timezone.localdate(), dt_time.min))
+
+
+def is_degraded(response):
+    data = getattr(response, 'data', None)
+    return isinstance(data, dict) and bool(data.get('degraded'))
+
+
+def conditional(freshness, policy):
+    """
+    Serve conditional GETs for a view method.
+
+    ``freshness(view, request, *args, **kwargs)`` returns ``(etag,
+    last_modified)`` without building the response; either may be None.
+    Successful responses, 304s included, get the policy's Cache-Control.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            etag, last_modified = freshness(view, request, *args, **kwargs)
+            respond = condition(
+                etag_func=lambda *a, **k: etag,
+                last_modified_func=lambda *a, **k: last_modified
+            )(lambda request, *a, **k: method(view, request, *a, **k))
+
+            response = respond(request, *args, **kwargs)
+            if is_degraded(response):
+                # Partial results must not be reused under a complete tag
+                response.headers.pop('ETag', None)
+                response.headers.pop('Last-Modified', None)
+                patch_cache_control(response, no_store=True)
+            elif response.status_code in (200, 304):
+                patch_cache_control(response, **settings.API_CACHE_CONTROL[policy])
+            return response
+        return wrapper
+    return decorator
+
+
+def url_freshness(view, request, *args, **kwargs):
+    """A URL's detail changes with edits and clicks"""
+    url = view.get_object()
+    last_modified = max(filter(None, [url.updated_at, url.last_accessed]))
+    return make_etag(request, url.pk, url.updated_at, url.last_accessed), last_modified
+
+
+def url_stats_freshness(view, request, *args, **kwargs):
+    """A URL's stats also change with geolocation and the 30-day window"""
+    url = view.get_object()
+    [(clicks_version, enriched_at)] = versions('clicks')
+    last_modified = max(filter(None, [
+        url.updated_at, url.last_accessed, enriched_at, start_of_today()
+    ]))
+    etag = make_etag(
+        request, url.pk, url.updated_at, url.last_accessed,
+        clicks_version, timezone.localdate()
+    )
+    return etag, last_modified
+
+
+def time_bucket(seconds):
+    """Index and start of the current ``seconds``-long time bucket"""
+    bucket = int(time.time() // seconds)
+    return bucket, datetime.fromtimestamp(bucket * seconds, dt_timezone.utc)
+
+
+def urls_freshness(view, request, *args, **kwargs):
+    """Popular and recent URLs change with URL edits and click counters"""
+    [(urls_version, changed_at)] = versions('urls')
+    bucket, bucket_start = time_bucket(COUNTERS_WINDOW_SECONDS)
+    return make_etag(request, urls_version, bucket), max(changed_at, bucket_start)
+
+
+def dashboard_freshness(view, request, *args, **kwargs):
+    """Dashboard totals change with URL edits, click counters and as the week rolls"""
+    [(urls_version, changed_at)] = versions('urls')
+    bucket, bucket_start = time_bucket(DASHBOARD_WINDOW_SECONDS)
+    return make_etag(request, urls_version, bucket), max(changed_at, bucket_start)
+
+
+def trends_freshness(view, request, *args, **kwargs):
+    """Trends change when daily analytics are rolled up, and daily"""
+    [(rollups_version, rolled_up_at)] = versions('rollups')
+    etag = make_etag(request, rollups_version, timezone.localdate())
+    return etag, max(rolled_up_at, start_of_today())
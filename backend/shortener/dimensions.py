@@ -0,0 +1,180 @@
+"""
+Interning of click dimensions.
+
+User agents, referers, browsers and operating systems are stored once in
+lookup tables and clicks reference them by id. Ids are resolved through a
+per-process LRU in front of ``get_or_create``; dimension rows are never
+updated or deleted, so cached ids stay valid. Ids created inside a
+transaction are only cached once it commits, since a rollback would take
+the row with it. Every shard has its own lookup tables, so ids are cached
+per shard.
+
+User agents are parsed once, when first seen: the parsed browser, OS and
+device type are stored on the ``UserAgent`` row and cached with its id.
+Referers are interned as scheme, host and path: query strings and
+fragments (tracking parameters, mostly) would make nearly every one new.
+"""
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+
+from config.sharding import current_db
+
+from .cache import LocalCache
+
+# Rows are immutable; the TTL only bounds how long an idle entry is kept
+DIMENSION_CACHE_TTL = 24 * 3600
+
+local_dimensions = LocalCache(settings.DIMENSION_CACHE_SIZE)
+
+
+def digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def _cache_key(name):
+    # Every shard interns its own rows
+    return f'{current_db()}:{name}'
+
+
+def _remember(key, value):
+    db = current_db()
+    if connections[db].in_atomic_block:
+        transaction.on_commit(
+            lambda: local_dimensions.set(key, value, DIMENSION_CACHE_TTL),
+            using=db
+        )
+    else:
+        local_dimensions.set(key, value, DIMENSION_CACHE_TTL)
+
+
+def _get_or_create(model, defaults=None, **lookup):
+    try:
+        obj, _ = model.objects.get_or_create(defaults=defaults, **lookup)
+    except IntegrityError:
+        # Lost a race with a concurrent insert outside a savepoint
+        obj = model.objects.get(**lookup)
+    return obj
+
+
+def _named_id(model, name):
+    if not name:
+        return None
+    name = name[:100]
+    key = _cache_key(f'{model._meta.db_table}:{name}')
+    cached = local_dimensions.get(key)
+    if cached is None:
+        cached = _get_or_create(model, name=name).id
+        _remember(key, cached)
+    return cached
+
+
+def browser_id(name):
+    """Id of an interned browser family"""
+    from .models import Browser
+    return _named_id(Browser, name)
+
+
+def os_id(name):
+    """Id of an interned operating system family"""
+    from .models import OperatingSystem
+    return _named_id(OperatingSystem, name)
+
+
+def parse_user_agent(value):
+    """Browser family, OS family and device type of a User-Agent string"""
+    from user_agents import parse
+
+    user_agent = parse(value)
+    device_type = 'desktop'
+    if user_agent.is_mobile:
+        device_type = 'mobile'
+    elif user_agent.is_tablet:
+        device_type = 'tablet'
+    elif user_agent.is_bot:
+        device_type = 'bot'
+    return user_agent.browser.family, user_agent.os.family, device_type
+
+
+def user_agent_dimensions(value):
+    """
+    ``(user_agent_id, browser_id, os_id, device_type)`` for a User-Agent
+    string, parsing it only the first time it is seen
+    """
+    from .models import UserAgent
+
+    value = value or ''
+    value_digest = digest(value)
+    key = _cache_key(f'user_agents:{value_digest}')
+    cached = local_dimensions.get(key)
+    if cached is not None:
+        return cached
+
+    user_agent = UserAgent.objects.filter(digest=value_digest).first()
+    if user_agent is None:
+        browser, os, device_type = parse_user_agent(value)
+        user_agent = _get_or_create(
+            UserAgent,
+            digest=value_digest,
+            defaults={
+                'value': value,
+                'browser_id': browser_id(browser),
+                'os_id': os_id(os),
+                'device_type': device_type,
+            }
+        )
+    cached = (
+        user_agent.id,
+        user_agent.browser_id,
+        user_agent.os_id,
+        user_agent.device_type,
+    )
+    _remember(key, cached)
+    return cached
+
+
+def referer_parts(url):
+    """``(url, host)`` a referer is interned as: no query, fragment or credentials"""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '')[:255]
+    except ValueError:
+        return url, ''
+    netloc = parts.netloc.rpartition('@')[2]
+    return urlunsplit((parts.scheme, netloc, parts.path, '', '')), host
+
+
+def referer_id(url):
+    """Id of an interned referer URL, or None for no referer"""
+    from .models import Referer
+
+    if not url:
+        return None
+    url, host = referer_parts(url)
+    if not url:
+        return None
+    url_digest = digest(url)
+    key = _cache_key(f'referers:{url_digest}')
+    cached = local_dimensions.get(key)
+    if cached is None:
+        cached = _get_or_create(
+            Referer,
+            digest=url_digest,
+            defaults={'url': url, 'host': host}
+        ).id
+        _remember(key, cached)
+    return cached
+
+
+def click_dimensions(user_agent, referer):
+    """Foreign key values for a new ``Click``"""
+    user_agent_id, browser, os, device_type = user_agent_dimensions(user_agent)
+    return {
+        'user_agent_id': user_agent_id,
+        'referer_id': referer_id(referer),
+        'browser_id': browser,
+        'os_id': os,
+        'device_type': device_type,
+    }
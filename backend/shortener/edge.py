@@ -0,0 +1,266 @@
+"""
+Edge redirects: nginx answers the hottest short codes itself.
+
+``publish_edge_map`` writes the hottest active codes to
+``EDGE_DIR/redirects.map`` as entries of an nginx ``map`` (see
+nginx/nginx.conf), each carrying the redirect status, ``Cache-Control``
+and destination from the URL's redirect policy. The file is only replaced
+when its contents change, and nginx's reload loop (nginx/edge-reload.sh)
+reloads gracefully when it does. Codes outside the map, destinations that
+cannot be written safely in nginx syntax and URLs expiring within
+``EDGE_MAP_EXPIRY_HORIZON`` (plus their cache lifetime, which the static
+map could not shorten as the expiry nears) keep going through Django.
+
+``invalidate_urls`` calls ``evict_edge`` for every edited, deleted or
+expired code, which drops it from the published map at once; the next
+publish adds it back with its new destination. A lock file serializes
+the publisher and evictions, so a publish that read the old row cannot
+overwrite an eviction.
+
+nginx logs each redirect it serves as one JSON line in an hourly file
+under ``EDGE_DIR/clicks/``. ``ClickLog`` reads them from the offsets saved
+after the last stored batch (clicks are counted at least once) and
+deletes files once they are read and nginx has moved on.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from config.sharding import urls_by_code
+
+logger = logging.getLogger(__name__)
+
+MAP_FILE = 'redirects.map'
+LOCK_FILE = '.redirects.lock'
+CLICK_LOG_DIR = 'clicks'
+OFFSETS_FILE = '.offsets.json'
+
+# Codes nginx routes to the redirect location
+EDGE_CODE = re.compile(r'^[a-zA-Z0-9]{3,20}$')
+# Quotes, backslashes and "$" (variables) cannot be escaped in nginx
+# strings; such destinations are left to Django
+EDGE_DESTINATION = re.compile(r'^[^\s"\\$\x00-\x1f\x7f]+$')
+
+PUBLISH_BATCH_SIZE = 1000
+# Files nginx may still be appending to are kept
+CLICK_LOG_GRACE_SECONDS = 120
+
+
+def map_path():
+    return os.path.join(settings.EDGE_DIR, MAP_FILE)
+
+
+def _write_atomic(path, content):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _map_lock():
+    os.makedirs(settings.EDGE_DIR, exist_ok=True)
+    with open(os.path.join(settings.EDGE_DIR, LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def is_edge_servable(short_code, destination):
+    return bool(EDGE_CODE.match(short_code) and EDGE_DESTINATION.match(destination))
+
+
+def edge_entries(limit):
+    """``(code, URL)`` of the hottest URLs nginx may answer"""
+    from .cache import hot_short_codes
+    from .models import URL
+
+    codes = hot_short_codes(limit)
+    horizon = timezone.now() + timedelta(seconds=settings.EDGE_MAP_EXPIRY_HORIZON)
+    entries = []
+    for start in range(0, len(codes), PUBLISH_BATCH_SIZE):
+        urls = urls_by_code(
+            URL.objects.filter(is_active=True).filter(
+                Q(expires_at__isnull=True) | Q(expires_at__gt=horizon)
+            ).only('short_code', 'original_url', 'expires_at', 'redirect_policy'),
+            codes[start:start + PUBLISH_BATCH_SIZE]
+        )
+        for url in urls:
+            if not is_edge_servable(url.short_code, url.original_url):
+                continue
+            # The map's max-age is fixed, so it must not reach the expiry
+            full_max_age = URL.policy_max_age(url.redirect_policy)
+            if url.expires_at and url.redirect_max_age(horizon) < full_max_age:
+                continue
+            entries.append((url.short_code, url))
+    return sorted(entries, key=lambda entry: entry[0])
+
+
+def render_map(entries):
+    """
+    Map lines of ``code "code|status|cache-control|destination";``.
+    nginx matches map keys case-insensitively while codes are case
+    sensitive, so the value repeats the code for nginx to compare exactly,
+    and codes differing only by case (one key to nginx) are left to Django
+    """
+    folded = Counter(code.lower() for code, _ in entries)
+    return ''.join(
+        f'{code} "{code}|{url.redirect_status()}|{url.redirect_cache_control()}|{url.original_url}";\n'
+        for code, url in entries
+        if folded[code.lower()] == 1
+    )
+
+
+def publish_edge_map(limit=None):
+    """
+    Write the map of the hottest codes if it changed. Returns the number
+    of entries and whether the file was replaced.
+    """
+    path = map_path()
+    with _map_lock():
+        content = render_map(edge_entries(limit or settings.EDGE_MAP_TOP_N))
+        try:
+            with open(path) as f:
+                if f.read() == content:
+                    return content.count('\n'), False
+        except FileNotFoundError:
+            pass
+        _write_atomic(path, content)
+    return content.count('\n'), True
+
+
+def remove_edge_map():
+    """Stop nginx answering any code; returns whether a map was published"""
+    path = map_path()
+    if not os.path.exists(path):
+        return False
+    with _map_lock():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def evict_edge(short_codes):
+    """Drop codes from the published map so nginx stops answering them"""
+    path = map_path()
+    if not os.path.exists(path):
+        return
+    codes = set(short_codes)
+    with _map_lock():
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        kept = [line for line in lines if line.split(' ', 1)[0] not in codes]
+        if len(kept) != len(lines):
+            _write_atomic(path, ''.join(kept))
+
+
+def client_ip(forwarded_for):
+    """
+    Client IP from nginx's ``$proxy_add_x_forwarded_for``, trusting the
+    same proxies as ``get_client_ip`` does for requests nginx forwards
+    """
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    if not hops:
+        return None
+    proxies = max(settings.TRUSTED_PROXY_COUNT, 1)
+    return hops[-proxies] if len(hops) >= proxies else hops[-1]
+
+
+def parse_click(line):
+    """Click event for ``ingest_clicks`` from one log line"""
+    record = json.loads(line)
+    return {
+        'code': record['code'],
+        'time': float(record['time']),
+        'ip_address': client_ip(record.get('forwarded_for', '')),
+        'user_agent': record.get('user_agent', ''),
+        'referer': record.get('referer', ''),
+    }
+
+
+class ClickLog:
+    """nginx's hourly click logs and how far they have been ingested"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(settings.EDGE_DIR, CLICK_LOG_DIR)
+        self.offsets_path = os.path.join(self.directory, OFFSETS_FILE)
+
+    def files(self):
+        """Log file names, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith('clicks-') and name.endswith('.log')
+        )
+
+    def offsets(self):
+        try:
+            with open(self.offsets_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def read(self, limit):
+        """
+        Up to ``limit`` click events after the saved offsets, and the
+        offsets to ``commit`` once they are stored
+        """
+        offsets = self.offsets()
+        events = []
+        for name in self.files():
+            path = os.path.join(self.directory, name)
+            offset = offsets.get(name, 0)
+            if os.path.getsize(path) < offset:
+                # Replaced since it was read
+                offset = 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if len(events) >= limit:
+                        break
+                    if not line.endswith(b'\n'):
+                        # nginx is still writing it
+                        break
+                    offset += len(line)
+                    try:
+                        events.append(parse_click(line))
+                    except (ValueError, KeyError, TypeError) as exc:
+                        logger.warning(f"Skipping bad click log line in {name}: {exc}")
+            offsets[name] = offset
+            if len(events) >= limit:
+                break
+        return events, offsets
+
+    def commit(self, offsets):
+        """Save offsets and delete the files that are fully read"""
+        files = self.files()
+        current = set(files)
+        offsets = {name: offset for name, offset in offsets.items() if name in current}
+        cutoff = time.time() - CLICK_LOG_GRACE_SECONDS
+        # The newest file is kept for nginx to append to
+        for name in files[:-1]:
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            if offsets.get(name) == stat.st_size and stat.st_mtime < cutoff:
+                os.remove(path)
+                del offsets[name]
+        _write_atomic(self.offsets_path, json.dumps(offsets))
@@ -0,0 +1,87 @@
+"""
+Expiry scheduling for URLs.
+
+Every active URL with an ``expires_at`` has a ``ScheduledExpiry`` row
+due in the minute it expires (``expires_at`` rounded up). URL saves keep
+the row in step (``shortener.signals``), and ``expire_due`` deactivates
+the URLs whose minute has come and evicts their cached copies. It reads
+them through the ``due_at`` index, so a run costs in proportion to what
+actually expires rather than scanning ``urls``. Rows left behind by an
+expiry moved with ``update()`` are scheduled again when they come due;
+``cleanup_expired_urls`` remains as a daily backstop for expiries set
+with ``update()``. Schedules are stored on their URL's shard and each
+shard is expired in turn.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from config.sharding import each_shard
+
+from .conditional import bump
+from .invalidation import invalidate_urls
+from .models import URL, ScheduledExpiry
+
+BATCH_SIZE = 1000
+
+
+def schedule_expiry(url):
+    """Schedule, move or cancel a URL's expiry after it was saved"""
+    schedules = ScheduledExpiry.objects.using(url._state.db)
+    if url.expires_at and url.is_active:
+        schedules.bulk_create(
+            [ScheduledExpiry(url=url, due_at=ScheduledExpiry.bucket(url.expires_at))],
+            update_conflicts=True,
+            unique_fields=['url'],
+            update_fields=['due_at']
+        )
+    else:
+        schedules.filter(url=url).delete()
+
+
+def expire_due(now=None, batch_size=BATCH_SIZE):
+    """Deactivate URLs whose expiry is due; returns how many"""
+    now = now or timezone.now()
+    expired = 0
+    for alias in each_shard():
+        expired += _expire_shard(alias, now, batch_size)
+    return expired
+
+
+def _expire_shard(alias, now, batch_size):
+    expired = 0
+    while True:
+        with transaction.atomic(using=alias):
+            due = ScheduledExpiry.objects.select_for_update(skip_locked=True).filter(
+                due_at__lte=now
+            )
+            url_ids = list(due.values_list('url_id', flat=True)[:batch_size])
+            if not url_ids:
+                break
+
+            # Rows that were not moved by a later save before this ran
+            urls = URL.objects.filter(
+                pk__in=url_ids,
+                is_active=True,
+                expires_at__lte=now
+            )
+            short_codes = list(urls.values_list('short_code', flat=True))
+            count = urls.update(is_active=False)
+            ScheduledExpiry.objects.filter(url_id__in=url_ids, due_at__lte=now).delete()
+            # Expiries moved with update() are scheduled again
+            moved = URL.objects.filter(pk__in=url_ids, is_active=True, expires_at__gt=now)
+            ScheduledExpiry.objects.bulk_create(
+                [
+                    ScheduledExpiry(url_id=url_id, due_at=ScheduledExpiry.bucket(expires_at))
+                    for url_id, expires_at in moved.values_list('id', 'expires_at')
+                ],
+                ignore_conflicts=True
+            )
+
+            # update() bypasses the model signals
+            invalidate_urls(short_codes)
+            if count:
+                bump('urls')
+        expired += count
+        if len(url_ids) < batch_size:
+            break
+    return expired
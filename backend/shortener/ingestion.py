@@ -0,0 +1,124 @@
+"""
+Batch click ingestion.
+
+``ingest_clicks`` stores a batch of click events (dicts with ``code``,
+``time``, ``ip_address``, ``user_agent`` and ``referer``) with a handful
+of queries per batch instead of several per click: one lookup of the
+URLs, one of returning visitors, one ``bulk_create`` and one counter
+update per URL. Sampling, interned dimensions and unique-visitor weights
+work as in ``track_click_async``.
+
+Clicks nginx answers at the edge (``shortener.edge``) arrive this way.
+A batch is split by shard and each part stored on its URLs' shard.
+"""
+import hashlib
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from config.sharding import on_shard, urls_by_code
+from monitoring.metrics import click_ingestion_lag
+
+from .dimensions import click_dimensions
+from .models import URL, Click
+from .sampling import in_sample, sample_rate
+
+logger = logging.getLogger(__name__)
+
+
+def visitor_session_id(ip_address, user_agent):
+    """Visitor id used for unique-click counting"""
+    return hashlib.md5(f"{ip_address}_{user_agent or ''}".encode()).hexdigest()
+
+
+def ingest_clicks(events):
+    """Store a batch of click events and return how many were counted"""
+    by_code = defaultdict(list)
+    for event in events:
+        by_code[event['code']].append(event)
+
+    urls = urls_by_code(
+        URL.objects.only('id', 'short_code', 'click_sample_rate'),
+        list(by_code)
+    )
+    # Codes deleted since nginx served them have nothing to count against
+    by_shard = defaultdict(dict)
+    for url in urls:
+        by_shard[url._state.db][url.short_code] = url
+
+    counted = stored = 0
+    for alias, shard_urls in by_shard.items():
+        with on_shard(alias):
+            shard_counted, shard_stored = _ingest(alias, shard_urls, by_code)
+        counted += shard_counted
+        stored += shard_stored
+
+    logger.info(f"Ingested {counted} clicks ({stored} stored) for {len(urls)} URLs")
+    return counted
+
+
+def _ingest(alias, urls, by_code):
+    now = time.time()
+    sampled = []
+    counters = {}
+    for code, url in urls.items():
+        url_events = by_code[code]
+        rate = sample_rate(url, len(url_events))
+        counters[url.pk] = {
+            'clicks': len(url_events),
+            'unique_clicks': 0,
+            'last_accessed': max(event['time'] for event in url_events),
+        }
+        for event in url_events:
+            click_ingestion_lag.observe(max(now - event['time'], 0))
+            session_id = visitor_session_id(event['ip_address'], event['user_agent'])
+            if in_sample(url.pk, session_id, rate):
+                sampled.append((url.pk, session_id, rate, event))
+
+    # Resolve interned dimension ids outside the transaction so they can
+    # be cached
+    dimensions = {}
+    clicks = []
+    for url_id, session_id, rate, event in sampled:
+        key = (event['user_agent'], event['referer'])
+        if key not in dimensions:
+            dimensions[key] = click_dimensions(*key)
+        clicks.append(Click(
+            url_id=url_id,
+            ip_address=event['ip_address'],
+            session_id=session_id,
+            weight=rate,
+            clicked_at=datetime.fromtimestamp(event['time'], dt_timezone.utc),
+            **dimensions[key]
+        ))
+
+    seen = set(Click.objects.filter(
+        url_id__in={click.url_id for click in clicks},
+        session_id__in={click.session_id for click in clicks}
+    ).values_list('url_id', 'session_id'))
+    for click in clicks:
+        visitor = (click.url_id, click.session_id)
+        if visitor not in seen:
+            seen.add(visitor)
+            # A sampled visitor stands for `weight` visitors
+            counters[click.url_id]['unique_clicks'] += click.weight
+
+    with transaction.atomic(using=alias):
+        Click.objects.bulk_create(clicks)
+        for url_id, counter in counters.items():
+            # Redirects served by Django may have touched the URL since
+            last_accessed = Value(
+                datetime.fromtimestamp(counter['last_accessed'], dt_timezone.utc)
+            )
+            URL.objects.filter(pk=url_id).update(
+                clicks=F('clicks') + counter['clicks'],
+                unique_clicks=F('unique_clicks') + counter['unique_clicks'],
+                last_accessed=Greatest(Coalesce('last_accessed', last_accessed), last_accessed)
+            )
+
+    return sum(counter['clicks'] for counter in counters.values()), len(clicks)
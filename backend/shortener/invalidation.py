@@ -0,0 +1,117 @@
+"""
+Cache invalidation for URL mutations.
+
+``invalidate_urls`` deletes the shared ``url_``/``qrcode_`` keys, evicts
+this process's local cache, drops the codes from nginx's edge redirect
+map (``shortener.edge``) and publishes them on
+``CACHE_INVALIDATION_CHANNEL``. Every worker runs a subscriber thread that
+evicts the published codes from its own local cache; if the subscription
+drops, the local cache is cleared since messages may have been missed.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+
+from config.sharding import current_db
+
+from .cache import local_urls, qrcode_cache_key, url_cache_key
+from .edge import evict_edge
+
+logger = logging.getLogger(__name__)
+
+_subscriber_lock = threading.Lock()
+_subscriber_pid = None
+
+
+def _redis_client():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def evict_local(short_codes):
+    """Drop codes from this process's local cache"""
+    for code in short_codes:
+        local_urls.delete(url_cache_key(code))
+
+
+def _invalidate(short_codes):
+    keys = []
+    for code in short_codes:
+        keys.extend([url_cache_key(code), qrcode_cache_key(code)])
+    cache.delete_many(keys)
+    evict_local(short_codes)
+    try:
+        evict_edge(short_codes)
+    except OSError as exc:
+        logger.error(f"Error evicting edge redirects: {exc}")
+
+    client = _redis_client()
+    if client is not None:
+        try:
+            client.publish(settings.CACHE_INVALIDATION_CHANNEL, ','.join(short_codes))
+        except Exception as exc:
+            logger.error(f"Error publishing cache invalidation: {exc}")
+
+
+def invalidate_urls(short_codes):
+    """
+    Evict cached copies of these codes everywhere.
+
+    Inside a transaction the eviction happens now and again on commit, so a
+    request that refills the cache from the old row in between is undone.
+    """
+    short_codes = [code for code in short_codes if code]
+    if not short_codes:
+        return
+    _invalidate(short_codes)
+    # The transaction of the shard being written, when sharded
+    db = current_db()
+    if connections[db].in_atomic_block:
+        transaction.on_commit(lambda: _invalidate(short_codes), using=db)
+
+
+def _listen():
+    while True:
+        client = _redis_client()
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(settings.CACHE_INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                data = message['data']
+                if isinstance(data, bytes):
+                    data = data.decode()
+                evict_local(data.split(','))
+        except Exception as exc:
+            logger.warning(f"Cache invalidation subscriber reconnecting: {exc}")
+        # We may have missed messages while disconnected
+        local_urls.clear()
+        time.sleep(1)
+
+
+def ensure_subscriber():
+    """
+    Start this process's subscriber thread once. Called lazily so that it
+    runs in each forked gunicorn/Celery worker rather than the master.
+    """
+    global _subscriber_pid
+    if _subscriber_pid == os.getpid():
+        return
+    with _subscriber_lock:
+        if _subscriber_pid == os.getpid():
+            return
+        _subscriber_pid = os.getpid()
+        if _redis_client() is None:
+            return
+        threading.Thread(
+            target=_listen,
+            name='url-cache-invalidation',
+            daemon=True
+        ).start()
@@ -0,0 +1,122 @@
+import random
+import statistics
+import time
+import uuid
+from itertools import count, islice
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from config.sharding import shard_for_code, shards
+from shortener.dimensions import click_dimensions
+from shortener.models import URL, Click
+from shortener.stats import click_breakdown
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0',
+]
+REFERERS = ['', 'https://www.google.com/', 'https://news.ycombinator.com/', 'https://t.co/abc']
+COUNTRIES = ['US', 'DE', 'IN', 'BR', 'GB', '']
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure click insert throughput and per-URL stats latency on the "
+        "current schema; run before and after migrating to compare indexes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--urls', type=int, default=20)
+        parser.add_argument('--single-rows', type=int, default=1000,
+                            help="Clicks inserted one at a time, like track_click_async")
+        parser.add_argument('--bulk-rows', type=int, default=50000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--stats-runs', type=int, default=50)
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the generated URLs and clicks")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Click indexes: {', '.join(self.click_indexes())}")
+
+        run = uuid.uuid4().hex[:8]
+        # Measured on the default database, so only codes that belong on it
+        codes = islice(
+            (code for code in (f'bc{run}{i}' for i in count()) if shard_for_code(code) == shards()[0]),
+            options['urls']
+        )
+        urls = [
+            URL.objects.create(
+                original_url=f'https://bench.example.com/{run}/{i}',
+                short_code=code
+            )
+            for i, code in enumerate(codes)
+        ]
+        dimensions = [
+            click_dimensions(user_agent, referer)
+            for user_agent in USER_AGENTS
+            for referer in REFERERS
+        ]
+
+        try:
+            timings = []
+            for i in range(options['single_rows']):
+                click = self.make_click(urls, dimensions, i)
+                started = time.perf_counter()
+                click.save()
+                timings.append(time.perf_counter() - started)
+            self.report_inserts('single inserts', options['single_rows'], sum(timings))
+
+            started = time.perf_counter()
+            batch = []
+            for i in range(options['bulk_rows']):
+                batch.append(self.make_click(urls, dimensions, i))
+                if len(batch) >= options['batch_size']:
+                    Click.objects.bulk_create(batch)
+                    batch = []
+            if batch:
+                Click.objects.bulk_create(batch)
+            self.report_inserts('bulk inserts', options['bulk_rows'], time.perf_counter() - started)
+
+            timings = []
+            for i in range(options['stats_runs']):
+                started = time.perf_counter()
+                click_breakdown(urls[i % len(urls)])
+                timings.append(time.perf_counter() - started)
+            self.report_latency('stats breakdown', timings)
+        finally:
+            if not options['keep']:
+                Click.objects.filter(url__in=urls).delete()
+                URL.objects.filter(pk__in=[url.pk for url in urls]).delete()
+
+    def make_click(self, urls, dimensions, i):
+        return Click(
+            url=urls[i % len(urls)],
+            ip_address=f'10.{i % 256}.{i // 256 % 256}.1',
+            country=random.choice(COUNTRIES),
+            session_id=f'session-{i % 5000}',
+            **random.choice(dimensions)
+        )
+
+    def click_indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Click._meta.db_table
+            )
+        return sorted(
+            f"{name} ({info.get('type') or 'btree'})"
+            for name, info in constraints.items()
+            if info['index'] and not info['primary_key']
+        )
+
+    def report_inserts(self, label, rows, seconds):
+        self.stdout.write(f"{label:>16}: {rows / seconds:,.0f} rows/s ({rows} rows in {seconds:.2f}s)")
+
+    def report_latency(self, label, timings):
+        timings.sort()
+        self.stdout.write(
+            f"{label:>16}: mean {statistics.mean(timings) * 1e3:.2f}ms, "
+            f"p50 {timings[len(timings) // 2] * 1e3:.2f}ms, "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e3:.2f}ms"
+        )
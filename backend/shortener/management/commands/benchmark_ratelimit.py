@@ -0,0 +1,51 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from shortener.ratelimit import RateLimiter
+
+# Counters of the benchmark's clients, apart from those of real clients
+BENCH_KEY_PREFIX = 'ratelimit-bench'
+
+
+class Command(BaseCommand):
+    help = "Measure rate-limit decision overhead against the configured backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--decisions', type=int, default=10000)
+        parser.add_argument('--clients', type=int, default=100)
+        parser.add_argument('--policy', default='redirect')
+
+    def handle(self, *args, **options):
+        self.limiter = RateLimiter(key_prefix=BENCH_KEY_PREFIX)
+        backend = type(self.limiter.backend).__name__
+        self.stdout.write(f"Backend: {backend}, policy: {options['policy']}")
+
+        # Fresh clients: every decision goes to the backend
+        allowed = self.run(options, lambda i: f"bench-{i % options['clients']}")
+        # One hammering client: after the first rejection decisions are local
+        blocked = self.run(options, lambda i: 'bench-blocked')
+
+        self.report('allowed/mixed clients', allowed)
+        self.report('single blocked client', blocked)
+        self.limiter.reset()
+
+    def run(self, options, identity):
+        self.limiter.reset()
+        timings = []
+        for i in range(options['decisions']):
+            started = time.perf_counter()
+            self.limiter.check(options['policy'], identity(i))
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def report(self, label, timings):
+        timings.sort()
+        total = sum(timings)
+        self.stdout.write(
+            f"{label:>24}: {len(timings) / total:,.0f} decisions/s, "
+            f"mean {statistics.mean(timings) * 1e6:.1f}us, "
+            f"p50 {timings[len(timings) // 2] * 1e6:.1f}us, "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.1f}us"
+        )
@@ -0,0 +1,80 @@
+import statistics
+import time
+import uuid
+from itertools import count, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from config.sharding import is_sharded, shard_for_code, shards
+from shortener.models import URL, ShardSequence
+from shortener.serializers import URLListSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare URL list serialization through ModelSerializer instances "
+        "with the .values() fast path on pages of generated URLs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help="URLs per page")
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the generated URLs")
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        now = timezone.now()
+        # One page is read from one shard, so only codes that belong on
+        # it are generated, with ids allocated there
+        alias = shards()[0]
+        codes = list(islice(
+            (code for code in (f'bs{run}{i}' for i in count()) if shard_for_code(code) == alias),
+            options['rows']
+        ))
+        ids = ShardSequence.next_ids(alias, len(codes)) if is_sharded() else [None] * len(codes)
+        URL.objects.using(alias).bulk_create([
+            URL(
+                id=pk,
+                original_url=f'https://bench.example.com/{run}/{i}',
+                short_code=code,
+                title=f'Benchmark {i}' if i % 2 else None,
+                clicks=i,
+                expires_at=now if i % 3 == 0 else None
+            )
+            for i, (pk, code) in enumerate(zip(ids, codes))
+        ])
+        queryset = URL.objects.using(alias).filter(short_code__startswith=f'bs{run}').order_by('-clicks')
+
+        try:
+            def model_serializer():
+                return URLListSerializer(list(queryset.all()), many=True).data
+
+            def values_rows():
+                return URLListSerializer.from_values(URLListSerializer.values(queryset))
+
+            if model_serializer() != values_rows():
+                raise CommandError("The two paths produced different output")
+
+            self.stdout.write(f"{options['rows']} rows per page, {options['runs']} runs")
+            baseline = self.report('ModelSerializer', model_serializer, options['runs'])
+            fast = self.report('values() rows', values_rows, options['runs'])
+            self.stdout.write(f"{'speedup':>16}: {baseline / fast:.1f}x")
+        finally:
+            if not options['keep']:
+                queryset.delete()
+
+    def report(self, label, serialize, runs):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            serialize()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.stdout.write(
+            f"{label:>16}: mean {statistics.mean(timings) * 1e3:.2f}ms, "
+            f"p50 {timings[len(timings) // 2] * 1e3:.2f}ms, "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e3:.2f}ms"
+        )
+        return statistics.mean(timings)
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortener.resharding import BATCH_SIZE, Resharder
+
+
+class Command(BaseCommand):
+    help = "Move URLs, with their clicks, to the shard their short code belongs on"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="URLs moved per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the URLs that would move")
+
+    def handle(self, *args, **options):
+        if not options['dry_run'] and not settings.SHARD_RESHARDING:
+            self.stderr.write(self.style.WARNING(
+                "SHARD_RESHARDING is off: codes that have not moved yet "
+                "are not found on their new shard until they do"
+            ))
+
+        moved = Resharder(batch_size=options['batch_size']).run(dry_run=options['dry_run'])
+        for (source, target), count in sorted(moved.items()):
+            self.stdout.write(f"{source} -> {target}: {count} URLs")
+        verb = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {sum(moved.values())} URLs"))
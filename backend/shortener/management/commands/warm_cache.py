@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from shortener.cache import url_cache_is_warm, warm_url_cache
+
+
+class Command(BaseCommand):
+    help = "Preload the hottest short codes into the redirect cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, help="Number of codes (CACHE_WARM_TOP_N)")
+        parser.add_argument('--batch-size', type=int, help="Codes per set_many (CACHE_WARM_BATCH_SIZE)")
+        parser.add_argument('--concurrency', type=int, help="Parallel cache writers (CACHE_WARM_CONCURRENCY)")
+        parser.add_argument(
+            '--if-cold',
+            action='store_true',
+            help="Skip when the cache is already warm (e.g. on every deploy)"
+        )
+
+    def handle(self, *args, **options):
+        if options['if_cold'] and url_cache_is_warm():
+            self.stdout.write("URL cache is already warm")
+            return
+
+        def progress(done, total):
+            if options['verbosity'] > 0:
+                self.stdout.write(f"\r{done}/{total} URLs cached", ending='')
+                self.stdout.flush()
+
+        count = warm_url_cache(
+            limit=options['top'],
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            progress=progress
+        )
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f"Warmed {count} URLs"))
@@ -0,0 +1,101 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0001_initial'),
+    ]
+
+    operations = [
+        # Keep the text columns until 0003 has copied them into the lookup tables
+        migrations.RenameField(
+            model_name='click',
+            old_name='user_agent',
+            new_name='legacy_user_agent',
+        ),
+        migrations.RenameField(
+            model_name='click',
+            old_name='referer',
+            new_name='legacy_referer',
+        ),
+        migrations.RenameField(
+            model_name='click',
+            old_name='browser',
+            new_name='legacy_browser',
+        ),
+        migrations.RenameField(
+            model_name='click',
+            old_name='os',
+            new_name='legacy_os',
+        ),
+        migrations.CreateModel(
+            name='Browser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'db_table': 'browsers',
+            },
+        ),
+        migrations.CreateModel(
+            name='OperatingSystem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'db_table': 'operating_systems',
+            },
+        ),
+        migrations.CreateModel(
+            name='Referer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text='SHA-1 of the URL; long values cannot be indexed directly', max_length=40, unique=True)),
+                ('url', models.TextField()),
+                ('host', models.CharField(blank=True, db_index=True, max_length=255)),
+            ],
+            options={
+                'db_table': 'referers',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text='SHA-1 of the value; long values cannot be indexed directly', max_length=40, unique=True)),
+                ('value', models.TextField()),
+                ('device_type', models.CharField(blank=True, max_length=50, null=True)),
+                ('browser', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='shortener.browser')),
+                ('os', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='shortener.operatingsystem')),
+            ],
+            options={
+                'db_table': 'user_agents',
+            },
+        ),
+        migrations.AddField(
+            model_name='click',
+            name='user_agent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='shortener.useragent'),
+        ),
+        migrations.AddField(
+            model_name='click',
+            name='referer',
+            field=models.ForeignKey(blank=True, db_index=False, help_text='HTTP referer', null=True, on_delete=django.db.models.deletion.PROTECT, to='shortener.referer'),
+        ),
+        migrations.AddField(
+            model_name='click',
+            name='browser',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='shortener.browser'),
+        ),
+        migrations.AddField(
+            model_name='click',
+            name='os',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='shortener.operatingsystem'),
+        ),
+    ]
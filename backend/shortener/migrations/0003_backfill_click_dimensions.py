@@ -0,0 +1,151 @@
+"""
+Copy the legacy click text columns into the interned dimension tables.
+
+Runs outside a single transaction: each chunk of clicks is committed on
+its own, so the backfill can be interrupted and resumed (already converted
+rows are skipped) and does not hold locks on the whole table.
+"""
+import hashlib
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 5000
+# Ids remembered by the backfill; referers and user agents past this are
+# looked up again, so memory stays flat however many distinct values
+INTERNED_IDS = 50000
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def _referer_parts(url):
+    # Interned as scheme, host and path, like shortener.dimensions.referer_parts
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '')[:255]
+    except ValueError:
+        return url, ''
+    netloc = parts.netloc.rpartition('@')[2]
+    return urlunsplit((parts.scheme, netloc, parts.path, '', '')), host
+
+
+class _Interner:
+    """get_or_create with an LRU of ids in front, for the historical models"""
+
+    def __init__(self, apps, db, size=INTERNED_IDS):
+        self.db = db
+        self.models = {
+            name: apps.get_model('shortener', name)
+            for name in ('Browser', 'OperatingSystem', 'UserAgent', 'Referer')
+        }
+        self.ids = OrderedDict()
+        self.size = size
+
+    def get(self, model_name, key, **defaults):
+        cache_key = (model_name, key)
+        if cache_key in self.ids:
+            self.ids.move_to_end(cache_key)
+            return self.ids[cache_key]
+        lookup = {'name': key} if model_name in ('Browser', 'OperatingSystem') else {'digest': key}
+        obj, _ = self.models[model_name].objects.using(self.db).get_or_create(
+            defaults=defaults, **lookup
+        )
+        self.ids[cache_key] = obj.id
+        if len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+        return obj.id
+
+    def named(self, model_name, name):
+        return self.get(model_name, name[:100]) if name else None
+
+
+def backfill_dimensions(apps, schema_editor):
+    Click = apps.get_model('shortener', 'Click')
+    db = schema_editor.connection.alias
+    interner = _Interner(apps, db)
+
+    pending = Click.objects.using(db).filter(
+        user_agent__isnull=True,
+        referer__isnull=True,
+        browser__isnull=True,
+        os__isnull=True,
+    ).order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(
+            pending.filter(id__gt=last_id).only(
+                'id', 'legacy_user_agent', 'legacy_referer',
+                'legacy_browser', 'legacy_os', 'device_type'
+            )[:CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        with transaction.atomic(using=db):
+            for click in chunk:
+                click.browser_id = interner.named('Browser', click.legacy_browser)
+                click.os_id = interner.named('OperatingSystem', click.legacy_os)
+                if click.legacy_user_agent is not None:
+                    click.user_agent_id = interner.get(
+                        'UserAgent',
+                        _digest(click.legacy_user_agent),
+                        value=click.legacy_user_agent,
+                        browser_id=click.browser_id,
+                        os_id=click.os_id,
+                        device_type=click.device_type,
+                    )
+                referer, host = _referer_parts(click.legacy_referer or '')
+                if referer:
+                    click.referer_id = interner.get(
+                        'Referer',
+                        _digest(referer),
+                        url=referer,
+                        host=host,
+                    )
+            Click.objects.using(db).bulk_update(
+                chunk,
+                ['user_agent', 'referer', 'browser', 'os'],
+                batch_size=1000
+            )
+        last_id = chunk[-1].id
+
+
+def restore_legacy_columns(apps, schema_editor):
+    Click = apps.get_model('shortener', 'Click')
+    db = schema_editor.connection.alias
+
+    clicks = Click.objects.using(db).select_related(
+        'user_agent', 'referer', 'browser', 'os'
+    ).order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(clicks.filter(id__gt=last_id)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        for click in chunk:
+            click.legacy_user_agent = click.user_agent.value if click.user_agent else None
+            click.legacy_referer = click.referer.url if click.referer else None
+            click.legacy_browser = click.browser.name if click.browser else None
+            click.legacy_os = click.os.name if click.os else None
+        with transaction.atomic(using=db):
+            Click.objects.using(db).bulk_update(
+                chunk,
+                ['legacy_user_agent', 'legacy_referer', 'legacy_browser', 'legacy_os'],
+                batch_size=1000
+            )
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('shortener', '0002_click_dimensions'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_dimensions, restore_legacy_columns),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0003_backfill_click_dimensions'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='click',
+            name='legacy_user_agent',
+        ),
+        migrations.RemoveField(
+            model_name='click',
+            name='legacy_referer',
+        ),
+        migrations.RemoveField(
+            model_name='click',
+            name='legacy_browser',
+        ),
+        migrations.RemoveField(
+            model_name='click',
+            name='legacy_os',
+        ),
+    ]
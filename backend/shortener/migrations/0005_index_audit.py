@@ -0,0 +1,104 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:40
+
+import config.indexes
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _index_options(schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        return {'concurrently': True}
+    return {}
+
+
+def drop_field_index(field_name):
+    """Drop a click field's db_index (and no other index on it) concurrently"""
+    def forwards(apps, schema_editor):
+        model = apps.get_model('shortener', 'Click')
+        column = model._meta.get_field(field_name).column
+        names = schema_editor._constraint_names(
+            model, [column], index=True, type_=models.Index.suffix,
+            exclude={index.name for index in model._meta.indexes}
+        )
+        for name in names:
+            schema_editor.execute(schema_editor._delete_index_sql(model, name, **_index_options(schema_editor)))
+
+    def backwards(apps, schema_editor):
+        model = apps.get_model('shortener', 'Click')
+        field = model._meta.get_field(field_name)
+        schema_editor.execute(schema_editor._create_index_sql(model, fields=[field], **_index_options(schema_editor)))
+
+    return migrations.RunPython(forwards, backwards)
+
+
+class Migration(migrations.Migration):
+    # The clicks table takes writes throughout: its indexes are built and
+    # dropped concurrently, which cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('shortener', '0004_remove_click_legacy_columns'),
+    ]
+
+    operations = [
+        # Build the replacement indexes before dropping the old ones
+        config.indexes.PortableAddIndexConcurrently(
+            model_name='click',
+            index=config.indexes.PortableBrinIndex(autosummarize=True, fields=['clicked_at'], name='clicks_clicked_at_brin'),
+        ),
+        config.indexes.PortableAddIndexConcurrently(
+            model_name='click',
+            index=models.Index(fields=['url', 'clicked_at'], include=('country', 'device_type', 'browser', 'referer'), name='clicks_url_time_cover_idx'),
+        ),
+        config.indexes.PortableAddIndexConcurrently(
+            model_name='click',
+            index=models.Index(fields=['url', 'session_id'], name='clicks_url_session_idx'),
+        ),
+        config.indexes.PortableRemoveIndexConcurrently(
+            model_name='click',
+            name='clicks_url_id_afa311_idx',
+        ),
+        config.indexes.PortableRemoveIndexConcurrently(
+            model_name='click',
+            name='clicks_clicked_fa0a3b_idx',
+        ),
+        config.indexes.PortableRemoveIndexConcurrently(
+            model_name='click',
+            name='clicks_session_c12dbd_idx',
+        ),
+        config.indexes.PortableRemoveIndexConcurrently(
+            model_name='url',
+            name='urls_short_c_484089_idx',
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='click',
+                    name='clicked_at',
+                    field=models.DateTimeField(auto_now_add=True),
+                ),
+            ],
+            database_operations=[drop_field_index('clicked_at')],
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='click',
+                    name='url',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='click_records', to='shortener.url'),
+                ),
+            ],
+            database_operations=[drop_field_index('url')],
+        ),
+        migrations.AlterField(
+            model_name='url',
+            name='original_url',
+            field=models.URLField(help_text='The original long URL', max_length=2048, validators=[django.core.validators.URLValidator()]),
+        ),
+        migrations.AlterField(
+            model_name='url',
+            name='short_code',
+            field=models.CharField(help_text='The unique short code for the URL', max_length=20, unique=True),
+        ),
+    ]
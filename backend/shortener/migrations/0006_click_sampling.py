@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:05
+
+import config.indexes
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Indexes on clicks are built and dropped concurrently, outside a
+    # transaction, so writes carry on during the migration
+    atomic = False
+
+    dependencies = [
+        ('shortener', '0005_index_audit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='click',
+            name='weight',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='url',
+            name='click_sample_rate',
+            field=models.PositiveIntegerField(blank=True, help_text='Store 1 in N click rows; empty uses the global policy', null=True, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        # The new covering index is built next to the old one, which keeps
+        # serving stats until it is swapped in under its name
+        config.indexes.PortableAddIndexConcurrently(
+            model_name='click',
+            index=models.Index(fields=['url', 'clicked_at'], include=('country', 'device_type', 'browser', 'referer', 'weight'), name='clicks_url_time_cover_new'),
+        ),
+        config.indexes.PortableRemoveIndexConcurrently(
+            model_name='click',
+            name='clicks_url_time_cover_idx',
+        ),
+        migrations.RenameIndex(
+            model_name='click',
+            new_name='clicks_url_time_cover_idx',
+            old_name='clicks_url_time_cover_new',
+        ),
+    ]
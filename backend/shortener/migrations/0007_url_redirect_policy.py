@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0006_click_sampling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='redirect_policy',
+            field=models.CharField(choices=[('301', '301 Moved Permanently (cached)'), ('308', '308 Permanent Redirect (cached)'), ('302', '302 Found (cached briefly)'), ('307', '307 Temporary Redirect (cached briefly)'), ('tracking', '302 Found, never cached (every click counted)')], default='tracking', help_text='Redirect status and whether browsers and CDNs may cache it', max_length=10),
+        ),
+    ]
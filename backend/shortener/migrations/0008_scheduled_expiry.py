@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0007_url_redirect_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledExpiry',
+            fields=[
+                ('url', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='scheduled_expiry', serialize=False, to='shortener.url')),
+                ('due_at', models.DateTimeField(db_index=True, help_text='expires_at rounded up to the minute')),
+            ],
+            options={
+                'db_table': 'scheduled_expiries',
+            },
+        ),
+    ]
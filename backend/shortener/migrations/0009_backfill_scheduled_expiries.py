@@ -0,0 +1,56 @@
+"""
+Schedule the expiry of every active URL that has an expires_at.
+
+URLs already past their expiry get a due time in the past, so the first
+run of expire_due_urls deactivates them. Chunks are committed separately,
+and URLs that already have a schedule are skipped, so the backfill can
+be interrupted and resumed.
+"""
+from datetime import timedelta
+
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 5000
+
+
+def _bucket(expires_at):
+    due_at = expires_at.replace(second=0, microsecond=0)
+    if due_at < expires_at:
+        due_at += timedelta(minutes=1)
+    return due_at
+
+
+def backfill_schedule(apps, schema_editor):
+    URL = apps.get_model('shortener', 'URL')
+    ScheduledExpiry = apps.get_model('shortener', 'ScheduledExpiry')
+    db = schema_editor.connection.alias
+
+    pending = URL.objects.using(db).filter(
+        is_active=True,
+        expires_at__isnull=False,
+        scheduled_expiry__isnull=True
+    ).order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(pending.filter(id__gt=last_id).values_list('id', 'expires_at')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        with transaction.atomic(using=db):
+            ScheduledExpiry.objects.using(db).bulk_create(
+                [ScheduledExpiry(url_id=url_id, due_at=_bucket(expires_at)) for url_id, expires_at in chunk],
+                ignore_conflicts=True
+            )
+        last_id = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('shortener', '0008_scheduled_expiry'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_schedule, migrations.RunPython.noop),
+    ]
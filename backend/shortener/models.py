@@ -1,7 +1,20 @@
-from django.db import models
-from django.core.validators import URLValidator
+from django.conf import settings
+from django.db import models, router, transaction
+from django.core.validators import MinValueValidator, URLValidator
 from django.utils import timezone
+from datetime import timedelta
 from hashids import Hashids
+
+from config.indexes import PortableBrinIndex
+from config.sharding import (
+    MAX_SHARDS,
+    code_shards,
+    encode_id,
+    fan_out,
+    is_sharded,
+    shard_for_id,
+    shard_order,
+)
 import random
 import string
 
@@ -9,16 +22,31 @@ import string
 class URL(models.Model):
     """Model to store URL mappings with analytics"""
     
+    # Redirect policies: permanent and temporary redirects may be cached by
+    # browsers and CDNs (repeat visits then go uncounted); tracking ones
+    # never are, so every click reaches us
+    REDIRECT_301 = '301'
+    REDIRECT_308 = '308'
+    REDIRECT_302 = '302'
+    REDIRECT_307 = '307'
+    REDIRECT_TRACKING = 'tracking'
+    REDIRECT_POLICY_CHOICES = [
+        (REDIRECT_301, '301 Moved Permanently (cached)'),
+        (REDIRECT_308, '308 Permanent Redirect (cached)'),
+        (REDIRECT_302, '302 Found (cached briefly)'),
+        (REDIRECT_307, '307 Temporary Redirect (cached briefly)'),
+        (REDIRECT_TRACKING, '302 Found, never cached (every click counted)'),
+    ]
+    PERMANENT_REDIRECTS = frozenset({REDIRECT_301, REDIRECT_308})
+    
     original_url = models.URLField(
         max_length=2048,
         validators=[URLValidator()],
-        db_index=True,
         help_text="The original long URL"
     )
     short_code = models.CharField(
         max_length=20,
         unique=True,
-        db_index=True,
         help_text="The unique short code for the URL"
     )
     custom_code = models.BooleanField(
@@ -51,6 +79,12 @@ class URL(models.Model):
         blank=True,
         help_text="Last time the URL was accessed"
     )
+    click_sample_rate = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(1)],
+        help_text="Store 1 in N click rows; empty uses the global policy"
+    )
     
     # Status fields
     is_active = models.BooleanField(
@@ -62,6 +96,12 @@ class URL(models.Model):
         blank=True,
         help_text="Optional expiration date"
     )
+    redirect_policy = models.CharField(
+        max_length=10,
+        choices=REDIRECT_POLICY_CHOICES,
+        default=REDIRECT_TRACKING,
+        help_text="Redirect status and whether browsers and CDNs may cache it"
+    )
     
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
@@ -83,8 +123,8 @@ class URL(models.Model):
     class Meta:
         db_table = 'urls'
         ordering = ['-created_at']
+        # short_code is indexed by its unique constraint
         indexes = [
-            models.Index(fields=['short_code']),
             models.Index(fields=['created_at']),
             models.Index(fields=['-clicks']),
             models.Index(fields=['is_active', 'expires_at']),
@@ -93,13 +133,55 @@ class URL(models.Model):
     def __str__(self):
         return f"{self.short_code} -> {self.original_url[:50]}"
     
+    def save(self, *args, **kwargs):
+        # Sharded URL ids are allocated per shard and carry its index
+        if self.pk is None and is_sharded():
+            using = kwargs.get('using') or router.db_for_write(URL, instance=self)
+            self.pk = ShardSequence.next_id(using)
+            kwargs.setdefault('force_insert', True)
+        super().save(*args, **kwargs)
+    
+    @staticmethod
+    def find(short_code, **filters):
+        """The URL with this code, read from its shard, or None"""
+        for alias in code_shards(short_code):
+            url = URL.objects.using(alias).filter(short_code=short_code, **filters).first()
+            if url is not None:
+                return url
+        return None
+    
+    @staticmethod
+    def code_taken(short_code):
+        """Whether a URL has this code, asking only the shard it belongs on"""
+        return any(
+            URL.objects.using(alias).filter(short_code=short_code).exists()
+            for alias in code_shards(short_code)
+        )
+    
+    @staticmethod
+    def get_by_id(pk):
+        """
+        The URL with this id from the shard it was allocated on, then the
+        others (it may have been moved, or predate sharding)
+        """
+        for alias in shard_order(shard_for_id(pk)):
+            url = URL.objects.using(alias).filter(pk=pk).first()
+            if url is not None:
+                return url
+        raise URL.DoesNotExist(f"URL {pk} does not exist")
+    
     @staticmethod
     def generate_short_code(length=6):
         """Generate a random short code"""
+        from .bloom import code_may_be_taken
+        
         characters = string.ascii_letters + string.digits
         while True:
             code = ''.join(random.choices(characters, k=length))
-            if not URL.objects.filter(short_code=code).exists():
+            # Only possible collisions need the database
+            if not code_may_be_taken(code):
+                return code
+            if not URL.code_taken(code):
                 return code
     
     @staticmethod
@@ -114,20 +196,187 @@ class URL(models.Model):
             return timezone.now() > self.expires_at
         return False
     
-    def increment_clicks(self, is_unique=False):
+    def redirect_status(self):
+        """HTTP status of this URL's redirect"""
+        if self.redirect_policy == self.REDIRECT_TRACKING:
+            return 302
+        return int(self.redirect_policy)
+    
+    @classmethod
+    def policy_max_age(cls, redirect_policy):
+        """Longest time a redirect under this policy may be cached"""
+        if redirect_policy in cls.PERMANENT_REDIRECTS:
+            return settings.REDIRECT_PERMANENT_MAX_AGE
+        if redirect_policy == cls.REDIRECT_TRACKING:
+            return 0
+        return settings.REDIRECT_TEMPORARY_MAX_AGE
+    
+    def redirect_max_age(self, now=None):
+        """Seconds the redirect may be cached, never past the expiry"""
+        max_age = self.policy_max_age(self.redirect_policy)
+        if self.expires_at:
+            remaining = (self.expires_at - (now or timezone.now())).total_seconds()
+            max_age = max(min(max_age, int(remaining)), 0)
+        return max_age
+    
+    def redirect_cache_control(self, now=None):
+        """``Cache-Control`` of this URL's redirect"""
+        max_age = self.redirect_max_age(now)
+        if not max_age:
+            return 'max-age=0, no-cache, no-store, must-revalidate, private'
+        return f'public, max-age={max_age}'
+    
+    def increment_clicks(self, is_unique=False, unique_weight=1):
         """Increment click count"""
         self.clicks = models.F('clicks') + 1
         if is_unique:
-            self.unique_clicks = models.F('unique_clicks') + 1
+            self.unique_clicks = models.F('unique_clicks') + unique_weight
         self.last_accessed = timezone.now()
         self.save(update_fields=['clicks', 'unique_clicks', 'last_accessed'])
     
     def get_short_url(self):
         """Get the full short URL"""
-        from django.conf import settings
         return f"{settings.BASE_URL}/{self.short_code}"
 
 
+class ScheduledExpiry(models.Model):
+    """Upcoming expiry of an active URL, bucketed by minute"""
+    
+    url = models.OneToOneField(
+        URL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='scheduled_expiry'
+    )
+    due_at = models.DateTimeField(
+        db_index=True,
+        help_text="expires_at rounded up to the minute"
+    )
+    
+    class Meta:
+        db_table = 'scheduled_expiries'
+    
+    def __str__(self):
+        return f"{self.url_id} due {self.due_at}"
+    
+    @staticmethod
+    def bucket(expires_at):
+        """The minute an expiry is due in, so due_at is never early"""
+        due_at = expires_at.replace(second=0, microsecond=0)
+        if due_at < expires_at:
+            due_at += timedelta(minutes=1)
+        return due_at
+
+
+class ShardSequence(models.Model):
+    """Counter the ids of URLs created on a shard are allocated from"""
+    
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'shard_sequences'
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+    
+    @classmethod
+    def next_id(cls, using, name='urls'):
+        """Next URL id on shard ``using``; no other shard can hand it out"""
+        return cls.next_ids(using, 1, name)[0]
+    
+    @classmethod
+    def next_ids(cls, using, count, name='urls'):
+        """``count`` consecutive URL ids on shard ``using``, for bulk inserts"""
+        sequence = cls.objects.using(using).filter(name=name)
+        with transaction.atomic(using=using):
+            if not sequence.update(value=models.F('value') + count):
+                # First id on this shard: start above every id already
+                # taken, including those of URLs from before sharding
+                highest = fan_out(
+                    lambda alias: URL.objects.using(alias).aggregate(top=models.Max('id'))['top'] or 0
+                )
+                cls.objects.using(using).bulk_create(
+                    [cls(name=name, value=max(highest.values()) // MAX_SHARDS)],
+                    ignore_conflicts=True
+                )
+                sequence.update(value=models.F('value') + count)
+            value = sequence.values_list('value', flat=True).get()
+        return [encode_id(n, using) for n in range(value - count + 1, value + 1)]
+
+
+class Browser(models.Model):
+    """Interned browser family"""
+    
+    name = models.CharField(max_length=100, unique=True)
+    
+    class Meta:
+        db_table = 'browsers'
+    
+    def __str__(self):
+        return self.name
+
+
+class OperatingSystem(models.Model):
+    """Interned operating system family"""
+    
+    name = models.CharField(max_length=100, unique=True)
+    
+    class Meta:
+        db_table = 'operating_systems'
+    
+    def __str__(self):
+        return self.name
+
+
+class UserAgent(models.Model):
+    """Interned User-Agent string with its parsed dimensions"""
+    
+    digest = models.CharField(
+        max_length=40,
+        unique=True,
+        help_text="SHA-1 of the value; long values cannot be indexed directly"
+    )
+    value = models.TextField()
+    browser = models.ForeignKey(
+        Browser,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True
+    )
+    os = models.ForeignKey(
+        OperatingSystem,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True
+    )
+    device_type = models.CharField(max_length=50, blank=True, null=True)
+    
+    class Meta:
+        db_table = 'user_agents'
+    
+    def __str__(self):
+        return self.value[:100]
+
+
+class Referer(models.Model):
+    """Interned HTTP referer"""
+    
+    digest = models.CharField(
+        max_length=40,
+        unique=True,
+        help_text="SHA-1 of the URL; long values cannot be indexed directly"
+    )
+    url = models.TextField()
+    host = models.CharField(max_length=255, blank=True, db_index=True)
+    
+    class Meta:
+        db_table = 'referers'
+    
+    def __str__(self):
+        return self.url[:100]
+
+
 class Click(models.Model):
     """Model to track individual clicks for analytics"""
     
@@ -135,7 +384,8 @@ class Click(models.Model):
         URL,
         on_delete=models.CASCADE,
         related_name='click_records',
-        db_index=True
+        # Covered by the (url, clicked_at) index
+        db_index=False
     )
     
     # Request information
@@ -143,14 +393,22 @@ class Click(models.Model):
         null=True,
         blank=True
     )
-    user_agent = models.TextField(
+    # Dimensions are interned (shortener/dimensions.py) so each click only
+    # stores small integer keys. Rows are never deleted, so the foreign
+    # keys need no index on this table
+    user_agent = models.ForeignKey(
+        UserAgent,
+        on_delete=models.PROTECT,
+        null=True,
         blank=True,
-        null=True
+        db_index=False
     )
-    referer = models.URLField(
-        max_length=2048,
-        blank=True,
+    referer = models.ForeignKey(
+        Referer,
+        on_delete=models.PROTECT,
         null=True,
+        blank=True,
+        db_index=False,
         help_text="HTTP referer"
     )
     
@@ -165,11 +423,26 @@ class Click(models.Model):
         null=True,
         help_text="mobile, tablet, desktop, bot"
     )
-    browser = models.CharField(max_length=100, blank=True, null=True)
-    os = models.CharField(max_length=100, blank=True, null=True)
+    browser = models.ForeignKey(
+        Browser,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        db_index=False
+    )
+    os = models.ForeignKey(
+        OperatingSystem,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        db_index=False
+    )
+    
+    # Clicks this row stands for when the URL's clicks are sampled
+    weight = models.PositiveIntegerField(default=1)
     
-    # Timestamp
-    clicked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Timestamp; batch ingestion sets the time of the redirect
+    clicked_at = models.DateTimeField(default=timezone.now, editable=False)
     
     # Session tracking
     session_id = models.CharField(
@@ -182,10 +455,22 @@ class Click(models.Model):
     class Meta:
         db_table = 'clicks'
         ordering = ['-clicked_at']
+        # Clicks are append-only and write-heavy, so every index here costs
+        # on each insert. Time-range scans use BRIN; per-URL stats are
+        # answered from the covering index (see shortener/stats.py)
         indexes = [
-            models.Index(fields=['url', '-clicked_at']),
-            models.Index(fields=['clicked_at']),
-            models.Index(fields=['session_id']),
+            PortableBrinIndex(
+                fields=['clicked_at'],
+                autosummarize=True,
+                name='clicks_clicked_at_brin'
+            ),
+            models.Index(
+                fields=['url', 'clicked_at'],
+                include=['country', 'device_type', 'browser', 'referer', 'weight'],
+                name='clicks_url_time_cover_idx'
+            ),
+            # Unique-visitor checks in track_click_async
+            models.Index(fields=['url', 'session_id'], name='clicks_url_session_idx'),
         ]
     
     def __str__(self):
@@ -0,0 +1,219 @@
+"""
+Sliding-window rate limiting with per-route policies.
+
+Each decision is one round trip: an atomic Lua script keeps two fixed
+window counters per client and weights the previous window by how much of
+it still overlaps the sliding window. Clients that were just rejected are
+remembered in-process until their retry time, so repeated requests from a
+blocked client are turned away without touching Redis at all.
+
+Without a Redis cache (tests, local development) the same algorithm runs
+in-process.
+"""
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+
+SLIDING_WINDOW_LUA = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local window = math.floor(now / period)
+local elapsed = now - window * period
+local current_key = KEYS[1] .. ':' .. window
+local previous_key = KEYS[1] .. ':' .. (window - 1)
+local current = tonumber(redis.call('GET', current_key) or '0')
+local previous = tonumber(redis.call('GET', previous_key) or '0')
+local used = previous * (period - elapsed) / period + current
+if used + cost > limit then
+    local wait = period - elapsed
+    if current + cost <= limit and previous > 0 then
+        wait = (period - elapsed) - (limit - current - cost) * period / previous
+    end
+    return {0, 0, math.ceil(wait * 1000)}
+end
+redis.call('INCRBY', current_key, cost)
+redis.call('PEXPIRE', current_key, period * 2000)
+return {1, math.floor(limit - used - cost), math.ceil((period - elapsed) * 1000)}
+"""
+
+KEY_PREFIX = 'ratelimit'
+
+
+class Decision:
+    """Outcome of a rate-limit check"""
+
+    __slots__ = ('allowed', 'limit', 'remaining', 'reset', 'period')
+
+    def __init__(self, allowed, limit, remaining, reset, period):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = max(int(remaining), 0)
+        self.reset = max(int(math.ceil(reset)), 0)
+        self.period = period
+
+    def headers(self):
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(self.reset),
+            'RateLimit-Policy': f'{self.limit};w={self.period}',
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(self.reset, 1))
+        return headers
+
+
+class RedisBackend:
+    """Runs the sliding-window script on the Redis behind the default cache"""
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(SLIDING_WINDOW_LUA)
+
+    def hit(self, key, limit, period, cost=1):
+        allowed, remaining, reset_ms = self.script(
+            keys=[key], args=[limit, period, cost]
+        )
+        return bool(allowed), remaining, reset_ms / 1000
+
+    def reset(self, key_prefix=KEY_PREFIX):
+        for key in self.client.scan_iter(match=f'{key_prefix}:*', count=1000):
+            self.client.delete(key)
+
+
+class LocalBackend:
+    """In-process equivalent of the Lua script"""
+
+    def __init__(self):
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, period, cost=1):
+        now = time.time()
+        window = int(now // period)
+        elapsed = now - window * period
+        with self.lock:
+            current = self.windows.get((key, window), 0)
+            previous = self.windows.get((key, window - 1), 0)
+            used = previous * (period - elapsed) / period + current
+            if used + cost > limit:
+                wait = period - elapsed
+                if current + cost <= limit and previous > 0:
+                    wait = (period - elapsed) - (limit - current - cost) * period / previous
+                return False, 0, wait
+            self.windows[(key, window)] = current + cost
+            if len(self.windows) > 100000:
+                self.windows = {
+                    entry: count for entry, count in self.windows.items()
+                    if entry[1] >= window - 1
+                }
+        return True, limit - used - cost, period - elapsed
+
+    def reset(self, key_prefix=KEY_PREFIX):
+        with self.lock:
+            self.windows = {
+                entry: count for entry, count in self.windows.items()
+                if not entry[0].startswith(f'{key_prefix}:')
+            }
+
+
+class RateLimiter:
+    """Applies the configured policies with a local cache of blocked clients"""
+
+    max_blocked = 10000
+
+    def __init__(self, key_prefix=KEY_PREFIX):
+        # Limiters with their own prefix (benchmarks) never touch the
+        # counters of real clients
+        self.key_prefix = key_prefix
+        self._backend = None
+        self._blocked = {}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            try:
+                from django_redis import get_redis_connection
+                self._backend = RedisBackend(get_redis_connection('default'))
+            except (ImportError, NotImplementedError):
+                self._backend = LocalBackend()
+        return self._backend
+
+    def check(self, policy_name, identity, cost=1):
+        """Count one request against a policy and return the Decision"""
+        policy = settings.RATE_LIMIT_POLICIES[policy_name]
+        limit, period = policy['limit'], policy['period']
+        key = f'{self.key_prefix}:{{{policy_name}:{identity}}}'
+
+        blocked_until = self._blocked.get(key)
+        if blocked_until is not None:
+            wait = blocked_until - time.monotonic()
+            if wait > 0:
+                return Decision(False, limit, 0, wait, period)
+            self._blocked.pop(key, None)
+
+        allowed, remaining, reset = self.backend.hit(key, limit, period, cost)
+        if not allowed:
+            if len(self._blocked) >= self.max_blocked:
+                self._blocked.clear()
+            self._blocked[key] = time.monotonic() + reset
+        return Decision(allowed, limit, remaining, reset, period)
+
+    def reset(self):
+        """Forget every counter and blocked client under this limiter's prefix"""
+        self._blocked.clear()
+        self.backend.reset(self.key_prefix)
+
+
+limiter = RateLimiter()
+
+
+def get_client_ip(request):
+    """
+    Client IP honouring only the ``TRUSTED_PROXY_COUNT`` proxies in front
+    of us, so a client cannot pick its identity via ``X-Forwarded-For``.
+    """
+    proxies = settings.TRUSTED_PROXY_COUNT
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies and x_forwarded_for:
+        hops = [hop.strip() for hop in x_forwarded_for.split(',') if hop.strip()]
+        if len(hops) >= proxies:
+            return hops[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def rate_limited(policy_name, methods=None):
+    """
+    View decorator enforcing a rate-limit policy per client IP.
+
+    Works on plain functions and on view methods; rejected requests get a
+    429 and every response carries the ``RateLimit-*`` headers.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            request = args[1] if len(args) > 1 and hasattr(args[1], 'META') else args[0]
+            if not settings.RATE_LIMIT_ENABLED or (
+                    methods and request.method not in methods):
+                return view(*args, **kwargs)
+
+            decision = limiter.check(policy_name, get_client_ip(request))
+            if decision.allowed:
+                response = view(*args, **kwargs)
+            else:
+                response = JsonResponse(
+                    {'detail': 'Rate limit exceeded. Try again later.'},
+                    status=429
+                )
+            for header, value in decision.headers().items():
+                response[header] = value
+            return response
+        return wrapper
+    return decorator
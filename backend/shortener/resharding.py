@@ -0,0 +1,176 @@
+"""
+Moving URLs to the shard their short code belongs on.
+
+Adding a shard to ``SHARD_DATABASE_URLS`` sends a share of the codes to
+it (``config.sharding.shard_for_code``); ``manage.py reshard`` then moves
+each misplaced URL with its clicks, scheduled expiry and daily rollups.
+Run it with ``SHARD_RESHARDING`` on, so lookups also ask the other shards
+for the codes that have not moved yet.
+
+A batch of URLs is locked on its source shard, copied to its target in
+one transaction and deleted from the source once the copy has committed.
+Clicks tracked for a locked URL wait for the move, then fail and are
+retried against its new shard. A batch interrupted after the copy is
+copied again: rows an earlier attempt left on the target are replaced.
+Interned dimensions are matched on their natural keys, since every shard
+numbers its own.
+"""
+import logging
+from collections import Counter, defaultdict
+
+from django.db import connections, transaction
+
+from analytics.models import DailyAnalytics
+from config.sharding import on_shard, shard_for_code, shards
+
+from .models import URL, Browser, Click, OperatingSystem, Referer, ScheduledExpiry, UserAgent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+CLICK_BATCH_SIZE = 5000
+
+NATURAL_KEYS = {
+    Browser: 'name',
+    OperatingSystem: 'name',
+    UserAgent: 'digest',
+    Referer: 'digest',
+}
+CLICK_DIMENSIONS = {
+    'user_agent_id': UserAgent,
+    'referer_id': Referer,
+    'browser_id': Browser,
+    'os_id': OperatingSystem,
+}
+
+
+def insert_rows(model, using, rows):
+    """
+    Insert ``.values()`` rows exactly as given; ``bulk_create`` would
+    reset ``auto_now`` and ``auto_now_add`` fields
+    """
+    if not rows:
+        return
+    connection = connections[using]
+    by_attname = {field.attname: field for field in model._meta.concrete_fields}
+    fields = [by_attname[name] for name in rows[0]]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields))
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(row[field.attname], connection) for field in fields]
+            for row in rows
+        ])
+
+
+class Resharder:
+    """Moves misplaced URLs in batches; dimension ids are cached per run"""
+
+    def __init__(self, batch_size=BATCH_SIZE, click_batch_size=CLICK_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.click_batch_size = click_batch_size
+        self.dimension_ids = {}
+
+    def misplaced(self, source):
+        """Batches of ``{target: [url ids]}`` for URLs on ``source`` that belong elsewhere"""
+        urls = URL.objects.using(source).order_by('id').values_list('id', 'short_code')
+        last_id = None
+        while True:
+            batch = urls if last_id is None else urls.filter(id__gt=last_id)
+            batch = list(batch[:self.batch_size])
+            if not batch:
+                return
+            last_id = batch[-1][0]
+            targets = defaultdict(list)
+            for url_id, short_code in batch:
+                target = shard_for_code(short_code)
+                if target != source:
+                    targets[target].append(url_id)
+            if targets:
+                yield targets
+
+    def run(self, dry_run=False):
+        """Move every misplaced URL; returns ``{(source, target): URLs}``"""
+        moved = Counter()
+        for source in shards():
+            for targets in self.misplaced(source):
+                for target, url_ids in targets.items():
+                    count = len(url_ids) if dry_run else self.move(source, target, url_ids)
+                    moved[source, target] += count
+        return dict(moved)
+
+    def move(self, source, target, url_ids):
+        """Move these URLs with everything stored alongside them"""
+        try:
+            with on_shard(source), transaction.atomic(using=source):
+                urls = list(
+                    URL.objects.using(source).select_for_update().filter(pk__in=url_ids).values()
+                )
+                url_ids = [row['id'] for row in urls]
+                if not url_ids:
+                    return 0
+                with on_shard(target), transaction.atomic(using=target):
+                    # Left by an interrupted run
+                    URL.objects.using(target).filter(pk__in=url_ids).delete()
+                    self.copy(source, target, urls)
+                # The copy has committed; signals evict the cached URLs
+                URL.objects.using(source).filter(pk__in=url_ids).delete()
+        except Exception:
+            # Dimension rows interned by a rolled back copy are gone
+            self.dimension_ids.pop((source, target), None)
+            raise
+        logger.info(f"Moved {len(url_ids)} URLs from {source} to {target}")
+        return len(url_ids)
+
+    def copy(self, source, target, urls):
+        url_ids = [row['id'] for row in urls]
+        insert_rows(URL, target, urls)
+        insert_rows(
+            ScheduledExpiry, target,
+            list(ScheduledExpiry.objects.using(source).filter(url_id__in=url_ids).values())
+        )
+        rollups = list(DailyAnalytics.objects.using(source).filter(url_id__in=url_ids).values())
+        for row in rollups:
+            del row['id']
+        insert_rows(DailyAnalytics, target, rollups)
+
+        clicks = Click.objects.using(source).filter(url_id__in=url_ids).order_by('id')
+        last_id = 0
+        while True:
+            rows = list(clicks.filter(id__gt=last_id).values()[:self.click_batch_size])
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            for attname, model in CLICK_DIMENSIONS.items():
+                ids = self.map_dimensions(model, source, target, {row[attname] for row in rows})
+                for row in rows:
+                    row[attname] = ids.get(row[attname])
+            for row in rows:
+                del row['id']
+            insert_rows(Click, target, rows)
+
+    def map_dimensions(self, model, source, target, source_ids):
+        """``{source id: target id}`` of dimension rows, interning those the target lacks"""
+        ids = self.dimension_ids.setdefault((source, target), {}).setdefault(model, {})
+        missing = {pk for pk in source_ids if pk is not None and pk not in ids}
+        if missing:
+            key = NATURAL_KEYS[model]
+            for row in model.objects.using(source).filter(pk__in=missing).values():
+                source_id = row.pop('id')
+                for field in model._meta.concrete_fields:
+                    # A user agent's browser and OS
+                    if field.is_relation and row[field.attname] is not None:
+                        related = self.map_dimensions(
+                            field.related_model, source, target, {row[field.attname]}
+                        )
+                        row[field.attname] = related[row[field.attname]]
+                obj, _ = model.objects.using(target).get_or_create(
+                    defaults=row,
+                    **{key: row.pop(key)}
+                )
+                ids[source_id] = obj.pk
+        return ids
@@ -0,0 +1,72 @@
+"""
+Click sampling for high-traffic URLs.
+
+URL counters stay exact, but only 1 in N raw ``Click`` rows is stored,
+with ``weight=N``, so summing weights estimates the true counts. Visitors
+rather than individual clicks are sampled: every click of a sampled
+visitor is stored, so unique-visitor checks stay exact within the sample
+and each newly seen sampled visitor counts for N unique clicks.
+
+N is the URL's ``click_sample_rate`` when set, else ``CLICK_SAMPLE_RATE``.
+In adaptive mode (``CLICK_SAMPLING_ADAPTIVE``) the global rate is raised
+to the ``CLICK_SAMPLING_THRESHOLDS`` step matching the URL's clicks per
+minute, counted in the shared cache.
+"""
+import random
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+RATE_KEY_TTL = 180
+
+
+def _rate_key(url_id, minute):
+    return f'click_rate:{url_id}:{minute}'
+
+
+def record_click_rate(url_id, clicks=1):
+    """Count clicks towards the URL's rate and return its clicks per minute"""
+    minute = int(time.time() // 60)
+    key = _rate_key(url_id, minute)
+    try:
+        current = cache.incr(key, clicks)
+    except ValueError:
+        # First click this minute
+        cache.add(key, 0, RATE_KEY_TTL)
+        current = cache.incr(key, clicks)
+    # The current minute has only just started; the last full one is steadier
+    previous = cache.get(_rate_key(url_id, minute - 1)) or 0
+    return max(current, previous)
+
+
+def adaptive_rate(clicks_per_minute):
+    """Sample rate for a click rate under CLICK_SAMPLING_THRESHOLDS"""
+    rate = 1
+    for threshold, step_rate in settings.CLICK_SAMPLING_THRESHOLDS:
+        if clicks_per_minute >= threshold:
+            rate = step_rate
+    return rate
+
+
+def sample_rate(url, clicks=1):
+    """N for this URL's next ``clicks`` clicks: 1 stores every click"""
+    if url.click_sample_rate:
+        return url.click_sample_rate
+    rate = settings.CLICK_SAMPLE_RATE
+    if settings.CLICK_SAMPLING_ADAPTIVE:
+        rate = max(rate, adaptive_rate(record_click_rate(url.id, clicks)))
+    return max(rate, 1)
+
+
+def in_sample(url_id, session_id, rate):
+    """
+    Whether a visitor's clicks are stored at this rate. A visitor sampled
+    at N stays sampled at any multiple of N.
+    """
+    if rate <= 1:
+        return True
+    if not session_id:
+        return random.randrange(rate) == 0
+    return zlib.crc32(f'{url_id}:{session_id}'.encode('utf-8')) % rate == 0
@@ -1,7 +1,11 @@
 from rest_framework import serializers
 from django.conf import settings
+from django.utils import timezone
 from drf_spectacular.utils import extend_schema_field
+from config.sharding import on_shard, shard_for_code
+from .bloom import code_may_be_taken
 from .models import URL, Click
+from .ratelimit import get_client_ip
 import validators
 
 
@@ -22,7 +26,8 @@ class URLCreateSerializer(serializers.ModelSerializer):
             'custom_code',
             'title',
             'description',
-            'expires_at'
+            'expires_at',
+            'redirect_policy'
         ]
     
     def validate_original_url(self, value):
@@ -44,7 +49,7 @@ class URLCreateSerializer(serializers.ModelSerializer):
                 )
             
             # Check if code is available
-            if URL.objects.filter(short_code=value).exists():
+            if code_may_be_taken(value) and URL.code_taken(value):
                 raise serializers.ValidationError(
                     "This custom code is already taken"
                 )
@@ -74,19 +79,11 @@ class URLCreateSerializer(serializers.ModelSerializer):
         # Get IP address from request context
         request = self.context.get('request')
         if request:
-            validated_data['created_by_ip'] = self.get_client_ip(request)
+            validated_data['created_by_ip'] = get_client_ip(request)
         
-        return super().create(validated_data)
-    
-    @staticmethod
-    def get_client_ip(request):
-        """Extract client IP from request"""
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
+        # Stored on the shard its code belongs on
+        with on_shard(shard_for_code(validated_data['short_code'])):
+            return super().create(validated_data)
 
 
 class URLSerializer(serializers.ModelSerializer):
@@ -109,9 +106,11 @@ class URLSerializer(serializers.ModelSerializer):
             'clicks',
             'unique_clicks',
             'last_accessed',
+            'click_sample_rate',
             'is_active',
             'expires_at',
             'is_expired',
+            'redirect_policy',
             'created_at',
             'updated_at',
             'qr_code_url'
@@ -173,6 +172,72 @@ class URLListSerializer(serializers.ModelSerializer):
     @extend_schema_field(serializers.BooleanField)
     def get_is_expired(self, obj):
         return obj.is_expired()
+    
+    # Columns read by the fast path below
+    VALUES_FIELDS = [
+        'id',
+        'original_url',
+        'short_code',
+        'title',
+        'clicks',
+        'is_active',
+        'expires_at',
+        'created_at'
+    ]
+    
+    @classmethod
+    def values(cls, queryset):
+        """The queryset as the ``.values()`` rows ``from_values`` needs"""
+        return queryset.values(*cls.VALUES_FIELDS)
+    
+    @classmethod
+    def from_values(cls, rows):
+        """
+        Same output as ``URLListSerializer(urls, many=True).data``, built
+        from ``.values()`` rows without model instances or field objects
+        """
+        base_url = settings.BASE_URL
+        now = timezone.now()
+        # Resolve the current timezone once rather than per row
+        format_datetime = serializers.DateTimeField(
+            default_timezone=timezone.get_current_timezone()
+        ).to_representation
+        return [
+            {
+                'id': row['id'],
+                'original_url': row['original_url'],
+                'short_code': row['short_code'],
+                'short_url': f"{base_url}/{row['short_code']}",
+                'title': row['title'],
+                'clicks': row['clicks'],
+                'is_active': row['is_active'],
+                'is_expired': bool(row['expires_at']) and now > row['expires_at'],
+                'created_at': format_datetime(row['created_at']),
+            }
+            for row in rows
+        ]
+
+
+class URLResolveSerializer(serializers.Serializer):
+    """Serializer for batch short code resolution requests"""
+    
+    codes = serializers.ListField(
+        child=serializers.CharField(max_length=20),
+        allow_empty=False,
+        max_length=settings.RESOLVE_MAX_CODES,
+        help_text="Short codes to resolve"
+    )
+
+
+class URLAvailabilitySerializer(serializers.Serializer):
+    """Serializer for short code availability checks"""
+    
+    code = serializers.CharField(max_length=20, help_text="Short code to check")
+    
+    def validate_code(self, value):
+        if not value.isalnum():
+            raise serializers.ValidationError("Code must be alphanumeric")
+        return value
 
 
 class URLStatsSerializer(serializers.Serializer):
@@ -186,11 +251,18 @@ class URLStatsSerializer(serializers.Serializer):
     clicks_by_device = serializers.DictField()
     clicks_by_browser = serializers.DictField()
     top_referrers = serializers.ListField()
+    degraded = serializers.BooleanField(
+        help_text="Some breakdowns timed out and are empty"
+    )
 
 
 class ClickSerializer(serializers.ModelSerializer):
     """Serializer for click records"""
     
+    referer = serializers.CharField(source='referer.url', allow_null=True, read_only=True)
+    browser = serializers.CharField(source='browser.name', allow_null=True, read_only=True)
+    os = serializers.CharField(source='os.name', allow_null=True, read_only=True)
+    
     class Meta:
         model = Click
         fields = [
@@ -202,7 +274,8 @@ class ClickSerializer(serializers.ModelSerializer):
             'device_type',
             'browser',
             'os',
-            'clicked_at'
+            'clicked_at',
+            'weight'
         ]
         read_only_fields = fields
 
@@ -211,3 +284,11 @@ class HealthCheckSerializer(serializers.Serializer):
     """Serializer for health check response"""
     status = serializers.CharField()
     timestamp = serializers.CharField()
+
+
+class DatabaseHealthSerializer(serializers.Serializer):
+    """Serializer for database health response"""
+    status = serializers.CharField()
+    pool_mode = serializers.CharField()
+    databases = serializers.ListField(child=serializers.DictField())
+    pools = serializers.ListField(child=serializers.DictField(), allow_null=True)
@@ -0,0 +1,56 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .bloom import short_codes
+from .conditional import bump
+from .expiry import schedule_expiry
+from .invalidation import invalidate_urls
+from .models import URL
+
+# Saves that only bump counters do not change what a redirect returns
+COUNTER_FIELDS = frozenset({'clicks', 'unique_clicks', 'last_accessed'})
+# Fields that schedule or cancel an expiry
+EXPIRY_FIELDS = frozenset({'expires_at', 'is_active'})
+
+
+@receiver(post_save, sender=URL)
+def invalidate_saved_url(sender, instance, created, update_fields=None, **kwargs):
+    """Evict cached copies of a URL after it is edited"""
+    if update_fields and set(update_fields) <= COUNTER_FIELDS:
+        return
+    invalidate_urls([instance.short_code])
+
+
+@receiver(post_save, sender=URL)
+def record_taken_code(sender, instance, created, update_fields=None, **kwargs):
+    """Add new (or edited) codes to the taken-code filter"""
+    if update_fields and set(update_fields) <= COUNTER_FIELDS:
+        return
+    short_codes.add(instance.short_code)
+
+
+@receiver(post_save, sender=URL)
+def reschedule_expiry(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the URL's scheduled expiry in step with its expires_at"""
+    if update_fields and not EXPIRY_FIELDS & set(update_fields):
+        return
+    # New URLs without an expiry have nothing to cancel
+    if created and not instance.expires_at:
+        return
+    schedule_expiry(instance)
+
+
+@receiver(post_delete, sender=URL)
+def invalidate_deleted_url(sender, instance, **kwargs):
+    """Evict cached copies of a deleted URL"""
+    invalidate_urls([instance.short_code])
+
+
+@receiver(post_save, sender=URL)
+@receiver(post_delete, sender=URL)
+def bump_urls_version(sender, update_fields=None, **kwargs):
+    """Change the ETags of URL lists and the dashboard after an edit"""
+    # Counters reach them with the next time window (conditional.py)
+    if update_fields and set(update_fields) <= COUNTER_FIELDS:
+        return
+    bump('urls')
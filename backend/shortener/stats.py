@@ -0,0 +1,102 @@
+"""
+Per-URL click breakdowns.
+
+Every query filters on ``url`` and a ``clicked_at`` range and only reads
+columns included in the ``clicks_url_time_cover_idx`` covering index, so
+Postgres can answer them with index-only scans. Counts sum ``weight`` so
+that sampled clicks (shortener/sampling.py) are scaled back up.
+"""
+from functools import partial
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from config.concurrency import Results, run_parallel
+
+from .models import Browser, Click, Referer
+
+
+def clicks_by_date(clicks):
+    return list(clicks.values('clicked_at__date').annotate(
+        count=Sum('weight')
+    ).order_by('clicked_at__date'))
+
+
+def clicks_by_country(clicks):
+    return dict(
+        clicks.exclude(country__isnull=True)
+        .exclude(country='')
+        .values('country')
+        .annotate(count=Sum('weight'))
+        .values_list('country', 'count')
+    )
+
+
+def clicks_by_device(clicks):
+    return dict(
+        clicks.exclude(device_type__isnull=True)
+        .values('device_type')
+        .annotate(count=Sum('weight'))
+        .values_list('device_type', 'count')
+    )
+
+
+def clicks_by_browser(clicks):
+    # Grouped on the interned id
+    browser_counts = dict(
+        clicks.exclude(browser__isnull=True)
+        .values('browser_id')
+        .annotate(count=Sum('weight'))
+        .values_list('browser_id', 'count')
+    )
+    browser_names = Browser.objects.in_bulk(browser_counts)
+    return {
+        browser_names[browser_id].name: count
+        for browser_id, count in browser_counts.items()
+    }
+
+
+def top_referrers(clicks):
+    # Direct visits (no Referer) are not a referrer
+    referer_counts = list(
+        clicks.exclude(referer__isnull=True)
+        .values('referer_id')
+        .annotate(count=Sum('weight'))
+        .order_by('-count')[:10]
+    )
+    referers = Referer.objects.in_bulk(
+        [entry['referer_id'] for entry in referer_counts]
+    )
+    return [
+        {'referer': referers[entry['referer_id']].url, 'count': entry['count']}
+        for entry in referer_counts
+    ]
+
+
+# Breakdown name -> (query, value when it timed out)
+BREAKDOWNS = {
+    'clicks_by_date': (clicks_by_date, list),
+    'clicks_by_country': (clicks_by_country, dict),
+    'clicks_by_device': (clicks_by_device, dict),
+    'clicks_by_browser': (clicks_by_browser, dict),
+    'top_referrers': (top_referrers, list),
+}
+
+
+def click_breakdown(url, days=30, timeout=None):
+    """
+    Clicks of a URL over the last ``days`` by date, country, device,
+    browser and referer, queried in parallel. Breakdowns missing
+    ``timeout`` are empty and the ``Results`` are ``degraded``.
+    """
+    since = timezone.now() - timezone.timedelta(days=days)
+    clicks = Click.objects.filter(url=url, clicked_at__gte=since).order_by()
+    
+    results = run_parallel(
+        {name: partial(query, clicks) for name, (query, _) in BREAKDOWNS.items()},
+        timeout=timeout
+    )
+    return Results(
+        {name: results.get(name, empty()) for name, (_, empty) in BREAKDOWNS.items()},
+        results.timed_out
+    )
@@ -1,10 +1,15 @@
 from celery import shared_task
+from celery.signals import worker_ready
 from django.core.files.base import ContentFile
 from django.db import transaction
 from django.utils import timezone
 import qrcode
 from io import BytesIO
 import logging
+import time
+
+from config.sharding import each_shard, on_shard
+from monitoring.metrics import click_ingestion_lag, qrcode_render_duration
 
 logger = logging.getLogger(__name__)
 
@@ -16,45 +21,50 @@ def track_click_async(self, url_id, click_data):
     """
     try:
         from .models import URL, Click
-        from user_agents import parse
+        from .dimensions import click_dimensions
+        from .sampling import in_sample, sample_rate
         
-        url = URL.objects.get(id=url_id)
+        requested_at = click_data.get('requested_at')
+        if requested_at:
+            click_ingestion_lag.observe(max(time.time() - requested_at, 0))
         
-        # Parse user agent
-        user_agent_string = click_data.get('user_agent', '')
-        user_agent = parse(user_agent_string)
+        url = URL.get_by_id(url_id)
+        session_id = click_data.get('session_id')
         
-        # Determine device type
-        device_type = 'desktop'
-        if user_agent.is_mobile:
-            device_type = 'mobile'
-        elif user_agent.is_tablet:
-            device_type = 'tablet'
-        elif user_agent.is_bot:
-            device_type = 'bot'
+        # High-traffic URLs only store a weighted sample of click rows;
+        # the URL counters stay exact
+        rate = sample_rate(url)
+        if not in_sample(url.id, session_id, rate):
+            url.increment_clicks()
+            return
         
-        # Check if this is a unique visitor
-        session_id = click_data.get('session_id')
-        is_unique = not Click.objects.filter(
-            url=url,
-            session_id=session_id
-        ).exists()
-        
-        # Create click record
-        with transaction.atomic():
-            Click.objects.create(
-                url=url,
-                ip_address=click_data.get('ip_address'),
-                user_agent=user_agent_string,
-                referer=click_data.get('referer'),
-                device_type=device_type,
-                browser=user_agent.browser.family,
-                os=user_agent.os.family,
-                session_id=session_id,
+        # Clicks and their dimensions are stored on the URL's shard
+        with on_shard(url._state.db):
+            # Resolve interned dimension ids outside the click transaction
+            # so they can be cached
+            dimensions = click_dimensions(
+                click_data.get('user_agent', ''),
+                click_data.get('referer')
             )
             
-            # Update URL click count
-            url.increment_clicks(is_unique=is_unique)
+            # Check if this is a unique visitor
+            is_unique = not Click.objects.filter(
+                url=url,
+                session_id=session_id
+            ).exists()
+            
+            # Create click record
+            with transaction.atomic(using=url._state.db):
+                Click.objects.create(
+                    url=url,
+                    ip_address=click_data.get('ip_address'),
+                    session_id=session_id,
+                    weight=rate,
+                    **dimensions
+                )
+                
+                # Update URL click count; a sampled visitor stands for `rate`
+                url.increment_clicks(is_unique=is_unique, unique_weight=rate)
         
         logger.info(f"Click tracked for URL {url.short_code}")
         
@@ -71,26 +81,28 @@ def generate_qr_code_async(self, url_id):
     try:
         from .models import URL
         
-        url = URL.objects.get(id=url_id)
+        url = URL.get_by_id(url_id)
         
         # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(url.get_short_url())
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
+        with qrcode_render_duration.time(source='task'):
+            qr = qrcode.QRCode(
+                version=1,
+                error_correction=qrcode.constants.ERROR_CORRECT_L,
+                box_size=10,
+                border=4,
+            )
+            qr.add_data(url.get_short_url())
+            qr.make(fit=True)
+            
+            img = qr.make_image(fill_color="black", back_color="white")
+            buffer = BytesIO()
+            img.save(buffer, format='PNG')
+            buffer.seek(0)
         
         # Save QR code
         filename = f'{url.short_code}_qr.png'
-        url.qr_code.save(filename, ContentFile(buffer.read()), save=True)
+        url.qr_code.save(filename, ContentFile(buffer.read()), save=False)
+        url.save(update_fields=['qr_code', 'updated_at'])
         
         logger.info(f"QR code generated for URL {url.short_code}")
         
@@ -102,15 +114,27 @@ def generate_qr_code_async(self, url_id):
 @shared_task
 def cleanup_expired_urls():
     """
-    Deactivate expired URLs
+    Deactivate expired URLs; a backstop for expire_due_urls
     """
     try:
-        from .models import URL
+        from .models import URL, ScheduledExpiry
+        from .conditional import bump
+        from .invalidation import invalidate_urls
         
-        expired_count = URL.objects.filter(
-            is_active=True,
-            expires_at__lt=timezone.now()
-        ).update(is_active=False)
+        expired_count = 0
+        for _ in each_shard():
+            expired = URL.objects.filter(
+                is_active=True,
+                expires_at__lt=timezone.now()
+            )
+            short_codes = list(expired.values_list('short_code', flat=True))
+            expired_count += expired.update(is_active=False)
+            ScheduledExpiry.objects.filter(url__short_code__in=short_codes).delete()
+            
+            # update() bypasses the model signals
+            invalidate_urls(short_codes)
+        if expired_count:
+            bump('urls')
         
         logger.info(f"Deactivated {expired_count} expired URLs")
         return expired_count
@@ -118,3 +142,132 @@ def cleanup_expired_urls():
     except Exception as exc:
         logger.error(f"Error cleaning up expired URLs: {exc}")
         raise
+
+
+@shared_task
+def expire_due_urls():
+    """
+    Deactivate the URLs whose scheduled expiry has come
+    """
+    try:
+        from .expiry import expire_due
+        
+        expired_count = expire_due()
+        if expired_count:
+            logger.info(f"Expired {expired_count} URLs")
+        return expired_count
+        
+    except Exception as exc:
+        logger.error(f"Error expiring due URLs: {exc}")
+        raise
+
+
+@shared_task
+def warm_url_cache_task(if_cold=False):
+    """
+    Preload the hottest URLs into the redirect cache
+    """
+    from django.core.cache import cache
+    from .cache import WARM_LOCK_KEY, url_cache_is_warm, warm_url_cache
+    
+    if if_cold and url_cache_is_warm():
+        return 0
+    
+    # Only one worker warms at a time
+    if not cache.add(WARM_LOCK_KEY, 1, 300):
+        return 0
+    try:
+        return warm_url_cache()
+    except Exception as exc:
+        logger.error(f"Error warming URL cache: {exc}")
+        raise
+    finally:
+        cache.delete(WARM_LOCK_KEY)
+
+
+@shared_task
+def rebuild_short_code_filter(if_missing=False):
+    """
+    Rebuild the taken-code Bloom filter from the database
+    """
+    from django.core.cache import cache
+    from .bloom import short_codes
+    
+    if if_missing and short_codes.is_ready():
+        return False
+    
+    # Only one worker rebuilds at a time
+    if not cache.add('bloom_rebuilding', 1, 600):
+        return False
+    try:
+        short_codes.rebuild()
+        return True
+    except Exception as exc:
+        logger.error(f"Error rebuilding short code filter: {exc}")
+        raise
+    finally:
+        cache.delete('bloom_rebuilding')
+
+
+@shared_task
+def publish_edge_redirects():
+    """
+    Publish the hottest codes for nginx to redirect at the edge
+    """
+    from django.conf import settings
+    from .edge import publish_edge_map, remove_edge_map
+    
+    try:
+        if not settings.EDGE_REDIRECTS_ENABLED:
+            # Stop nginx serving a map left over from before
+            if remove_edge_map():
+                logger.info("Removed the edge redirect map")
+            return 0
+        
+        count, changed = publish_edge_map()
+        if changed:
+            logger.info(f"Published {count} edge redirects")
+        return count
+        
+    except Exception as exc:
+        logger.error(f"Error publishing edge redirects: {exc}")
+        raise
+
+
+@shared_task
+def ingest_edge_clicks(max_seconds=60):
+    """
+    Store the clicks nginx logged for edge redirects, in batches
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+    from .edge import ClickLog
+    from .ingestion import ingest_clicks
+    
+    # Only one worker reads the logs at a time
+    if not cache.add('edge_clicks_ingesting', 1, max_seconds * 5):
+        return 0
+    try:
+        log = ClickLog()
+        deadline = time.monotonic() + max_seconds
+        ingested = 0
+        while time.monotonic() < deadline:
+            events, offsets = log.read(settings.EDGE_CLICK_BATCH_SIZE)
+            if events:
+                ingested += ingest_clicks(events)
+            log.commit(offsets)
+            if len(events) < settings.EDGE_CLICK_BATCH_SIZE:
+                break
+        return ingested
+    except Exception as exc:
+        logger.error(f"Error ingesting edge clicks: {exc}")
+        raise
+    finally:
+        cache.delete('edge_clicks_ingesting')
+
+
+@worker_ready.connect
+def warm_url_cache_on_startup(sender=None, **kwargs):
+    """Warm the redirect cache when a worker starts and finds it cold"""
+    warm_url_cache_task.delay(if_cold=True)
+    rebuild_short_code_filter.delay(if_missing=True)
@@ -0,0 +1,150 @@
+"""
+Tests for the taken short code Bloom filter
+"""
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from shortener.bloom import (
+    FILTER_KEY,
+    RedisFilterStore,
+    ShortCodeFilter,
+    build_bitmap,
+    filter_size,
+    short_codes,
+)
+from shortener.models import URL
+
+
+class BitmapClient:
+    """The few Redis string and bit commands the filter uses, in memory"""
+
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def set(self, key, value):
+        self.data[key] = bytearray(value)
+
+    def rename(self, source, target):
+        self.data[target] = self.data.pop(source)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def getrange(self, key, start, end):
+        return bytes(self.data.get(key, b'')[start:end + 1])
+
+    def getbit(self, key, offset):
+        value = self.data.get(key, b'')
+        return int(offset >> 3 < len(value) and bool(value[offset >> 3] & (0x80 >> (offset & 7))))
+
+    def setbit(self, key, offset, bit):
+        value = self.data.setdefault(key, bytearray())
+        value.extend(bytes(max(0, (offset >> 3) + 1 - len(value))))
+        value[offset >> 3] |= 0x80 >> (offset & 7)
+
+    def pipeline(self, transaction=True):
+        return BitmapPipeline(self)
+
+
+class BitmapPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((getattr(self.client, name), args))
+
+    def execute(self):
+        self.client.round_trips += 1
+        return [method(*args) for method, args in self.calls]
+
+
+@pytest.fixture
+def redis_filter():
+    """A filter on a Redis store"""
+    codes = ShortCodeFilter()
+    codes._store = RedisFilterStore(BitmapClient())
+    return codes
+
+
+@pytest.mark.django_db
+class TestShortCodeFilter:
+    """Test filter membership and maintenance"""
+
+    def test_filter_size(self):
+        """Test sizing for a capacity and error rate"""
+        bits, hashes = filter_size(1000, 0.01)
+        assert 9500 <= bits <= 9600
+        assert hashes == 7
+
+    def test_unbuilt_filter_reports_maybe(self, sample_url):
+        """Test that every code needs the database until a build"""
+        assert short_codes.might_contain('anything') is True
+
+    def test_rebuild_has_no_false_negatives(self, db):
+        """Test that every existing code is reported as maybe taken"""
+        URL.objects.bulk_create([
+            URL(original_url=f'https://example.com/{i}', short_code=f'code{i}')
+            for i in range(200)
+        ])
+        short_codes.rebuild()
+        assert all(short_codes.might_contain(f'code{i}') for i in range(200))
+
+    def test_free_codes_mostly_definite(self, db):
+        """Test that free codes are mostly answered by the filter"""
+        short_codes.rebuild()
+        maybes = sum(short_codes.might_contain(f'free{i}') for i in range(1000))
+        assert maybes < 10
+
+    def test_created_urls_added(self, db):
+        """Test that new URLs are added without a rebuild"""
+        short_codes.rebuild()
+        assert short_codes.might_contain('newcode') is False
+        URL.objects.create(original_url='https://example.com', short_code='newcode')
+        assert short_codes.might_contain('newcode') is True
+
+    def test_resized_filter_not_trusted(self, db, settings):
+        """Test that a bitmap built with other parameters is ignored"""
+        short_codes.rebuild()
+        settings.BLOOM_CAPACITY = 1000
+        assert short_codes.is_ready() is False
+        assert short_codes.might_contain('free') is True
+
+    def test_bitmap_uses_redis_bit_order(self):
+        """Test that offset 0 is the high bit of the first byte"""
+        bitmap = build_bitmap(['a'], 8, 1)
+        assert bin(bitmap[0]).count('1') == 1
+
+    def test_generate_short_code_skips_query(self, db, settings):
+        """Test that generation needs no query once the filter is built"""
+        short_codes.rebuild()
+        with CaptureQueriesContext(connection) as queries:
+            code = URL.generate_short_code(settings.SHORT_CODE_LENGTH)
+        assert len(code) == settings.SHORT_CODE_LENGTH
+        assert len(queries) == 0
+
+
+@pytest.mark.django_db
+class TestRedisFilterStore:
+    """Test the Redis bitmap and its build header"""
+
+    def test_one_round_trip(self, redis_filter, sample_url):
+        """Test a check is one pipelined round trip"""
+        redis_filter.rebuild()
+        client = redis_filter.store.client
+        client.round_trips = 0
+
+        assert redis_filter.might_contain('test123') is True
+        assert redis_filter.might_contain('free1') is False
+        assert client.round_trips == 2
+
+    def test_evicted_bitmap_not_trusted(self, redis_filter, sample_url):
+        """Test a bitmap lost to eviction, even if recreated by an add, reports maybe"""
+        redis_filter.rebuild()
+        redis_filter.store.client.delete(FILTER_KEY)
+        redis_filter.add('other1')
+
+        assert redis_filter.is_ready() is False
+        assert redis_filter.might_contain('test123') is True
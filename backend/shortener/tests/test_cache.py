@@ -0,0 +1,193 @@
+"""
+Tests for redirect cache helpers and warm-up
+"""
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import OperationalError
+from django.http import Http404
+from django.utils import timezone
+from shortener.cache import (
+    get_cached_url,
+    get_or_fill,
+    jittered_ttl,
+    make_entries,
+    make_entry,
+    hot_short_codes,
+    url_cache_is_warm,
+    warm_url_cache,
+)
+from shortener.models import URL
+
+
+@pytest.fixture
+def urls(db):
+    """URLs with different access recency"""
+    now = timezone.now()
+    cache.clear()
+    return [
+        URL.objects.create(
+            original_url=f'https://www.example.com/{i}',
+            short_code=f'warm{i}',
+            last_accessed=now - timedelta(minutes=i)
+        )
+        for i in range(4)
+    ]
+
+
+@pytest.mark.django_db
+class TestWarmURLCache:
+    """Tests for warm_url_cache"""
+
+    def test_hot_codes_prefer_trending(self, urls):
+        """Test trending codes come first, then recent access"""
+        cache.set('top_urls_weekly', [{'short_code': 'warm3'}])
+
+        assert hot_short_codes(3) == ['warm3', 'warm0', 'warm1']
+
+    def test_warms_top_codes(self, urls):
+        """Test the top-N codes are cached in batches with progress"""
+        progress = []
+
+        count = warm_url_cache(limit=3, batch_size=2, concurrency=2,
+                               progress=lambda done, total: progress.append((done, total)))
+
+        assert count == 3
+        assert progress[-1] == (3, 3)
+        assert get_cached_url('warm0').pk == urls[0].pk
+        assert get_cached_url('warm2') is not None
+        assert get_cached_url('warm3') is None
+        assert url_cache_is_warm()
+
+    def test_skips_inactive_and_expired(self, urls):
+        """Test dead URLs are never warmed"""
+        URL.objects.filter(short_code='warm0').update(is_active=False)
+        URL.objects.filter(short_code='warm1').update(
+            expires_at=timezone.now() - timedelta(days=1)
+        )
+
+        warm_url_cache(limit=2)
+
+        assert get_cached_url('warm0') is None
+        assert get_cached_url('warm1') is None
+        assert get_cached_url('warm2') is not None
+
+
+class TestGetOrFill:
+    """Tests for single-flight cache fills"""
+
+    def setup_method(self):
+        cache.clear()
+
+    def slow_loader(self, calls, value='value', delay=0.1):
+        def loader():
+            calls.append(1)
+            time.sleep(delay)
+            return value
+        return loader
+
+    def test_concurrent_misses_load_once(self):
+        """Test concurrent misses on one key run the loader once"""
+        calls = []
+        loader = self.slow_loader(calls)
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda _: get_or_fill('stampede', loader, 60), range(10)))
+
+        assert results == ['value'] * 10
+        assert len(calls) == 1
+
+    def test_waits_for_fill_by_other_worker(self, monkeypatch):
+        """Test a miss waits for another worker holding the fill lock"""
+        cache.add('stampede:fill', 1, 5)
+        calls = []
+
+        def other_worker():
+            time.sleep(0.05)
+            entry, timeout = make_entry('from-other-worker', 60)
+            cache.set('stampede', entry, timeout)
+
+        threading.Thread(target=other_worker).start()
+
+        assert get_or_fill('stampede', self.slow_loader(calls), 60) == 'from-other-worker'
+        assert calls == []
+
+    def test_missing_value_cached(self):
+        """Test concurrent misses for a missing key ask the loader once"""
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.1)
+            raise Http404
+
+        def lookup(_):
+            try:
+                return get_or_fill('missing', loader, 60)
+            except Http404:
+                return 'not found'
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lookup, range(10)))
+
+        assert results == ['not found'] * 10
+        assert len(calls) == 1
+        assert time.monotonic() - started < 0.5
+
+    def test_key_outlives_jittered_expiry(self, settings):
+        """Test keys live for the stale window past their own jittered expiry"""
+        settings.CACHE_TTL_JITTER = 0.5
+        for _ in range(20):
+            entry, timeout = make_entry('value', 100)
+            assert timeout >= entry[1] - time.time() + settings.URL_CACHE_STALE_TTL
+
+        entries, timeout = make_entries({f'k{n}': n for n in range(20)}, 100)
+        latest = max(entry[1] for entry in entries.values())
+        assert timeout >= latest - time.time() + settings.URL_CACHE_STALE_TTL
+
+    def test_stale_entry_served_while_refreshing(self):
+        """Test only one request refreshes a stale entry, others serve it"""
+        cache.set('stampede', ('stale', time.time() - 1, 0.0), 60)
+        cache.add('stampede:fill', 1, 5)  # someone is already refreshing
+        calls = []
+
+        assert get_or_fill('stampede', self.slow_loader(calls, 'fresh'), 60) == 'stale'
+        assert calls == []
+
+        cache.delete('stampede:fill')
+        assert get_or_fill('stampede', self.slow_loader(calls, 'fresh'), 60) == 'fresh'
+        assert calls == [1]
+
+    def test_failed_refresh_keeps_stale_entry(self):
+        """Test a refresh that errors serves the stale copy, one that finds nothing drops it"""
+        cache.set('stampede', ('stale', time.time() - 1, 0.0), 60)
+
+        def broken():
+            raise OperationalError('database is down')
+
+        def gone():
+            raise URL.DoesNotExist
+
+        assert get_or_fill('stampede', broken, 60) == 'stale'
+        assert cache.get('stampede')[0] == 'stale'
+        with pytest.raises(URL.DoesNotExist):
+            get_or_fill('stampede', gone, 60)
+        assert cache.get('stampede') is None
+
+    def test_early_refresh_and_jitter(self, settings, monkeypatch):
+        """Test XFetch refreshes slow entries early and TTLs are jittered"""
+        settings.CACHE_TTL_JITTER = 0.1
+        ttls = {round(jittered_ttl(100), 3) for _ in range(20)}
+        assert len(ttls) > 1
+        assert all(90 <= ttl <= 110 for ttl in ttls)
+
+        # 1s of headroom, but the last fill took 10s: refresh almost surely
+        monkeypatch.setattr('shortener.cache.random.random', lambda: 0.5)
+        cache.set('stampede', ('old', time.time() + 1, 10.0), 60)
+        calls = []
+
+        assert get_or_fill('stampede', self.slow_loader(calls, 'new', 0), 60) == 'new'
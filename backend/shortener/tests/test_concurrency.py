@@ -0,0 +1,160 @@
+"""
+Tests for running queries in parallel
+"""
+import threading
+import time
+import pytest
+from types import SimpleNamespace
+from django.db import OperationalError
+from config.concurrency import QueryTimeout, _deadline_guard, _pools, _worker, run_parallel
+from config.routers import _state as router_state, use_replica
+from config.sharding import current_db, fan_out, on_shard
+from shortener.models import URL
+
+
+def thread_name():
+    return threading.current_thread().name
+
+
+class TestRunParallel:
+    """Test the thread pool path, outside transactions"""
+
+    def test_results(self):
+        """Test every query runs on a pool thread and is returned by name"""
+        results = run_parallel({'a': lambda: 1, 'b': thread_name})
+
+        assert results['a'] == 1
+        assert results['b'].startswith('query')
+        assert not results.degraded
+
+    def test_timeout(self):
+        """Test a slow query is left out and the results degraded"""
+        started = time.monotonic()
+
+        results = run_parallel({'fast': lambda: 1, 'slow': lambda: time.sleep(1)}, timeout=0.1)
+
+        assert time.monotonic() - started < 0.5
+        assert results == {'fast': 1}
+        assert results.timed_out == ['slow']
+        assert results.degraded
+
+    def test_errors_propagate(self):
+        """Test a failing query fails the call"""
+        with pytest.raises(ZeroDivisionError):
+            run_parallel({'a': lambda: 1, 'b': lambda: 1 / 0})
+
+    def test_routing_state(self):
+        """Test workers route like their caller, and forget it afterwards"""
+        def state():
+            return current_db(), getattr(router_state, 'replica_depth', 0)
+
+        with on_shard('shard_1'), use_replica():
+            results = run_parallel({'a': state, 'b': state})
+        after = run_parallel({'a': state, 'b': state})
+
+        assert set(results.values()) == {('shard_1', 1)}
+        assert set(after.values()) == {('default', 0)}
+
+    def test_nested(self):
+        """Test queries started by a worker run in that worker"""
+        def nested():
+            inner = run_parallel({'a': thread_name, 'b': thread_name})
+            return {thread_name(), *inner.values()}
+
+        results = run_parallel({'a': nested, 'b': nested})
+
+        assert all(len(names) == 1 for names in results.values())
+
+    def test_shard_pool(self, shards):
+        """Test the shard fan-out runs on its own pool"""
+        results = fan_out(lambda alias: thread_name())
+
+        assert all(name.startswith('shard') for name in results.values())
+
+    def test_server_side_timeout(self, monkeypatch):
+        """Test PostgreSQL statements from a worker carry the time left"""
+        monkeypatch.setattr(_worker, 'active', True, raising=False)
+        guard = _deadline_guard(time.monotonic() + 2, SimpleNamespace(vendor='postgresql'))
+
+        sql = guard(lambda sql, *args: sql, 'SELECT 1', None, False, {})
+
+        prefix, statement = sql.split('; ')
+        assert statement == 'SELECT 1'
+        assert prefix.startswith('SET LOCAL statement_timeout = ')
+        assert 1000 < int(prefix.rsplit(' ', 1)[1]) <= 2000
+
+    def test_cancelled_statement_times_out(self, monkeypatch):
+        """Test a statement cancelled by the server counts as timed out"""
+        class QueryCanceled(Exception):
+            pgcode = '57014'
+
+        def cancelled(*args):
+            raise OperationalError('canceling statement') from QueryCanceled()
+
+        monkeypatch.setattr(_worker, 'active', True, raising=False)
+        guard = _deadline_guard(time.monotonic() + 2, SimpleNamespace(vendor='postgresql'))
+
+        with pytest.raises(QueryTimeout):
+            guard(cancelled, 'SELECT 1', None, False, {})
+
+
+@pytest.mark.django_db(transaction=True)
+class TestRunConcurrently:
+    """Test queries against the database on the pool threads"""
+
+    @pytest.fixture(autouse=True)
+    def new_pools(self):
+        """Drop the pools afterwards, with the connections their threads opened"""
+        yield
+        for pool in _pools.values():
+            pool.shutdown()
+        _pools.clear()
+
+    def test_deadline(self, sample_url):
+        """Test a query missing the deadline is left out and stops at its next statement"""
+        stopped = threading.Event()
+
+        def slow():
+            time.sleep(0.3)
+            try:
+                return URL.objects.count()
+            except QueryTimeout:
+                stopped.set()
+                raise
+
+        def count():
+            return URL.objects.count(), thread_name()
+
+        started = time.monotonic()
+        results = run_parallel({'slow': slow, 'count': count}, timeout=0.1)
+
+        assert time.monotonic() - started < 0.3
+        assert results.timed_out == ['slow']
+        assert results['count'][0] == 1
+        assert results['count'][1].startswith('query')
+        assert stopped.wait(2)
+
+
+@pytest.mark.django_db
+class TestRunInTransaction:
+    """Test queries inside a transaction"""
+
+    def test_sequential(self, sample_url):
+        """Test queries run in the calling thread, which sees uncommitted rows"""
+        results = run_parallel({
+            'count': lambda: URL.objects.count(),
+            'thread': thread_name,
+        })
+
+        assert results == {'count': 1, 'thread': thread_name()}
+
+    def test_deadline(self, sample_url):
+        """Test a query past the deadline stops at its next statement, later ones are skipped"""
+        def slow():
+            time.sleep(0.05)
+            return URL.objects.count()
+
+        results = run_parallel({'slow': slow, 'count': lambda: URL.objects.count()}, timeout=0.01)
+
+        assert results.timed_out == ['slow', 'count']
+        assert URL.objects.count() == 1
@@ -0,0 +1,146 @@
+"""
+Tests for conditional requests and Cache-Control on API reads
+"""
+import time
+import pytest
+from unittest.mock import patch
+from shortener.conditional import COUNTERS_WINDOW_SECONDS, bump
+
+
+@pytest.mark.django_db
+class TestConditionalRequests:
+    """Test ETags, 304s and cache policies"""
+
+    def test_retrieve_headers(self, api_client, sample_url):
+        """Test URL details carry validators and the cache policy"""
+        response = api_client.get(f'/api/urls/{sample_url.id}/')
+
+        assert response.status_code == 200
+        assert response['ETag']
+        assert response['Last-Modified']
+        assert response['Cache-Control'] == 'max-age=0, s-maxage=5'
+
+    def test_retrieve_not_modified(self, api_client, sample_url):
+        """Test a matching ETag gets a 304 until the URL is clicked"""
+        etag = api_client.get(f'/api/urls/{sample_url.id}/')['ETag']
+
+        response = api_client.get(f'/api/urls/{sample_url.id}/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response.content == b''
+        assert response['Cache-Control'] == 'max-age=0, s-maxage=5'
+
+        sample_url.increment_clicks()
+        response = api_client.get(f'/api/urls/{sample_url.id}/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    def test_stats_not_modified_skips_aggregation(
+            self, api_client, sample_url, sample_click, django_assert_num_queries):
+        """Test a 304 for stats only looks up the URL"""
+        etag = api_client.get(f'/api/urls/{sample_url.id}/stats/')['ETag']
+
+        with django_assert_num_queries(1):
+            response = api_client.get(
+                f'/api/urls/{sample_url.id}/stats/', HTTP_IF_NONE_MATCH=etag
+            )
+
+        assert response.status_code == 304
+
+    def test_stats_change_with_enrichment(self, api_client, sample_url, django_capture_on_commit_callbacks):
+        """Test geolocation enrichment changes the stats ETag"""
+        etag = api_client.get(f'/api/urls/{sample_url.id}/stats/')['ETag']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            bump('clicks')
+
+        response = api_client.get(f'/api/urls/{sample_url.id}/stats/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_lists_change_with_url_saves(self, api_client, sample_url, django_capture_on_commit_callbacks):
+        """Test popular and recent are revalidated until a URL changes"""
+        popular = api_client.get('/api/urls/popular/')['ETag']
+        recent = api_client.get('/api/urls/recent/')['ETag']
+        assert popular != recent
+
+        assert api_client.get('/api/urls/popular/', HTTP_IF_NONE_MATCH=popular).status_code == 304
+        assert api_client.get('/api/urls/recent/', HTTP_IF_NONE_MATCH=recent).status_code == 304
+
+        with django_capture_on_commit_callbacks(execute=True):
+            sample_url.title = 'Changed'
+            sample_url.save()
+
+        assert api_client.get('/api/urls/popular/', HTTP_IF_NONE_MATCH=popular).status_code == 200
+        assert api_client.get('/api/urls/recent/', HTTP_IF_NONE_MATCH=recent).status_code == 200
+
+    def test_lists_take_counters_each_window(self, api_client, sample_url, django_capture_on_commit_callbacks):
+        """Test clicks leave list ETags alone until the counters window rolls"""
+        now = time.time()
+        with patch('shortener.conditional.time.time', return_value=now):
+            popular = api_client.get('/api/urls/popular/')['ETag']
+
+            with django_capture_on_commit_callbacks(execute=True):
+                sample_url.increment_clicks()
+
+            assert api_client.get('/api/urls/popular/', HTTP_IF_NONE_MATCH=popular).status_code == 304
+
+        with patch('shortener.conditional.time.time', return_value=now + COUNTERS_WINDOW_SECONDS):
+            assert api_client.get('/api/urls/popular/', HTTP_IF_NONE_MATCH=popular).status_code == 200
+
+    def test_representation_in_etag(self, api_client, sample_url):
+        """Test JSON, NDJSON and query parameters get different ETags"""
+        etags = {
+            api_client.get('/api/urls/popular/')['ETag'],
+            api_client.get('/api/urls/popular/?limit=5')['ETag'],
+            api_client.get('/api/urls/popular/', HTTP_ACCEPT='application/x-ndjson')['ETag'],
+        }
+
+        assert len(etags) == 3
+
+    def test_if_modified_since(self, api_client, sample_url):
+        """Test Last-Modified validation without an ETag"""
+        last_modified = api_client.get(f'/api/urls/{sample_url.id}/')['Last-Modified']
+
+        response = api_client.get(
+            f'/api/urls/{sample_url.id}/', HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+
+        assert response.status_code == 304
+
+    def test_errors_not_cacheable(self, api_client):
+        """Test error responses get no cache policy"""
+        response = api_client.get('/api/urls/999999/')
+
+        assert response.status_code == 404
+        assert not response.has_header('Cache-Control')
+
+    def test_degraded_not_cacheable(self, api_client, sample_url, sample_click, settings):
+        """Test stats missing timed out breakdowns are neither tagged nor cached"""
+        settings.QUERY_TIMEOUT_SECONDS = 0
+
+        response = api_client.get(f'/api/urls/{sample_url.id}/stats/')
+
+        assert response.status_code == 200
+        assert response.data['degraded'] is True
+        assert response.data['total_clicks'] == sample_url.clicks
+        assert not response.has_header('ETag')
+        assert not response.has_header('Last-Modified')
+        assert 'no-store' in response['Cache-Control']
+
+    def test_dashboard_and_trends(self, api_client, sample_url, django_capture_on_commit_callbacks):
+        """Test analytics views revalidate against their versions"""
+        dashboard = api_client.get('/api/analytics/dashboard/')
+        trends = api_client.get('/api/analytics/trends/')
+        assert dashboard['Cache-Control'] == 'max-age=0, s-maxage=60'
+        assert trends['Cache-Control'] == 'max-age=300, s-maxage=300'
+
+        assert api_client.get(
+            '/api/analytics/trends/', HTTP_IF_NONE_MATCH=trends['ETag']
+        ).status_code == 304
+
+        from analytics.tasks import aggregate_analytics
+        with django_capture_on_commit_callbacks(execute=True):
+            aggregate_analytics()
+
+        assert api_client.get(
+            '/api/analytics/trends/', HTTP_IF_NONE_MATCH=trends['ETag']
+        ).status_code == 200
@@ -0,0 +1,94 @@
+"""
+Tests for interned click dimensions
+"""
+import importlib
+import pytest
+from unittest.mock import patch
+from django.apps import apps
+from shortener.dimensions import (
+    click_dimensions,
+    local_dimensions,
+    referer_id,
+    user_agent_dimensions,
+)
+from shortener.models import Browser, Referer, UserAgent
+
+IPHONE = (
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1'
+)
+
+
+@pytest.mark.django_db
+class TestDimensions:
+    """Test dimension interning"""
+
+    def test_user_agent_parsed_and_interned(self):
+        """Test a User-Agent is stored once with its parsed dimensions"""
+        first = user_agent_dimensions(IPHONE)
+        second = user_agent_dimensions(IPHONE)
+
+        assert first == second
+        assert UserAgent.objects.count() == 1
+        user_agent = UserAgent.objects.get()
+        assert user_agent.device_type == 'mobile'
+        assert user_agent.browser.name == 'Mobile Safari'
+        assert user_agent.os.name == 'iOS'
+
+    def test_known_user_agent_not_reparsed(self):
+        """Test parsing only happens the first time a value is seen"""
+        user_agent_dimensions(IPHONE)
+        local_dimensions.clear()
+
+        with patch('shortener.dimensions.parse_user_agent') as parse:
+            user_agent_dimensions(IPHONE)
+        parse.assert_not_called()
+
+    def test_ids_cached_after_commit(self, django_capture_on_commit_callbacks,
+                                     django_assert_num_queries):
+        """Test ids are cached once their transaction commits"""
+        with django_capture_on_commit_callbacks(execute=True):
+            referer_id('https://news.example.com/post?id=1')
+
+        with django_assert_num_queries(0):
+            referer_id('https://news.example.com/post?id=1')
+
+    def test_referer_host(self):
+        """Test referers keep their host for grouping"""
+        referer = Referer.objects.get(pk=referer_id('https://news.example.com/post'))
+        assert referer.host == 'news.example.com'
+        assert referer.url == 'https://news.example.com/post'
+
+    def test_referer_query_dropped(self):
+        """Test referers differing only in tracking parameters share a row"""
+        first = referer_id('https://news.example.com/post?utm_source=a#top')
+        second = referer_id('https://user@news.example.com/post?utm_source=b')
+
+        assert first == second
+        assert Referer.objects.get(pk=first).url == 'https://news.example.com/post'
+
+    def test_click_dimensions(self):
+        """Test the foreign keys for a new click"""
+        dimensions = click_dimensions(IPHONE, '')
+
+        assert dimensions['referer_id'] is None
+        assert dimensions['device_type'] == 'mobile'
+        assert dimensions['browser_id'] == Browser.objects.get(name='Mobile Safari').id
+
+
+@pytest.mark.django_db
+class TestBackfillInterner:
+    """Test the ids remembered by the click dimension backfill"""
+
+    def test_bounded(self):
+        """Test the least recently used ids are forgotten past the size"""
+        backfill = importlib.import_module('shortener.migrations.0003_backfill_click_dimensions')
+        interner = backfill._Interner(apps, 'default', size=2)
+
+        chrome = interner.named('Browser', 'Chrome')
+        interner.named('Browser', 'Firefox')
+        assert interner.named('Browser', 'Chrome') == chrome
+        interner.named('Browser', 'Safari')
+
+        assert list(interner.ids) == [('Browser', 'Chrome'), ('Browser', 'Safari')]
+        assert interner.named('Browser', 'Firefox') == Browser.objects.get(name='Firefox').id
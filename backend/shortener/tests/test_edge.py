@@ -0,0 +1,325 @@
+"""
+Tests for edge redirects and batch click ingestion
+"""
+import json
+import os
+import re
+import time
+import pytest
+from datetime import timedelta
+from django.urls import reverse
+from django.utils import timezone
+from shortener.edge import ClickLog, client_ip, map_path, publish_edge_map
+from shortener.ingestion import ingest_clicks, visitor_session_id
+from shortener.models import URL, Click
+from shortener.tasks import ingest_edge_clicks, publish_edge_redirects
+
+
+@pytest.fixture
+def edge_dir(settings, tmp_path):
+    """Publish edge redirects into a temporary directory"""
+    settings.EDGE_DIR = str(tmp_path)
+    settings.EDGE_REDIRECTS_ENABLED = True
+    return tmp_path
+
+
+def read_map():
+    with open(map_path()) as f:
+        return f.read()
+
+
+def write_log(directory, name, events, tail=''):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), 'a') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+        f.write(tail)
+
+
+def log_event(code, ip='203.0.113.7', user_agent='Mozilla/5.0 (Windows NT 10.0) Chrome/120.0'):
+    return {
+        'code': code,
+        'time': time.time(),
+        'forwarded_for': ip,
+        'user_agent': user_agent,
+        'referer': 'https://news.example.com/',
+    }
+
+
+def event(code, ip='203.0.113.7', user_agent='Mozilla/5.0 (Windows NT 10.0) Chrome/120.0'):
+    return {
+        'code': code,
+        'time': time.time(),
+        'ip_address': ip,
+        'user_agent': user_agent,
+        'referer': 'https://news.example.com/',
+    }
+
+
+@pytest.mark.django_db
+class TestEdgeMap:
+    """Test publishing and evicting edge redirects"""
+
+    def test_publish(self, edge_dir, sample_url):
+        """Test active URLs are published as map entries"""
+        count, changed = publish_edge_map()
+
+        assert (count, changed) == (1, True)
+        assert read_map() == 'test123 "test123|302|max-age=0, no-cache, no-store, must-revalidate, private|https://www.example.com";\n'
+
+    def test_publish_unchanged(self, edge_dir, sample_url):
+        """Test an unchanged map is not rewritten, so nginx is not reloaded"""
+        publish_edge_map()
+        mtime = os.stat(map_path()).st_mtime_ns
+
+        assert publish_edge_map() == (1, False)
+        assert os.stat(map_path()).st_mtime_ns == mtime
+
+    def test_skipped_urls(self, edge_dir, sample_url, expired_url):
+        """Test expiring, inactive and unsafe URLs are left to Django"""
+        URL.objects.create(
+            original_url='https://www.example.com/soon',
+            short_code='soon1',
+            expires_at=timezone.now() + timedelta(minutes=5)
+        )
+        URL.objects.create(
+            original_url='https://www.example.com/later',
+            short_code='later1',
+            expires_at=timezone.now() + timedelta(days=5)
+        )
+        URL.objects.create(original_url='https://www.example.com/$uri', short_code='dollar1')
+        URL.objects.create(original_url='https://www.example.com/"x"', short_code='quote1')
+        URL.objects.create(original_url='https://www.example.com/', short_code='off1', is_active=False)
+        URL.objects.create(original_url='https://www.example.com/', short_code='with-dash')
+
+        publish_edge_map()
+
+        codes = [line.split(' ')[0] for line in read_map().splitlines()]
+        assert codes == ['later1', 'test123']
+
+    def test_codes_differing_by_case(self, edge_dir, sample_url):
+        """Test codes one nginx key apart are left to Django, others only match exactly"""
+        URL.objects.create(original_url='https://www.example.com/a', short_code='abc123')
+        URL.objects.create(original_url='https://www.example.com/b', short_code='ABC123')
+
+        publish_edge_map()
+
+        [line] = read_map().splitlines()
+        code, value = line.rstrip(';').split(' ', 1)
+        entry = value.strip('"')
+        # nginx.conf's $edge_destination guard
+        guard = re.compile(r'^([a-zA-Z0-9]+)\|\1\|(.*)$')
+        assert code == 'test123'
+        assert guard.match(f'test123|{entry}').group(2).startswith('302|')
+        assert guard.match(f'TEST123|{entry}') is None
+
+    def test_redirect_policy(self, edge_dir, sample_url):
+        """Test entries carry the status and Cache-Control of the policy"""
+        sample_url.redirect_policy = URL.REDIRECT_308
+        sample_url.save()
+        URL.objects.create(
+            original_url='https://www.example.com/soon',
+            short_code='soon1',
+            redirect_policy=URL.REDIRECT_301,
+            expires_at=timezone.now() + timedelta(days=1, minutes=30)
+        )
+
+        publish_edge_map()
+
+        assert read_map() == 'test123 "test123|308|public, max-age=86400|https://www.example.com";\n'
+
+    def test_update_evicts(self, edge_dir, api_client, sample_url):
+        """Test editing a URL drops it from the map until the next publish"""
+        publish_edge_map()
+
+        api_client.patch(
+            reverse('url-detail', kwargs={'pk': sample_url.pk}),
+            {'original_url': 'https://www.changed.com'},
+            format='json'
+        )
+
+        assert read_map() == ''
+        publish_edge_map()
+        assert read_map() == 'test123 "test123|302|max-age=0, no-cache, no-store, must-revalidate, private|https://www.changed.com";\n'
+
+    def test_destroy_evicts(self, edge_dir, api_client, sample_url):
+        """Test deactivating a URL drops it from the map"""
+        publish_edge_map()
+
+        api_client.delete(reverse('url-detail', kwargs={'pk': sample_url.pk}))
+
+        assert read_map() == ''
+        assert publish_edge_map() == (0, False)
+
+    def test_counters_keep_map(self, edge_dir, sample_url):
+        """Test click counter updates leave the map alone"""
+        publish_edge_map()
+
+        sample_url.increment_clicks()
+
+        assert read_map() == 'test123 "test123|302|max-age=0, no-cache, no-store, must-revalidate, private|https://www.example.com";\n'
+
+    def test_disabled_removes_map(self, edge_dir, settings, sample_url):
+        """Test turning edge redirects off withdraws the published map"""
+        publish_edge_redirects()
+        assert os.path.exists(map_path())
+
+        settings.EDGE_REDIRECTS_ENABLED = False
+        publish_edge_redirects()
+
+        assert not os.path.exists(map_path())
+
+
+class TestClickLog:
+    """Test reading nginx's click logs from saved offsets"""
+
+    def test_read_and_commit(self, edge_dir):
+        """Test events are read once and offsets survive a new reader"""
+        directory = edge_dir / 'clicks'
+        write_log(directory, 'clicks-2024-01-01T10.log', [log_event('a1b2c3'), log_event('d4e5f6')])
+        log = ClickLog()
+
+        events, offsets = log.read(10)
+        assert [e['code'] for e in events] == ['a1b2c3', 'd4e5f6']
+        assert events[0]['ip_address'] == '203.0.113.7'
+
+        log.commit(offsets)
+        assert ClickLog().read(10)[0] == []
+
+    def test_uncommitted_events_are_read_again(self, edge_dir):
+        """Test a batch that failed to store is retried"""
+        write_log(edge_dir / 'clicks', 'clicks-2024-01-01T10.log', [log_event('a1b2c3')])
+        log = ClickLog()
+
+        log.read(10)
+
+        assert len(log.read(10)[0]) == 1
+
+    def test_limit_and_partial_line(self, edge_dir):
+        """Test batches stop at the limit and at a line still being written"""
+        directory = edge_dir / 'clicks'
+        write_log(
+            directory, 'clicks-2024-01-01T10.log',
+            [log_event('a1b2c3'), log_event('d4e5f6'), log_event('g7h8i9')],
+            tail='{"code":"partial'
+        )
+        log = ClickLog()
+
+        events, offsets = log.read(2)
+        assert len(events) == 2
+        log.commit(offsets)
+
+        events, offsets = log.read(10)
+        assert [e['code'] for e in events] == ['g7h8i9']
+        log.commit(offsets)
+
+        write_log(directory, 'clicks-2024-01-01T10.log', [], tail='", "time": 1}\n')
+        assert [e['code'] for e in log.read(10)[0]] == ['partial']
+
+    def test_bad_lines_skipped(self, edge_dir):
+        """Test malformed lines do not block the log"""
+        write_log(edge_dir / 'clicks', 'clicks-2024-01-01T10.log', [log_event('a1b2c3')], tail='oops\n')
+
+        events, offsets = ClickLog().read(10)
+
+        assert [e['code'] for e in events] == ['a1b2c3']
+
+    def test_old_files_deleted(self, edge_dir):
+        """Test fully read files nginx has moved on from are deleted"""
+        directory = edge_dir / 'clicks'
+        write_log(directory, 'clicks-2024-01-01T10.log', [log_event('a1b2c3')])
+        write_log(directory, 'clicks-2024-01-01T11.log', [log_event('d4e5f6')])
+        old = os.path.join(directory, 'clicks-2024-01-01T10.log')
+        os.utime(old, (time.time() - 3600, time.time() - 3600))
+        log = ClickLog()
+
+        events, offsets = log.read(10)
+        log.commit(offsets)
+
+        assert len(events) == 2
+        assert log.files() == ['clicks-2024-01-01T11.log']
+
+    def test_client_ip(self, settings):
+        """Test the client IP trusts the same proxies as get_client_ip"""
+        settings.TRUSTED_PROXY_COUNT = 1
+        assert client_ip('198.51.100.1, 203.0.113.7') == '203.0.113.7'
+
+        settings.TRUSTED_PROXY_COUNT = 2
+        assert client_ip('198.51.100.1, 203.0.113.7') == '198.51.100.1'
+
+
+@pytest.mark.django_db
+class TestClickIngestion:
+    """Test storing click events in batches"""
+
+    def test_counters_and_clicks(self, sample_url):
+        """Test counters, unique visitors and click rows for a batch"""
+        events = [
+            event('test123'),
+            event('test123'),
+            event('test123', ip='198.51.100.9'),
+            event('missing'),
+        ]
+
+        assert ingest_clicks(events) == 3
+
+        sample_url.refresh_from_db()
+        assert sample_url.clicks == 3
+        assert sample_url.unique_clicks == 2
+        assert sample_url.last_accessed is not None
+        clicks = Click.objects.filter(url=sample_url)
+        assert clicks.count() == 3
+        assert clicks.first().browser.name == 'Chrome'
+        assert clicks.first().referer.url == 'https://news.example.com/'
+
+    def test_click_time_from_log(self, sample_url):
+        """Test a backlogged click keeps the time nginx redirected it"""
+        old = event('test123')
+        old['time'] -= 3600
+
+        ingest_clicks([old])
+
+        click = Click.objects.get(url=sample_url)
+        assert click.clicked_at.timestamp() == pytest.approx(old['time'])
+        assert timezone.now() - click.clicked_at > timedelta(minutes=59)
+
+    def test_returning_visitor(self, sample_url, sample_click):
+        """Test visitors seen before are not counted as unique again"""
+        Click.objects.create(url=sample_url, session_id=visitor_session_id('203.0.113.7', 'Mozilla/5.0'))
+
+        ingest_clicks([event('test123', user_agent='Mozilla/5.0')])
+
+        sample_url.refresh_from_db()
+        assert sample_url.unique_clicks == 0
+
+    def test_sampled(self, sample_url):
+        """Test sampled URLs store weighted rows and exact counters"""
+        sample_url.click_sample_rate = 4
+        sample_url.save()
+
+        ingest_clicks([event('test123', ip=f'198.51.100.{n}') for n in range(40)])
+
+        sample_url.refresh_from_db()
+        clicks = Click.objects.filter(url=sample_url)
+        assert sample_url.clicks == 40
+        assert sample_url.unique_clicks == 4 * clicks.count()
+        assert set(clicks.values_list('weight', flat=True)) == {4}
+
+    def test_query_count(self, sample_url, django_assert_max_num_queries,
+                         django_capture_on_commit_callbacks):
+        """Test a batch costs a fixed number of queries once dimensions are known"""
+        with django_capture_on_commit_callbacks(execute=True):
+            ingest_clicks([event('test123')])
+
+        with django_assert_max_num_queries(6):
+            ingest_clicks([event('test123', ip=f'198.51.100.{n}') for n in range(50)])
+
+    def test_ingest_task(self, edge_dir, sample_url):
+        """Test the task drains the logs into the database"""
+        write_log(edge_dir / 'clicks', 'clicks-2024-01-01T10.log', [log_event('test123')] * 3)
+
+        assert ingest_edge_clicks() == 3
+        assert ingest_edge_clicks() == 0
+
+        sample_url.refresh_from_db()
+        assert sample_url.clicks == 3
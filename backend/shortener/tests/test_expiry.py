@@ -0,0 +1,136 @@
+"""
+Tests for scheduled URL expiry
+"""
+import pytest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.urls import reverse
+from django.utils import timezone
+from shortener.cache import get_cached_url
+from shortener.expiry import expire_due
+from shortener.models import URL, ScheduledExpiry
+from shortener.tasks import cleanup_expired_urls, expire_due_urls
+
+
+def due_at(url):
+    return ScheduledExpiry.objects.get(url=url).due_at
+
+
+class TestBucket:
+    """Test rounding expiries to minute buckets"""
+
+    def test_rounds_up(self):
+        """Test an expiry is never due before it happens"""
+        expires_at = datetime(2024, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc)
+
+        assert ScheduledExpiry.bucket(expires_at) == datetime(2024, 1, 2, 3, 5, tzinfo=dt_timezone.utc)
+
+    def test_exact_minute(self):
+        """Test an expiry on the minute stays in that minute"""
+        expires_at = datetime(2024, 1, 2, 3, 4, tzinfo=dt_timezone.utc)
+
+        assert ScheduledExpiry.bucket(expires_at) == expires_at
+
+
+@pytest.mark.django_db
+class TestSchedule:
+    """Test URL saves keep the schedule in step"""
+
+    def test_created_with_expiry(self, expired_url):
+        """Test a new URL with an expiry is scheduled"""
+        assert due_at(expired_url) == ScheduledExpiry.bucket(expired_url.expires_at)
+
+    def test_created_without_expiry(self, sample_url):
+        """Test URLs that never expire are not scheduled"""
+        assert not ScheduledExpiry.objects.exists()
+
+    def test_expiry_moved(self, sample_url):
+        """Test changing expires_at moves the schedule"""
+        sample_url.expires_at = timezone.now() + timedelta(days=1)
+        sample_url.save()
+        sample_url.expires_at = timezone.now() + timedelta(days=2)
+        sample_url.save()
+
+        assert due_at(sample_url) == ScheduledExpiry.bucket(sample_url.expires_at)
+
+    def test_expiry_cleared(self, expired_url):
+        """Test removing the expiry cancels the schedule"""
+        expired_url.expires_at = None
+        expired_url.save()
+
+        assert not ScheduledExpiry.objects.exists()
+
+    def test_deactivated(self, api_client, expired_url):
+        """Test deleting a URL cancels its schedule"""
+        api_client.delete(reverse('url-detail', kwargs={'pk': expired_url.pk}))
+
+        assert not ScheduledExpiry.objects.exists()
+
+    def test_counters_keep_schedule(self, expired_url):
+        """Test click counter saves do not touch the schedule"""
+        expired_url.increment_clicks()
+
+        assert ScheduledExpiry.objects.filter(url=expired_url).exists()
+
+
+@pytest.mark.django_db
+class TestExpireDue:
+    """Test deactivating the URLs that are due"""
+
+    def test_expires_due_urls(self, api_client, sample_url, expired_url):
+        """Test due URLs are deactivated and evicted, others left alone"""
+        later = URL.objects.create(
+            original_url='https://www.example.com/later',
+            short_code='later1',
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+        api_client.get(f'/{expired_url.short_code}/')
+
+        assert expire_due_urls() == 1
+
+        expired_url.refresh_from_db()
+        assert not expired_url.is_active
+        assert get_cached_url(expired_url.short_code) is None
+        assert list(ScheduledExpiry.objects.values_list('url_id', flat=True)) == [later.pk]
+
+    def test_not_due_yet(self):
+        """Test nothing is expired before its minute"""
+        url = URL.objects.create(
+            original_url='https://www.example.com/soon',
+            short_code='soon1',
+            expires_at=timezone.now() + timedelta(seconds=90)
+        )
+
+        assert expire_due() == 0
+        assert expire_due(now=url.expires_at + timedelta(minutes=1)) == 1
+
+    def test_batches(self):
+        """Test more URLs than one batch are all expired"""
+        past = timezone.now() - timedelta(minutes=5)
+        for n in range(5):
+            URL.objects.create(original_url='https://www.example.com/', short_code=f'batch{n}', expires_at=past)
+
+        assert expire_due(batch_size=2) == 5
+        assert not ScheduledExpiry.objects.exists()
+
+    def test_stale_schedule_row(self, expired_url):
+        """Test an expiry moved without its schedule is scheduled again, not expired"""
+        URL.objects.filter(pk=expired_url.pk).update(expires_at=timezone.now() + timedelta(days=1))
+
+        assert expire_due() == 0
+
+        expired_url.refresh_from_db()
+        assert expired_url.is_active
+        assert due_at(expired_url) == ScheduledExpiry.bucket(expired_url.expires_at)
+
+    def test_cost_proportional_to_due(self, sample_url, expired_url, django_assert_max_num_queries):
+        """Test a run with nothing due is one indexed lookup in its savepoint"""
+        expire_due_urls()
+
+        with django_assert_max_num_queries(3):
+            assert expire_due_urls() == 0
+
+    def test_backstop_clears_schedule(self, expired_url):
+        """Test the full-scan cleanup also drops what it deactivates"""
+        assert cleanup_expired_urls() == 1
+
+        assert not ScheduledExpiry.objects.exists()
@@ -0,0 +1,75 @@
+"""
+Tests for event-driven cache invalidation
+"""
+import pytest
+from unittest.mock import Mock
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from shortener import invalidation
+from shortener.cache import get_cached_url, local_urls, qrcode_cache_key, url_cache_key
+from shortener.tasks import cleanup_expired_urls
+
+
+def warm(api_client, url):
+    """Redirect once so the URL is cached in both tiers"""
+    api_client.get(f'/{url.short_code}/')
+    assert get_cached_url(url.short_code) is not None
+    assert local_urls.get(url_cache_key(url.short_code)) is not None
+
+
+@pytest.mark.django_db
+class TestURLInvalidation:
+    """Tests for cache eviction on URL changes"""
+
+    def test_update_evicts_cache(self, api_client, sample_url):
+        """Test editing a URL drops every cached copy"""
+        warm(api_client, sample_url)
+        cache.set(qrcode_cache_key(sample_url.short_code), b'png')
+
+        response = api_client.patch(
+            reverse('url-detail', kwargs={'pk': sample_url.pk}),
+            {'original_url': 'https://www.changed.com'},
+            format='json'
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert get_cached_url(sample_url.short_code) is None
+        assert local_urls.get(url_cache_key(sample_url.short_code)) is None
+        assert cache.get(qrcode_cache_key(sample_url.short_code)) is None
+        assert api_client.get(f'/{sample_url.short_code}/').url == 'https://www.changed.com'
+
+    def test_destroy_stops_redirecting(self, api_client, sample_url):
+        """Test a deactivated URL stops redirecting immediately"""
+        warm(api_client, sample_url)
+
+        api_client.delete(reverse('url-detail', kwargs={'pk': sample_url.pk}))
+
+        response = api_client.get(f'/{sample_url.short_code}/')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_click_counters_keep_cache(self, api_client, sample_url):
+        """Test click counter updates do not evict the URL"""
+        warm(api_client, sample_url)
+
+        sample_url.increment_clicks()
+
+        assert get_cached_url(sample_url.short_code) is not None
+
+    def test_cleanup_expired_urls_evicts_cache(self, api_client, expired_url):
+        """Test the bulk expiry task evicts what it deactivates"""
+        cache.set(url_cache_key(expired_url.short_code), ('stale', 0, 0), 60)
+
+        assert cleanup_expired_urls() == 1
+        assert cache.get(url_cache_key(expired_url.short_code)) is None
+
+    def test_publishes_to_other_workers(self, monkeypatch, sample_url, settings):
+        """Test invalidations are published for other workers' local caches"""
+        client = Mock()
+        monkeypatch.setattr(invalidation, '_redis_client', lambda: client)
+
+        invalidation.invalidate_urls([sample_url.short_code, 'other'])
+
+        client.publish.assert_called_with(
+            settings.CACHE_INVALIDATION_CHANNEL, f'{sample_url.short_code},other'
+        )
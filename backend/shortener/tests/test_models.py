@@ -79,7 +79,6 @@ class TestClickModel:
         click = Click.objects.create(
             url=sample_url,
             ip_address='192.168.1.1',
-            user_agent='Test Agent',
             session_id='session123'
         )
         assert click.url == sample_url
@@ -0,0 +1,170 @@
+"""
+Query and cache budgets for the shortener endpoints
+
+Each budget runs against several URLs and clicks, so a per-row query
+shows up as a budget failure. Re-record after an intended change with
+``pytest --record-query-budgets``.
+"""
+import pytest
+from django.core.cache import cache
+from shortener.dimensions import click_dimensions
+from shortener.models import URL, Click
+
+URL_COUNT = 5
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0'
+
+
+@pytest.fixture
+def urls(db):
+    """Several URLs with clicks from interned dimensions"""
+    created = [
+        URL.objects.create(
+            original_url=f'https://www.example.com/{i}',
+            short_code=f'budget{i}',
+            title=f'Budget {i}',
+            qr_code=f'qr_codes/budget{i}.png'
+        )
+        for i in range(URL_COUNT)
+    ]
+    for url in created:
+        for i in range(3):
+            Click.objects.create(
+                url=url,
+                ip_address='127.0.0.1',
+                session_id=f'session{i}',
+                country='US',
+                **click_dimensions(USER_AGENT, f'https://referer{i}.example.com/')
+            )
+    return created
+
+
+@pytest.mark.django_db
+class TestURLViewSetBudgets:
+    """Test URLViewSet stays within its query budgets"""
+
+    def test_list(self, api_client, urls, query_budget):
+        """Test listing URLs"""
+        with query_budget(queries=2, cache=0):
+            response = api_client.get('/api/urls/')
+        assert len(response.data['results']) == URL_COUNT
+
+    def test_retrieve(self, api_client, urls, query_budget):
+        """Test URL details"""
+        with query_budget(queries=1, cache=0):
+            response = api_client.get(f'/api/urls/{urls[0].id}/')
+        assert response.data['qr_code_url']
+
+    def test_create(self, api_client, query_budget):
+        """Test creating a URL, including the eager QR code task"""
+        with query_budget(queries=4, cache=2):
+            response = api_client.post(
+                '/api/urls/',
+                {'original_url': 'https://www.example.com/new'},
+                format='json'
+            )
+        assert response.status_code == 201
+
+    def test_create_custom_code(self, api_client, query_budget):
+        """Test creating a URL with a custom code"""
+        with query_budget(queries=4, cache=2):
+            response = api_client.post(
+                '/api/urls/',
+                {'original_url': 'https://www.example.com/new', 'custom_code': 'mycode'},
+                format='json'
+            )
+        assert response.status_code == 201
+
+    def test_update(self, api_client, urls, query_budget):
+        """Test updating a URL"""
+        with query_budget(queries=3, cache=1):
+            response = api_client.patch(
+                f'/api/urls/{urls[0].id}/',
+                {'title': 'Updated'},
+                format='json'
+            )
+        assert response.status_code == 200
+
+    def test_destroy(self, api_client, urls, query_budget):
+        """Test soft deleting a URL"""
+        with query_budget(queries=3, cache=1):
+            response = api_client.delete(f'/api/urls/{urls[0].id}/')
+        assert response.status_code == 204
+
+    def test_stats(self, api_client, urls, query_budget):
+        """Test the stats breakdown"""
+        with query_budget(queries=8, cache=2):
+            response = api_client.get(f'/api/urls/{urls[0].id}/stats/')
+        assert response.data['total_clicks'] == 0
+
+    def test_export_clicks(self, api_client, urls, query_budget):
+        """Test streaming a URL's clicks"""
+        with query_budget(queries=2, cache=0):
+            response = api_client.get(f'/api/urls/{urls[0].id}/clicks/export/?as=ndjson')
+            lines = b''.join(response.streaming_content).splitlines()
+        assert len(lines) == 3
+
+    def test_qrcode(self, api_client, urls, query_budget):
+        """Test rendering a QR code, then serving it from the cache"""
+        with query_budget(queries=1, cache=2):
+            api_client.get(f'/api/urls/{urls[0].id}/qrcode/')
+        with query_budget(queries=1, cache=1):
+            response = api_client.get(f'/api/urls/{urls[0].id}/qrcode/')
+        assert response['Content-Type'] == 'image/png'
+
+    def test_resolve(self, api_client, urls, query_budget):
+        """Test resolving a batch of codes, cold then cached"""
+        codes = [url.short_code for url in urls] + ['missing']
+        with query_budget(queries=1, cache=2):
+            api_client.post('/api/urls/resolve/', {'codes': codes}, format='json')
+        with query_budget(queries=1, cache=1):
+            response = api_client.post('/api/urls/resolve/', {'codes': codes}, format='json')
+        assert response.data['results']['missing']['status'] == 'not_found'
+
+    def test_available(self, api_client, urls, query_budget):
+        """Test checking taken and free codes"""
+        with query_budget(queries=1, cache=0):
+            response = api_client.get('/api/urls/available/?code=budget0')
+        assert response.data['available'] is False
+        with query_budget(queries=1, cache=0):
+            response = api_client.get('/api/urls/available/?code=freecode')
+        assert response.data['available'] is True
+
+    def test_popular(self, api_client, urls, query_budget):
+        """Test the most clicked URLs"""
+        with query_budget(queries=1, cache=2):
+            response = api_client.get('/api/urls/popular/')
+        assert len(response.data) == URL_COUNT
+
+    def test_recent(self, api_client, urls, query_budget):
+        """Test the newest URLs"""
+        with query_budget(queries=1, cache=2):
+            response = api_client.get('/api/urls/recent/')
+        assert len(response.data) == URL_COUNT
+
+
+@pytest.mark.django_db
+class TestRedirectViewBudgets:
+    """Test redirects stay within their query budgets"""
+
+    def test_redirect_cold(self, api_client, urls, query_budget):
+        """Test a redirect that loads the URL, including the eager click task"""
+        cache.clear()
+        with query_budget(queries=20, cache=5):
+            response = api_client.get(f'/{urls[0].short_code}/')
+        assert response.status_code == 302
+
+    def test_redirect_cached(self, api_client, urls, query_budget):
+        """Test a redirect served from the cache"""
+        api_client.get(f'/{urls[0].short_code}/')
+        with query_budget(queries=7, cache=0):
+            response = api_client.get(f'/{urls[0].short_code}/')
+        assert response.status_code == 302
+
+    def test_redirect_not_found(self, api_client, query_budget):
+        """Test an unknown code, then the cached miss"""
+        with query_budget(queries=1, cache=5):
+            response = api_client.get('/nothere/')
+        assert response.status_code == 404
+        with query_budget(queries=0, cache=1):
+            response = api_client.get('/nothere/')
+        assert response.status_code == 404
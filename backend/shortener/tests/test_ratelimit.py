@@ -0,0 +1,129 @@
+"""
+Tests for the sliding-window rate limiter
+"""
+import pytest
+from unittest.mock import MagicMock
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework import status
+from shortener.ratelimit import LocalBackend, RateLimiter, RedisBackend, get_client_ip, limiter
+
+
+class TestLocalBackend:
+    """Tests for the in-process sliding window"""
+
+    def test_allows_up_to_limit(self):
+        """Test requests are allowed until the limit and then rejected"""
+        backend = LocalBackend()
+
+        decisions = [backend.hit('client', limit=3, period=60)[0] for _ in range(4)]
+
+        assert decisions == [True, True, True, False]
+
+    def test_previous_window_is_weighted(self, monkeypatch):
+        """Test the previous window still counts while it overlaps"""
+        backend = LocalBackend()
+        clock = [600.0]
+        monkeypatch.setattr('shortener.ratelimit.time.time', lambda: clock[0])
+        for _ in range(4):
+            backend.hit('client', limit=4, period=60)
+
+        # A quarter into the next window 75% of the previous one still counts
+        clock[0] = 675.0
+        assert backend.hit('client', limit=4, period=60)[0] is True
+        assert backend.hit('client', limit=4, period=60)[0] is False
+
+
+class TestKeyPrefix:
+    """Test limiters under their own key prefix"""
+
+    def test_reset_keeps_other_prefixes(self, settings):
+        """Test a benchmark limiter's reset leaves real clients' counters alone"""
+        settings.RATE_LIMIT_POLICIES = {'test': {'limit': 1, 'period': 60}}
+        bench = RateLimiter(key_prefix='ratelimit-bench')
+        bench._backend = limiter.backend
+        limiter.check('test', 'client')
+        bench.check('test', 'client')
+
+        bench.reset()
+
+        assert limiter.check('test', 'client').allowed is False
+        assert bench.check('test', 'client').allowed is True
+
+    def test_redis_reset_scans_prefix(self):
+        """Test Redis counters are only deleted under the limiter's prefix"""
+        client = MagicMock()
+        client.scan_iter.return_value = ['ratelimit-bench:{redirect:a}']
+
+        RedisBackend(client).reset('ratelimit-bench')
+
+        client.scan_iter.assert_called_once_with(match='ratelimit-bench:*', count=1000)
+        client.delete.assert_called_once_with('ratelimit-bench:{redirect:a}')
+
+
+class TestClientIP:
+    """Tests for get_client_ip"""
+
+    def test_forwarded_for_ignored_without_trusted_proxies(self, settings):
+        """Test a spoofed X-Forwarded-For does not change identity"""
+        settings.TRUSTED_PROXY_COUNT = 0
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.2.3.4', REMOTE_ADDR='10.0.0.1')
+
+        assert get_client_ip(request) == '10.0.0.1'
+
+    def test_forwarded_for_from_trusted_proxy(self, settings):
+        """Test the hop added by the trusted proxy is used"""
+        settings.TRUSTED_PROXY_COUNT = 1
+        request = RequestFactory().get(
+            '/', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.9', REMOTE_ADDR='10.0.0.1'
+        )
+
+        assert get_client_ip(request) == '203.0.113.9'
+
+
+@pytest.mark.django_db
+class TestRateLimitedViews:
+    """Tests for per-route policies on the API"""
+
+    def test_create_limit(self, api_client, settings):
+        """Test create returns 429 with RateLimit headers past its policy"""
+        settings.RATE_LIMIT_POLICIES = {**settings.RATE_LIMIT_POLICIES, 'create': {'limit': 2, 'period': 60}}
+        url = reverse('url-list')
+        data = {'original_url': 'https://www.example.com'}
+
+        responses = [api_client.post(url, data, format='json') for _ in range(3)]
+
+        assert [r.status_code for r in responses] == [201, 201, 429]
+        assert responses[0]['RateLimit-Limit'] == '2'
+        assert responses[0]['RateLimit-Remaining'] == '1'
+        assert int(responses[2]['Retry-After']) >= 1
+
+    def test_redirect_limit(self, api_client, settings, sample_url):
+        """Test redirects have their own policy"""
+        settings.RATE_LIMIT_POLICIES = {**settings.RATE_LIMIT_POLICIES, 'redirect': {'limit': 1, 'period': 60}}
+
+        first = api_client.get(f'/{sample_url.short_code}/')
+        second = api_client.get(f'/{sample_url.short_code}/')
+
+        assert first.status_code == status.HTTP_302_FOUND
+        assert second.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    def test_blocked_client_skips_backend(self, settings, monkeypatch):
+        """Test a rejected client is answered from the local blocked cache"""
+        settings.RATE_LIMIT_POLICIES = {**settings.RATE_LIMIT_POLICIES, 'stats': {'limit': 1, 'period': 60}}
+        limiter.check('stats', '10.0.0.1')
+        assert limiter.check('stats', '10.0.0.1').allowed is False
+
+        calls = []
+        monkeypatch.setattr(limiter.backend, 'hit', lambda *args: calls.append(args))
+
+        assert limiter.check('stats', '10.0.0.1').allowed is False
+        assert calls == []
+
+    def test_disabled(self, api_client, settings, sample_url):
+        """Test no limiting or headers when disabled"""
+        settings.RATE_LIMIT_ENABLED = False
+
+        response = api_client.get(f'/{sample_url.short_code}/')
+
+        assert 'RateLimit-Limit' not in response
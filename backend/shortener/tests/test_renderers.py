@@ -0,0 +1,179 @@
+"""
+Tests for the orjson and NDJSON renderers and parsers
+"""
+import io
+import json
+import uuid
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+import pytest
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
+from config.parsers import NDJSONParser, ORJSONParser
+from config.renderers import NDJSONRenderer, ORJSONRenderer
+from shortener.models import URL
+
+PAYLOADS = [
+    {'a': 1, 'b': [1.5, None, True], 'c': 'text'},
+    [datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=ZoneInfo('UTC'))],
+    [datetime(2024, 1, 2, 3, 4, 5, tzinfo=ZoneInfo('Asia/Kolkata'))],
+    [datetime(2024, 1, 2, 3, 4, 5), date(2024, 1, 2), time(3, 4, 5, 6)],
+    {'amount': Decimal('12.50'), 'id': uuid.UUID(int=7)},
+    {'delay': timedelta(seconds=90), 'lazy': gettext_lazy('Not found')},
+    {'detail': ErrorDetail('Invalid code', code='invalid')},
+    ReturnDict([('nested', {'x': (1, 2)})], serializer=None),
+    {'unicode': 'héllo – 世界', 'separators': '\u2028\u2029', 'control': '\x00\x1f\n\t"\\'},
+    {1: 'int key', 'big': 2 ** 63, 'negative': -2 ** 63},
+    [],
+    {},
+]
+
+
+def parser_context(encoding='utf-8'):
+    return {'encoding': encoding}
+
+
+class TestORJSONRenderer:
+    """Test the orjson renderer matches DRF's JSONRenderer"""
+
+    @pytest.mark.parametrize('payload', PAYLOADS)
+    def test_identical_output(self, payload):
+        """Test payloads render byte for byte like the stock renderer"""
+        assert ORJSONRenderer().render(payload) == JSONRenderer().render(payload)
+
+    def test_indent_falls_back(self):
+        """Test an indent requested by the client is honoured"""
+        media_type = 'application/json; indent=2'
+        data = {'a': [1, 2]}
+
+        assert ORJSONRenderer().render(data, media_type) == JSONRenderer().render(data, media_type)
+
+    def test_huge_integers_fall_back(self):
+        """Test integers orjson cannot encode use the stock encoder"""
+        data = {'n': 2 ** 70}
+
+        assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+
+    def test_none_renders_empty(self):
+        """Test no data renders an empty body"""
+        assert ORJSONRenderer().render(None) == b''
+
+    @pytest.mark.django_db
+    def test_api_responses_identical(self, api_client, sample_url, sample_click):
+        """Test real API responses match the stock renderer"""
+        URL.objects.create(
+            original_url='https://www.example.com/ünïcode',
+            short_code='unicode1',
+            title='Ünïcode – title',
+            expires_at=timezone.now() + timedelta(days=1)
+        )
+        paths = [
+            '/api/urls/',
+            '/api/urls/popular/',
+            f'/api/urls/{sample_url.id}/',
+            f'/api/urls/{sample_url.id}/stats/',
+            '/api/analytics/dashboard/',
+        ]
+        for path in paths:
+            response = api_client.get(path)
+
+            assert response.content == JSONRenderer().render(response.data)
+
+
+class TestNDJSONRenderer:
+    """Test rendering one document per line"""
+
+    def test_list(self):
+        """Test a list renders one line per item"""
+        body = NDJSONRenderer().render([{'a': 1}, {'a': 2}])
+
+        assert body == b'{"a":1}\n{"a":2}\n'
+
+    def test_paginated(self):
+        """Test a paginated response renders its results"""
+        body = NDJSONRenderer().render({'count': 2, 'next': None, 'results': [{'a': 1}, {'a': 2}]})
+
+        assert body == b'{"a":1}\n{"a":2}\n'
+
+    def test_single_object(self):
+        """Test a single object renders as one line"""
+        assert NDJSONRenderer().render({'detail': 'Not found.'}) == b'{"detail":"Not found."}\n'
+
+    @pytest.mark.django_db
+    def test_accept_header(self, api_client, sample_url, expired_url):
+        """Test clients can ask for NDJSON"""
+        response = api_client.get('/api/urls/', HTTP_ACCEPT='application/x-ndjson')
+
+        assert response['Content-Type'] == 'application/x-ndjson'
+        records = [json.loads(line) for line in response.content.splitlines()]
+        assert {record['short_code'] for record in records} == {'test123', 'expired'}
+
+
+class TestORJSONParser:
+    """Test the orjson parser matches DRF's JSONParser"""
+
+    @pytest.mark.parametrize('body', [
+        b'{"a": 1, "b": [1.5, null, true], "c": "h\\u00e9llo"}',
+        '{"unicode": "世界"}'.encode(),
+        b'[]',
+        b'  "text"  ',
+    ])
+    def test_identical_data(self, body):
+        """Test bodies parse to the same data as the stock parser"""
+        expected = JSONParser().parse(io.BytesIO(body), parser_context=parser_context())
+
+        assert ORJSONParser().parse(io.BytesIO(body), parser_context=parser_context()) == expected
+
+    @pytest.mark.parametrize('body', [b'{"a": ', b'{"a": NaN}', b''])
+    def test_invalid_body(self, body):
+        """Test invalid bodies raise the stock parse error"""
+        with pytest.raises(ParseError) as fast:
+            ORJSONParser().parse(io.BytesIO(body), parser_context=parser_context())
+        with pytest.raises(ParseError) as stock:
+            JSONParser().parse(io.BytesIO(body), parser_context=parser_context())
+
+        assert str(fast.value) == str(stock.value)
+
+    def test_other_charset(self):
+        """Test non-UTF-8 bodies are decoded with their charset"""
+        body = '{"name": "café"}'.encode('latin-1')
+
+        data = ORJSONParser().parse(io.BytesIO(body), parser_context=parser_context('latin-1'))
+
+        assert data == {'name': 'café'}
+
+
+class TestNDJSONParser:
+    """Test parsing one document per line"""
+
+    def test_lines(self):
+        """Test each non-blank line becomes an item"""
+        body = io.BytesIO(b'{"a": 1}\n\n"code"\n[1, 2]')
+
+        assert NDJSONParser().parse(body, parser_context=parser_context()) == [{'a': 1}, 'code', [1, 2]]
+
+    def test_invalid_line(self):
+        """Test a bad line is reported by number"""
+        body = io.BytesIO(b'{"a": 1}\n{"a": \n')
+
+        with pytest.raises(ParseError, match='line 2'):
+            NDJSONParser().parse(body, parser_context=parser_context())
+
+    @pytest.mark.django_db
+    def test_resolve_ndjson_body(self, api_client, sample_url):
+        """Test resolving codes sent one per line"""
+        response = api_client.post(
+            '/api/urls/resolve/',
+            data=b'"test123"\n"missing"\n',
+            content_type='application/x-ndjson'
+        )
+
+        assert response.status_code == 200
+        assert response.data['results']['test123']['status'] == 'active'
+        assert response.data['results']['missing']['status'] == 'not_found'
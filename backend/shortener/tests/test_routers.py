@@ -0,0 +1,89 @@
+"""
+Tests for read-replica routing
+"""
+import pytest
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.test import RequestFactory
+from config import routers
+from config.routers import (
+    ReplicaPinningMiddleware,
+    ReplicaRouter,
+    pin_primary,
+    use_replica,
+)
+from shortener.models import URL
+
+
+@pytest.fixture
+def replicas(settings, monkeypatch):
+    """Configure one replica whose lag can be set by the test"""
+    settings.DATABASE_REPLICAS = ['replica_0']
+    lag = {'replica_0': 0.0}
+    monkeypatch.setattr(routers, 'replica_lag', lambda alias: lag[alias])
+    return lag
+
+
+class TestReplicaRouter:
+    """Tests for ReplicaRouter"""
+
+    def test_reads_default_to_primary(self, replicas):
+        """Test reads outside use_replica stay on the primary"""
+        assert ReplicaRouter().db_for_read(URL) == DEFAULT_DB_ALIAS
+
+    def test_opted_in_reads_use_replica(self, replicas):
+        """Test reads inside use_replica go to a healthy replica"""
+        with use_replica():
+            assert ReplicaRouter().db_for_read(URL) == 'replica_0'
+
+    def test_lagging_replica_falls_back(self, replicas, settings):
+        """Test a replica past the lag budget is skipped"""
+        replicas['replica_0'] = settings.REPLICA_MAX_LAG_SECONDS + 1
+
+        with use_replica():
+            assert ReplicaRouter().db_for_read(URL) == DEFAULT_DB_ALIAS
+
+    def test_pinned_reads_use_primary(self, replicas):
+        """Test read-your-writes pinning wins over use_replica"""
+        with use_replica(), pin_primary():
+            assert ReplicaRouter().db_for_read(URL) == DEFAULT_DB_ALIAS
+
+    def test_writes_and_migrations_stay_on_primary(self, replicas):
+        """Test writes never target a replica"""
+        router = ReplicaRouter()
+        with use_replica():
+            assert router.db_for_write(URL) == DEFAULT_DB_ALIAS
+        assert router.allow_migrate('replica_0', 'shortener') is False
+
+    def test_no_replicas_is_a_no_op(self, settings):
+        """Test the router defers to Django without replicas"""
+        settings.DATABASE_REPLICAS = []
+        with use_replica():
+            assert ReplicaRouter().db_for_read(URL) is None
+
+
+class TestReplicaPinningMiddleware:
+    """Tests for ReplicaPinningMiddleware"""
+
+    def test_write_sets_pin_cookie(self, replicas, settings):
+        """Test a successful write pins the client to the primary"""
+        middleware = ReplicaPinningMiddleware(lambda request: HttpResponse(status=201))
+
+        response = middleware(RequestFactory().post('/api/urls/'))
+
+        assert response.cookies[settings.REPLICA_PIN_COOKIE]['max-age'] == settings.REPLICA_PIN_SECONDS
+
+    def test_pin_cookie_routes_reads_to_primary(self, replicas, settings):
+        """Test requests carrying the pin cookie read from the primary"""
+        seen = []
+
+        def view(request):
+            with use_replica():
+                seen.append(ReplicaRouter().db_for_read(URL))
+            return HttpResponse()
+
+        request = RequestFactory().get('/api/urls/')
+        request.COOKIES[settings.REPLICA_PIN_COOKIE] = '1'
+        ReplicaPinningMiddleware(view)(request)
+
+        assert seen == [DEFAULT_DB_ALIAS]
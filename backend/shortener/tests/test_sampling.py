@@ -0,0 +1,59 @@
+"""
+Tests for click sampling
+"""
+import pytest
+from django.core.cache import cache
+from shortener.models import Click
+from shortener.sampling import adaptive_rate, in_sample, sample_rate
+from shortener.stats import click_breakdown
+from shortener.tasks import track_click_async
+
+
+@pytest.mark.django_db
+class TestSampling:
+    """Test sampling policy and weighted ingestion"""
+
+    def test_adaptive_rate_steps(self, settings):
+        """Test the rate follows the configured thresholds"""
+        settings.CLICK_SAMPLING_THRESHOLDS = [(100, 10), (1000, 100)]
+        assert adaptive_rate(99) == 1
+        assert adaptive_rate(100) == 10
+        assert adaptive_rate(5000) == 100
+
+    def test_sampled_visitors_stay_sampled(self):
+        """Test a visitor sampled at N is sampled at multiples of N"""
+        for i in range(500):
+            if in_sample(1, f'session-{i}', 100):
+                assert in_sample(1, f'session-{i}', 10)
+
+    def test_url_rate_overrides_global(self, sample_url, settings):
+        """Test a per-URL rate wins over the global policy"""
+        settings.CLICK_SAMPLE_RATE = 5
+        assert sample_rate(sample_url) == 5
+        sample_url.click_sample_rate = 50
+        assert sample_rate(sample_url) == 50
+
+    def test_adaptive_mode_raises_rate(self, sample_url, settings):
+        """Test the rate rises once a URL crosses a threshold"""
+        cache.clear()
+        settings.CLICK_SAMPLING_ADAPTIVE = True
+        settings.CLICK_SAMPLING_THRESHOLDS = [(3, 10)]
+        rates = [sample_rate(sample_url) for _ in range(4)]
+        assert rates == [1, 1, 10, 10]
+
+    def test_sampled_ingestion(self, sample_url):
+        """Test counters stay exact while stored rows carry the weight"""
+        sample_url.click_sample_rate = 10
+        sample_url.save()
+
+        for i in range(200):
+            track_click_async(sample_url.id, {'session_id': f'session-{i}'})
+
+        sample_url.refresh_from_db()
+        rows = Click.objects.filter(url=sample_url)
+        assert sample_url.clicks == 200
+        assert 0 < rows.count() < 200
+        assert set(rows.values_list('weight', flat=True)) == {10}
+        assert sample_url.unique_clicks == rows.count() * 10
+        total = sum(entry['count'] for entry in click_breakdown(sample_url)['clicks_by_date'])
+        assert total == rows.count() * 10
@@ -128,6 +128,25 @@ class TestURLListSerializer:
         assert 'title' in serializer.data
         assert 'clicks' in serializer.data
         assert 'created_at' in serializer.data
+    
+    def test_from_values_matches_serializer(self, sample_url, expired_url):
+        """Test the values() path gives the same output as the serializer"""
+        from django.utils import timezone
+        from datetime import timedelta
+        
+        URL.objects.create(
+            original_url='https://www.example.com/future',
+            short_code='future',
+            expires_at=timezone.now() + timedelta(days=1)
+        )
+        queryset = URL.objects.order_by('id')
+        
+        expected = URLListSerializer(queryset, many=True).data
+        rows = URLListSerializer.from_values(URLListSerializer.values(queryset))
+        
+        assert rows == expected
+        assert [list(row) for row in rows] == [list(row) for row in expected]
+        assert [row['is_expired'] for row in rows] == [False, True, False]
 
 
 @pytest.mark.django_db
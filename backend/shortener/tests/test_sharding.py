@@ -0,0 +1,358 @@
+"""
+Tests for sharded URL storage and resharding
+"""
+import zlib
+import pytest
+from datetime import timedelta
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from analytics.models import DailyAnalytics
+from config.sharding import (
+    MAX_SHARDS,
+    ShardRouter,
+    jump_hash,
+    on_shard,
+    shard_for_code,
+    shard_for_id,
+)
+from shortener.models import URL, Browser, Click, ScheduledExpiry, ShardSequence
+from shortener.resharding import Resharder
+
+
+def code_on(alias, prefix='code'):
+    """A short code that belongs on ``alias``"""
+    n = 0
+    while shard_for_code(f'{prefix}{n}') != alias:
+        n += 1
+    return f'{prefix}{n}'
+
+
+def create_on(alias, code, **fields):
+    with on_shard(alias):
+        return URL.objects.create(original_url=f'https://www.example.com/{code}', short_code=code, **fields)
+
+
+class queries_per_shard:
+    """Count the queries each shard receives inside the block"""
+
+    def __init__(self, aliases):
+        self.contexts = {alias: CaptureQueriesContext(connections[alias]) for alias in aliases}
+
+    def __enter__(self):
+        for context in self.contexts.values():
+            context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        for context in self.contexts.values():
+            context.__exit__(*exc_info)
+
+    def counts(self):
+        return {alias: len(context) for alias, context in self.contexts.items()}
+
+
+class TestShardMapping:
+    """Test mapping codes and ids to shards"""
+
+    def test_single_database(self):
+        """Test everything maps to default without shards"""
+        assert shard_for_code('abc123') == DEFAULT_DB_ALIAS
+        assert ShardRouter().db_for_read(URL) is None
+
+    def test_codes_spread_over_shards(self, shards):
+        """Test codes map stably onto every shard"""
+        placed = {shard_for_code(f'code{n}') for n in range(200)}
+
+        assert placed == set(shards)
+        assert shard_for_code('code7') == shard_for_code('code7')
+
+    def test_adding_a_shard_moves_few_codes(self):
+        """Test a new shard only takes codes, never shuffles the others"""
+        codes = [zlib.crc32(f'code{n}'.encode()) for n in range(3000)]
+
+        moved = [key for key in codes if jump_hash(key, 3) != jump_hash(key, 4)]
+
+        assert all(jump_hash(key, 4) == 3 for key in moved)
+        assert len(moved) < len(codes) / 3
+
+    def test_ids_carry_their_shard(self, shards):
+        """Test a URL id names the shard it was allocated on"""
+        assert shard_for_id(5 * MAX_SHARDS + 2) == 'shard_2'
+        assert shard_for_id(5 * MAX_SHARDS + 9) is None
+        assert shard_for_id('nope') is None
+
+
+@pytest.mark.django_db(databases='__all__')
+class TestShardRouter:
+    """Test routing sharded models"""
+
+    def test_routes_to_selected_shard(self, shards):
+        """Test sharded models follow on_shard and other models stay on default"""
+        from django.contrib.auth.models import User
+        router = ShardRouter()
+
+        with on_shard('shard_1'):
+            assert router.db_for_read(Click) == 'shard_1'
+            assert router.db_for_write(DailyAnalytics) == 'shard_1'
+            assert router.db_for_read(User) is None
+
+    def test_instance_wins(self, shards):
+        """Test related rows go to the database of the instance at hand"""
+        url = create_on('shard_2', code_on('shard_2'))
+
+        click = url.click_records.create()
+
+        assert click._state.db == 'shard_2'
+        assert Click.objects.using('shard_2').filter(url=url).exists()
+
+    def test_migrations(self, shards):
+        """Test shards only get the sharded tables"""
+        router = ShardRouter()
+
+        assert router.allow_migrate('shard_1', 'shortener', 'click') is True
+        assert router.allow_migrate('shard_1', 'analytics', 'dailyanalytics') is True
+        assert router.allow_migrate('shard_1', 'analytics', 'exportwatermark') is False
+        assert router.allow_migrate('shard_1', 'auth', 'user') is False
+        assert router.allow_migrate(DEFAULT_DB_ALIAS, 'auth', 'user') is None
+
+
+@pytest.mark.django_db(databases='__all__')
+class TestShardedURLs:
+    """Test URLs and their clicks live on the shard of their code"""
+
+    def test_create(self, api_client, shards):
+        """Test a new URL is stored on its code's shard with an id naming it"""
+        response = api_client.post(
+            reverse('url-list'),
+            {'original_url': 'https://www.example.com', 'custom_code': code_on('shard_1')},
+            format='json'
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        url = URL.objects.using('shard_1').get(short_code=response.data['short_code'])
+        assert shard_for_id(url.pk) == 'shard_1'
+        assert not URL.objects.using(DEFAULT_DB_ALIAS).exists()
+
+    def test_ids_start_above_existing(self, shards):
+        """Test allocated ids never reuse those of URLs from before sharding"""
+        legacy = URL(pk=1000, original_url='https://www.example.com', short_code='legacy1')
+        legacy.save(using=DEFAULT_DB_ALIAS)
+
+        url = create_on('shard_2', code_on('shard_2'))
+
+        assert url.pk > 1000
+        assert url.pk % MAX_SHARDS == 2
+
+    def test_id_blocks(self, shards):
+        """Test a block of ids for a bulk insert is never handed out again"""
+        ids = ShardSequence.next_ids('shard_1', 3)
+
+        assert [shard_for_id(pk) for pk in ids] == ['shard_1'] * 3
+        assert len(set(ids)) == 3
+        assert ShardSequence.next_id('shard_1') > max(ids)
+
+    def test_admin_create(self, admin_client, shards):
+        """Test a URL added in the admin is stored on its code's shard"""
+        response = admin_client.post(
+            reverse('admin:shortener_url_add'),
+            {'original_url': 'https://www.example.com', 'redirect_policy': URL.REDIRECT_TRACKING, 'is_active': 'on'}
+        )
+
+        assert response.status_code == 302
+        [url] = [url for alias in shards for url in URL.objects.using(alias).all()]
+        assert url._state.db == shard_for_code(url.short_code) == shard_for_id(url.pk)
+
+    def test_benchmark_serializers(self, shards):
+        """Test benchmark URLs are placed and numbered on their shard"""
+        from io import StringIO
+        out = StringIO()
+
+        call_command('benchmark_serializers', rows=20, runs=1, keep=True, stdout=out)
+
+        urls = URL.objects.using(DEFAULT_DB_ALIAS).all()
+        assert len(urls) == 20
+        assert {shard_for_code(url.short_code) for url in urls} == {DEFAULT_DB_ALIAS}
+        assert {shard_for_id(url.pk) for url in urls} == {DEFAULT_DB_ALIAS}
+        assert not URL.objects.using('shard_1').exists()
+
+    def test_redirect_hits_one_shard(self, api_client, shards):
+        """Test a redirect reads only its shard and clicks are stored there"""
+        code = code_on('shard_1')
+        create_on('shard_1', code)
+
+        with queries_per_shard(shards) as queries:
+            response = api_client.get(f'/{code}/', HTTP_USER_AGENT='Mozilla/5.0 Chrome/120.0')
+
+        assert response.status_code == status.HTTP_302_FOUND
+        counts = queries.counts()
+        assert counts['shard_1'] > 0
+        assert counts['default'] == counts['shard_2'] == 0
+        assert Click.objects.using('shard_1').count() == 1
+        assert Browser.objects.using('shard_1').exists()
+        assert URL.objects.using('shard_1').get(short_code=code).clicks == 1
+
+    def test_redirect_other_shards_not_asked(self, api_client, shards):
+        """Test a code stored on the wrong shard is not found outside resharding"""
+        code = code_on('shard_1')
+        create_on('shard_2', code)
+
+        assert api_client.get(f'/{code}/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_redirect_while_resharding(self, api_client, shards, settings):
+        """Test codes not moved yet are still found while resharding"""
+        settings.SHARD_RESHARDING = True
+        code = code_on('shard_1')
+        create_on('shard_2', code)
+
+        assert api_client.get(f'/{code}/').status_code == status.HTTP_302_FOUND
+
+    def test_detail_and_stats(self, api_client, shards):
+        """Test lookups by id and click stats run on the URL's shard"""
+        url = create_on('shard_2', code_on('shard_2'))
+        url.click_records.create(country='US')
+
+        detail = api_client.get(reverse('url-detail', kwargs={'pk': url.pk}))
+        stats = api_client.get(reverse('url-stats', kwargs={'pk': url.pk}))
+
+        assert detail.data['short_code'] == url.short_code
+        assert stats.data['clicks_by_country'] == {'US': 1}
+
+    def test_detail_of_moved_url(self, api_client, shards):
+        """Test URLs whose id names another shard are still found"""
+        code = code_on('shard_1')
+        url = URL(pk=5 * MAX_SHARDS + 2, original_url='https://www.example.com', short_code=code)
+        url.save(using='shard_1')
+
+        response = api_client.patch(
+            reverse('url-detail', kwargs={'pk': url.pk}),
+            {'title': 'Moved'},
+            format='json'
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert URL.objects.using('shard_1').get(pk=url.pk).title == 'Moved'
+
+    def test_list_merges_shards(self, api_client, shards):
+        """Test lists read every shard and page through the merged order"""
+        for n, alias in enumerate(['default', 'shard_1', 'shard_2', 'shard_1', 'default']):
+            create_on(alias, code_on(alias, prefix=f'l{n}x'), clicks=n)
+
+        response = api_client.get(reverse('url-list'), {'order_by': '-clicks', 'page_size': 2})
+        second = api_client.get(reverse('url-list'), {'order_by': '-clicks', 'page': 2})
+
+        assert response.data['count'] == 5
+        assert [url['clicks'] for url in response.data['results']] == [4, 3, 2, 1, 0]
+        assert second.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_search_merges_shards(self, api_client, shards):
+        """Test search matches on every shard"""
+        create_on('shard_1', code_on('shard_1'), title='Needle one')
+        create_on('shard_2', code_on('shard_2'), title='Needle two')
+        create_on(DEFAULT_DB_ALIAS, code_on(DEFAULT_DB_ALIAS), title='Hay')
+
+        response = api_client.get(reverse('url-list'), {'search': 'needle'})
+
+        assert sorted(url['title'] for url in response.data['results']) == ['Needle one', 'Needle two']
+
+    def test_popular(self, api_client, shards):
+        """Test popular URLs are the top of every shard merged"""
+        create_on('shard_1', code_on('shard_1'), clicks=5)
+        create_on('shard_2', code_on('shard_2'), clicks=9)
+        create_on(DEFAULT_DB_ALIAS, code_on(DEFAULT_DB_ALIAS), clicks=1)
+
+        response = api_client.get(reverse('url-popular'), {'limit': 2})
+
+        assert [url['clicks'] for url in response.data] == [9, 5]
+
+    def test_dashboard_sums_shards(self, api_client, shards):
+        """Test dashboard totals add up every shard"""
+        one = create_on('shard_1', code_on('shard_1'), clicks=3)
+        create_on('shard_2', code_on('shard_2'), clicks=4)
+        one.click_records.create()
+
+        response = api_client.get(reverse('dashboard-stats'))
+
+        assert response.data['total_urls'] == 2
+        assert response.data['total_clicks'] == 7
+        assert response.data['clicks_today'] == 1
+        assert [url['clicks'] for url in response.data['top_urls']] == [4, 3]
+
+    def test_expiry_on_every_shard(self, shards):
+        """Test due URLs are expired on every shard"""
+        from shortener.expiry import expire_due
+        past = timezone.now() - timedelta(minutes=5)
+        for alias in shards:
+            create_on(alias, code_on(alias, prefix='e'), expires_at=past)
+
+        assert expire_due() == 3
+        for alias in shards:
+            assert not ScheduledExpiry.objects.using(alias).exists()
+
+
+@pytest.mark.django_db(databases='__all__')
+class TestReshard:
+    """Test moving URLs to the shard their code belongs on"""
+
+    def test_moves_url_with_its_rows(self, shards, settings):
+        """Test a misplaced URL moves with its clicks, schedule and rollups"""
+        code = code_on('shard_2')
+        url = create_on('shard_1', code, expires_at=timezone.now() + timedelta(days=1))
+        with on_shard('shard_1'):
+            chrome = Browser.objects.create(name='Chrome')
+            Click.objects.create(url=url, browser=chrome, country='US')
+            Click.objects.create(url=url, browser=chrome)
+            DailyAnalytics.objects.create(url=url, date=timezone.now().date(), clicks=2)
+        created_at = url.created_at
+
+        assert Resharder().run() == {('shard_1', 'shard_2'): 1}
+
+        assert not URL.objects.using('shard_1').exists()
+        assert not Click.objects.using('shard_1').exists()
+        moved = URL.objects.using('shard_2').get(short_code=code)
+        assert moved.pk == url.pk
+        assert moved.created_at == created_at
+        clicks = Click.objects.using('shard_2').filter(url=moved)
+        assert clicks.count() == 2
+        assert set(clicks.values_list('browser__name', flat=True)) == {'Chrome'}
+        assert ScheduledExpiry.objects.using('shard_2').filter(url_id=url.pk).exists()
+        assert DailyAnalytics.objects.using('shard_2').get(url_id=url.pk).clicks == 2
+
+    def test_leaves_placed_urls(self, shards):
+        """Test URLs already on their shard are not touched"""
+        for alias in shards:
+            create_on(alias, code_on(alias))
+
+        assert Resharder().run() == {}
+
+    def test_dry_run(self, shards):
+        """Test a dry run only counts"""
+        create_on(DEFAULT_DB_ALIAS, code_on('shard_1'))
+
+        assert Resharder().run(dry_run=True) == {(DEFAULT_DB_ALIAS, 'shard_1'): 1}
+        assert URL.objects.using(DEFAULT_DB_ALIAS).exists()
+
+    def test_replaces_interrupted_copy(self, shards):
+        """Test rows left on the target by an interrupted run are replaced"""
+        code = code_on('shard_2')
+        url = create_on('shard_1', code, title='Source')
+        stale = URL(pk=url.pk, original_url='https://www.example.com', short_code=code, title='Stale')
+        stale.save(using='shard_2')
+
+        Resharder().run()
+
+        assert URL.objects.using('shard_2').get(pk=url.pk).title == 'Source'
+
+    def test_command(self, shards):
+        """Test the management command moves and reports"""
+        from io import StringIO
+        create_on(DEFAULT_DB_ALIAS, code_on('shard_1'))
+        out = StringIO()
+
+        call_command('reshard', stdout=out, stderr=StringIO())
+
+        assert 'default -> shard_1: 1 URLs' in out.getvalue()
+        assert URL.objects.using('shard_1').count() == 1
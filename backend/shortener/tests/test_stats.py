@@ -0,0 +1,50 @@
+"""
+Tests for per-URL click breakdowns
+"""
+import pytest
+from datetime import timedelta
+from django.utils import timezone
+from shortener.dimensions import click_dimensions
+from shortener.models import Click
+from shortener.stats import click_breakdown
+
+FIREFOX = 'Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0'
+
+
+@pytest.mark.django_db
+class TestClickBreakdown:
+    """Test click breakdown queries"""
+
+    def test_breakdown(self, sample_url):
+        """Test counts per country, device, browser and referer"""
+        for country, referer in [('US', 'https://google.com'), ('US', ''), ('DE', 'https://google.com')]:
+            Click.objects.create(
+                url=sample_url,
+                country=country,
+                **click_dimensions(FIREFOX, referer)
+            )
+
+        breakdown = click_breakdown(sample_url)
+
+        assert breakdown['clicks_by_country'] == {'US': 2, 'DE': 1}
+        assert breakdown['clicks_by_device'] == {'desktop': 3}
+        assert breakdown['clicks_by_browser'] == {'Firefox': 3}
+        assert breakdown['top_referrers'] == [{'referer': 'https://google.com', 'count': 2}]
+        assert [entry['count'] for entry in breakdown['clicks_by_date']] == [3]
+
+    def test_window(self, sample_url, sample_click):
+        """Test clicks older than the window are left out"""
+        Click.objects.filter(pk=sample_click.pk).update(
+            clicked_at=timezone.now() - timedelta(days=31)
+        )
+
+        assert click_breakdown(sample_url)['clicks_by_country'] == {}
+        assert click_breakdown(sample_url, days=60)['clicks_by_country'] == {'US': 1}
+
+    def test_timeout(self, sample_url, sample_click):
+        """Test breakdowns past the deadline are empty and flagged"""
+        breakdown = click_breakdown(sample_url, timeout=0)
+
+        assert breakdown.degraded
+        assert breakdown['clicks_by_country'] == {}
+        assert breakdown['clicks_by_date'] == []
@@ -28,7 +28,8 @@ class TestTrackClickTask:
         assert Click.objects.count() == initial_count + 1
         click = Click.objects.latest('clicked_at')
         assert click.ip_address == '192.168.1.1'
-        assert click.user_agent == 'Test Agent'
+        assert click.user_agent.value == 'Test Agent'
+        assert click.referer.url == 'https://google.com'
     
     def test_track_click_increments_url_clicks(self, sample_url):
         """Test that track_click increments URL clicks"""
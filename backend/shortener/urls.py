@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import URLViewSet, RedirectView, HealthCheckView
+from .views import URLViewSet, RedirectView, HealthCheckView, DatabaseHealthView
 
 router = DefaultRouter()
 router.register(r'urls', URLViewSet, basename='url')
@@ -8,4 +8,5 @@ router.register(r'urls', URLViewSet, basename='url')
 urlpatterns = [
     path('', include(router.urls)),
     path('health/', HealthCheckView.as_view(), name='health-check'),
+    path('health/db/', DatabaseHealthView.as_view(), name='health-check-db'),
 ]
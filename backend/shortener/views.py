@@ -1,27 +1,50 @@
 from rest_framework import viewsets, status, generics
+from rest_framework import serializers as drf_serializers
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.shortcuts import get_object_or_404, redirect
 from django.views import View
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Count, Q
+from django.db.models import Q
 from django.utils import timezone
-from django_ratelimit.decorators import ratelimit
-from django.utils.decorators import method_decorator
 import qrcode
 from io import BytesIO
-import hashlib
+import time
 
-from .models import URL, Click
+from config.routers import read_from_replica
+from config.sharding import (
+    MergedRows,
+    is_sharded,
+    on_shard,
+    select_shard,
+    shard_for_id,
+    shard_order,
+)
+from monitoring.metrics import qrcode_render_duration, redirect_phase_duration
+from .models import URL
+from .ratelimit import rate_limited, get_client_ip
+from .stats import click_breakdown
+from .bloom import code_may_be_taken
+from .cache import get_or_load_url, qrcode_cache_key, resolve_short_codes
+from .ingestion import visitor_session_id
+from .conditional import (
+    conditional,
+    url_freshness,
+    url_stats_freshness,
+    urls_freshness,
+)
 from .serializers import (
     URLCreateSerializer,
     URLSerializer,
     URLListSerializer,
     URLStatsSerializer,
+    URLResolveSerializer,
+    URLAvailabilitySerializer,
     ClickSerializer,
-    HealthCheckSerializer
+    HealthCheckSerializer,
+    DatabaseHealthSerializer
 )
 from .tasks import track_click_async, generate_qr_code_async
 
@@ -37,13 +60,18 @@ class URLViewSet(viewsets.ModelViewSet):
             return URLCreateSerializer
         elif self.action == 'list':
             return URLListSerializer
+        elif self.action == 'resolve':
+            return URLResolveSerializer
+        elif self.action == 'available':
+            return URLAvailabilitySerializer
         return URLSerializer
     
-    @method_decorator(ratelimit(
-        key='ip',
-        rate=f'{settings.RATE_LIMIT_PER_MINUTE}/m',
-        method='POST'
-    ))
+    def dispatch(self, request, *args, **kwargs):
+        # get_object() selects the shard of the requested URL
+        with on_shard(None):
+            return super().dispatch(request, *args, **kwargs)
+    
+    @rate_limited('create')
     def create(self, request, *args, **kwargs):
         """Create a new short URL"""
         serializer = self.get_serializer(data=request.data)
@@ -61,6 +89,7 @@ class URLViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
     
+    @read_from_replica
     def list(self, request, *args, **kwargs):
         """List all short URLs with pagination"""
         queryset = self.filter_queryset(self.get_queryset())
@@ -80,14 +109,35 @@ class URLViewSet(viewsets.ModelViewSet):
         if order_by in allowed_orders:
             queryset = queryset.order_by(order_by)
         
-        page = self.paginate_queryset(queryset)
+        # Read-only listing: build the response from .values() rows
+        rows = URLListSerializer.values(queryset)
+        if is_sharded():
+            # Every shard is read in parallel and the pages merged
+            rows = MergedRows(rows, order_by if order_by in allowed_orders else '-created_at')
+        page = self.paginate_queryset(rows)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(URLListSerializer.from_values(page))
         
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(URLListSerializer.from_values(rows))
     
+    def get_object(self):
+        """The requested URL, looked up once per request on its shard"""
+        if not hasattr(self, '_object'):
+            lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+            aliases = shard_order(shard_for_id(lookup))
+            for alias in aliases:
+                # The rest of the request (stats, clicks) runs there too
+                select_shard(alias)
+                try:
+                    self._object = super().get_object()
+                    break
+                except Http404:
+                    # Moved by resharding, or created before sharding
+                    if alias == aliases[-1]:
+                        raise
+        return self._object
+    
+    @conditional(url_freshness, 'url')
     def retrieve(self, request, *args, **kwargs):
         """Get details of a specific short URL"""
         instance = self.get_object()
@@ -115,141 +165,204 @@ class URLViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
     
     @action(detail=True, methods=['get'])
+    @rate_limited('stats')
+    @read_from_replica
+    @conditional(url_stats_freshness, 'url-stats')
     def stats(self, request, pk=None):
         """Get detailed statistics for a URL"""
         url = self.get_object()
         
-        # Get click data for last 30 days
-        thirty_days_ago = timezone.now() - timezone.timedelta(days=30)
-        clicks = Click.objects.filter(
-            url=url,
-            clicked_at__gte=thirty_days_ago
-        )
-        
-        # Clicks by date
-        clicks_by_date = clicks.values('clicked_at__date').annotate(
-            count=Count('id')
-        ).order_by('clicked_at__date')
-        
-        # Clicks by country
-        clicks_by_country = dict(
-            clicks.exclude(country__isnull=True)
-            .values('country')
-            .annotate(count=Count('id'))
-            .values_list('country', 'count')
-        )
-        
-        # Clicks by device
-        clicks_by_device = dict(
-            clicks.exclude(device_type__isnull=True)
-            .values('device_type')
-            .annotate(count=Count('id'))
-            .values_list('device_type', 'count')
-        )
-        
-        # Clicks by browser
-        clicks_by_browser = dict(
-            clicks.exclude(browser__isnull=True)
-            .values('browser')
-            .annotate(count=Count('id'))
-            .values_list('browser', 'count')
-        )
-        
-        # Top referrers
-        top_referrers = list(
-            clicks.exclude(referer__isnull=True)
-            .values('referer')
-            .annotate(count=Count('id'))
-            .order_by('-count')[:10]
-        )
-        
+        breakdown = click_breakdown(url, timeout=settings.QUERY_TIMEOUT_SECONDS)
         stats_data = {
             'total_clicks': url.clicks,
             'unique_clicks': url.unique_clicks,
             'last_accessed': url.last_accessed,
-            'clicks_by_date': list(clicks_by_date),
-            'clicks_by_country': clicks_by_country,
-            'clicks_by_device': clicks_by_device,
-            'clicks_by_browser': clicks_by_browser,
-            'top_referrers': top_referrers,
+            **breakdown,
+            'degraded': breakdown.degraded,
         }
         
         serializer = URLStatsSerializer(stats_data)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'], url_path='clicks/export')
+    @read_from_replica
+    def export_clicks(self, request, pk=None):
+        """Stream the raw clicks of a URL as CSV or NDJSON"""
+        from analytics.exports import (
+            iter_click_rows,
+            stream_csv,
+            stream_ndjson,
+            gzip_stream,
+        )
+        
+        url = self.get_object()
+        
+        export_as = request.query_params.get('as', 'csv')
+        if export_as not in ('csv', 'ndjson'):
+            raise ValidationError({'as': "Must be 'csv' or 'ndjson'"})
+        try:
+            after = int(request.query_params.get('after', 0))
+        except ValueError:
+            raise ValidationError({'after': "Must be a click id"})
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        
+        # Keyset on id: resumable with ?after=<last id> and ordered so the
+        # server-side cursor never has to sort more than the index gives it
+        fields = ClickSerializer.Meta.fields
+        clicks = url.click_records.filter(id__gt=after)
+        # The stream is consumed after the view returns, so bind the
+        # database chosen now rather than when the cursor opens
+        clicks = clicks.using(clicks.db)
+        rows = iter_click_rows(
+            clicks,
+            fields=fields,
+            chunk_size=settings.CLICK_EXPORT_CHUNK_SIZE
+        )
+        format_datetime = drf_serializers.DateTimeField().to_representation
+        if export_as == 'csv':
+            content = stream_csv(rows, fields, format_datetime)
+            content_type = 'text/csv'
+        else:
+            content = stream_ndjson(rows, fields, format_datetime)
+            content_type = 'application/x-ndjson'
+        
+        filename = f'{url.short_code}-clicks.{export_as}'
+        if compress:
+            content = gzip_stream(content)
+            content_type = 'application/gzip'
+            filename += '.gz'
+        
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
     @action(detail=True, methods=['get'])
     def qrcode(self, request, pk=None):
         """Generate and return QR code for the short URL"""
         url = self.get_object()
         
         # Check if QR code is cached
-        cache_key = f'qrcode_{url.short_code}'
+        cache_key = qrcode_cache_key(url.short_code)
         qr_image = cache.get(cache_key)
         
         if not qr_image:
             # Generate QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(url.get_short_url())
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            qr_image = buffer.getvalue()
+            with qrcode_render_duration.time(source='view'):
+                qr = qrcode.QRCode(
+                    version=1,
+                    error_correction=qrcode.constants.ERROR_CORRECT_L,
+                    box_size=10,
+                    border=4,
+                )
+                qr.add_data(url.get_short_url())
+                qr.make(fit=True)
+                
+                img = qr.make_image(fill_color="black", back_color="white")
+                buffer = BytesIO()
+                img.save(buffer, format='PNG')
+                qr_image = buffer.getvalue()
             
             # Cache for 1 hour
             cache.set(cache_key, qr_image, 3600)
         
         return HttpResponse(qr_image, content_type='image/png')
     
+    @action(detail=False, methods=['post'])
+    @rate_limited('resolve')
+    def resolve(self, request):
+        """Resolve many short codes to their destinations without recording clicks"""
+        data = request.data
+        if isinstance(data, list):
+            # NDJSON body: one code per line
+            data = {'codes': data}
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        codes = list(dict.fromkeys(serializer.validated_data['codes']))
+        
+        results = {}
+        for code, url in resolve_short_codes(codes).items():
+            if url is None:
+                results[code] = {'destination': None, 'status': 'not_found'}
+            elif not url.is_active:
+                results[code] = {'destination': None, 'status': 'inactive'}
+            elif url.is_expired():
+                results[code] = {'destination': None, 'status': 'expired'}
+            else:
+                results[code] = {'destination': url.original_url, 'status': 'active'}
+        
+        return Response({'results': results})
+    
     @action(detail=False, methods=['get'])
+    @rate_limited('available')
+    def available(self, request):
+        """Check whether a custom short code is free"""
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        code = serializer.validated_data['code']
+        
+        # The filter answers most lookups; only possible collisions hit the DB
+        if not code_may_be_taken(code):
+            return Response({'code': code, 'available': True, 'checked': 'filter'})
+        
+        taken = URL.code_taken(code)
+        return Response({'code': code, 'available': not taken, 'checked': 'database'})
+    
+    @action(detail=False, methods=['get'])
+    @read_from_replica
+    @conditional(urls_freshness, 'url-lists')
     def popular(self, request):
         """Get most popular URLs"""
         limit = int(request.query_params.get('limit', 10))
-        queryset = self.get_queryset().order_by('-clicks')[:limit]
-        serializer = URLListSerializer(
-            queryset,
-            many=True,
-            context={'request': request}
-        )
-        return Response(serializer.data)
+        queryset = self.get_queryset().order_by('-clicks')
+        rows = URLListSerializer.values(queryset)
+        if is_sharded():
+            rows = MergedRows(rows, '-clicks')
+        rows = rows[:limit]
+        return Response(URLListSerializer.from_values(rows))
     
     @action(detail=False, methods=['get'])
+    @read_from_replica
+    @conditional(urls_freshness, 'url-lists')
     def recent(self, request):
         """Get most recent URLs"""
         limit = int(request.query_params.get('limit', 10))
-        queryset = self.get_queryset().order_by('-created_at')[:limit]
-        serializer = URLListSerializer(
-            queryset,
-            many=True,
-            context={'request': request}
-        )
-        return Response(serializer.data)
+        queryset = self.get_queryset().order_by('-created_at')
+        rows = URLListSerializer.values(queryset)
+        if is_sharded():
+            rows = MergedRows(rows, '-created_at')
+        rows = rows[:limit]
+        return Response(URLListSerializer.from_values(rows))
 
 
 class RedirectView(View):
     """Handle URL redirects"""
     
+    @rate_limited('redirect')
     def get(self, request, short_code):
         """Redirect to original URL and track the click"""
         
-        # Try to get from cache first
-        cache_key = f'url_{short_code}'
-        url = cache.get(cache_key)
+        # Cached lookup; concurrent misses share a single database query
+        db_seconds = []
         
-        if not url:
-            url = get_object_or_404(
-                URL,
-                short_code=short_code,
-                is_active=True
-            )
-            # Cache for 1 hour
-            cache.set(cache_key, url, 3600)
+        def load():
+            started = time.perf_counter()
+            try:
+                # Only the code's own shard is asked
+                url = URL.find(short_code, is_active=True)
+                if url is None:
+                    raise Http404("No URL matches the given query.")
+                return url
+            finally:
+                db_seconds.append(time.perf_counter() - started)
+        
+        started = time.perf_counter()
+        url = get_or_load_url(short_code, load)
+        redirect_phase_duration.observe(
+            time.perf_counter() - started - sum(db_seconds),
+            phase='cache'
+        )
+        if db_seconds:
+            redirect_phase_duration.observe(sum(db_seconds), phase='db')
         
         # Check if expired
         if url.is_expired():
@@ -260,30 +373,29 @@ class RedirectView(View):
         
         # Track click asynchronously
         click_data = self.extract_click_data(request, url)
-        track_click_async.delay(url.id, click_data)
+        with redirect_phase_duration.time(phase='enqueue'):
+            track_click_async.delay(url.id, click_data)
         
-        # Redirect to original URL
-        return redirect(url.original_url)
+        # Redirect with the URL's status and cache policy
+        response = HttpResponseRedirect(url.original_url)
+        response.status_code = url.redirect_status()
+        response['Cache-Control'] = url.redirect_cache_control()
+        return response
     
     @staticmethod
     def extract_click_data(request, url):
         """Extract click data from request"""
-        # Get IP address
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip_address = x_forwarded_for.split(',')[0]
-        else:
-            ip_address = request.META.get('REMOTE_ADDR')
+        ip_address = get_client_ip(request)
         
-        # Generate session ID for unique visitor tracking
-        session_string = f"{ip_address}_{request.META.get('HTTP_USER_AGENT', '')}"
-        session_id = hashlib.md5(session_string.encode()).hexdigest()
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
         
         return {
             'ip_address': ip_address,
-            'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+            'user_agent': user_agent,
             'referer': request.META.get('HTTP_REFERER', ''),
-            'session_id': session_id,
+            # Session ID for unique visitor tracking
+            'session_id': visitor_session_id(ip_address, user_agent),
+            'requested_at': time.time(),
         }
 
 
@@ -297,3 +409,19 @@ class HealthCheckView(generics.GenericAPIView):
             'status': 'healthy',
             'timestamp': timezone.now().isoformat()
         })
+
+
+class DatabaseHealthView(generics.GenericAPIView):
+    """Database connection health and pool metrics"""
+    serializer_class = DatabaseHealthSerializer
+    
+    def get(self, request):
+        """Return per-database reachability and pgbouncer pool stats"""
+        from config.database import database_health
+        
+        health = database_health()
+        return Response(
+            health,
+            status=status.HTTP_200_OK if health['status'] == 'healthy'
+            else status.HTTP_503_SERVICE_UNAVAILABLE
+        )
@@ -81,7 +81,7 @@ export default function Dashboard() {
               <div>
                 <p className="text-sm text-gray-600 mb-1">{stat.title}</p>
                 <p className="text-3xl font-bold text-gray-900">
-                  {stat.value.toLocaleString()}
+                  {stat.value === null ? '—' : stat.value.toLocaleString()}
                 </p>
               </div>
               <div className={`p-3 rounded-full bg-${stat.color}-100`}>
@@ -36,18 +36,20 @@ export interface CreateURLPayload {
   expires_at?: string
 }
 
+// Figures are null when their query timed out (degraded)
 export interface DashboardStats {
-  total_urls: number
-  total_clicks: number
-  total_unique_visitors: number
-  clicks_today: number
-  clicks_this_week: number
+  total_urls: number | null
+  total_clicks: number | null
+  total_unique_visitors: number | null
+  clicks_today: number | null
+  clicks_this_week: number | null
   top_urls: Array<{
     short_code: string
     original_url: string
     clicks: number
     title?: string
   }>
+  degraded?: boolean
 }
 
 export interface URLStats {
@@ -59,6 +61,7 @@ export interface URLStats {
   clicks_by_device: Record<string, number>
   clicks_by_browser: Record<string, number>
   top_referrers: Array<{ referer: string; count: number }>
+  degraded?: boolean
 }
 
 // API methods
@@ -0,0 +1,27 @@
+#!/bin/sh
+# Reload nginx when the backend publishes a new edge redirect map.
+#
+# Runs next to nginx in its container (see docker-compose.yml). The map is
+# replaced atomically and only when it changes, so a reload is graceful
+# and infrequent; a map that fails `nginx -t` is left unloaded.
+
+EDGE_DIR=${EDGE_DIR:-/edge}
+INTERVAL=${EDGE_RELOAD_INTERVAL:-1}
+
+# nginx workers write the click logs
+mkdir -p "$EDGE_DIR/clicks"
+chown nginx "$EDGE_DIR/clicks"
+
+last=""
+while true; do
+    sleep "$INTERVAL"
+    current=$(cat "$EDGE_DIR"/redirects*.map 2>/dev/null | md5sum)
+    if [ "$current" != "$last" ]; then
+        if nginx -t -q; then
+            nginx -s reload
+        else
+            echo "edge-reload: keeping the previous map" >&2
+        fi
+        last=$current
+    fi
+done